@@ -0,0 +1,290 @@
+"""
+Headless HTTP API for the chatbot
+An ASGI app on top of llm_helpers: sessions, persona switching, chat with
+Server-Sent Events streaming, history and stats.
+
+Run with: python api_server.py [--host 127.0.0.1] [--port 8000]
+Uses uvicorn when it is installed, otherwise the built-in asyncio server.
+"""
+
+from collections import OrderedDict
+from config import MAX_REQUEST_BODY_BYTES
+from utils import llm_helpers
+from utils.message_history import as_dicts
+from utils.resilience import LLMError, LLMTimeoutError, RateLimitedError
+import argparse
+import asyncio
+import json
+import logging
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class SessionStore:
+    """ChatSessions by id, evicting the least recently used and idle ones
+
+    Each entry has its own asyncio.Lock so concurrent requests on one session
+    take turns, while different sessions run fully in parallel.
+    """
+
+    def __init__(self, max_sessions=1000, idle_timeout=3600):
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self._sessions = OrderedDict()  # id -> [ChatSession, asyncio.Lock, last used]
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def create(self, persona=None, user=None):
+        session_id = uuid.uuid4().hex
+        # The rate limiter shares capacity fairly between users (each session is its own user by default)
+        session = llm_helpers.ChatSession(persona=persona, user=user or session_id)
+        self._sessions[session_id] = [session, asyncio.Lock(), time.monotonic()]
+        while len(self._sessions) > self.max_sessions:
+            _, (evicted, _, _) = self._sessions.popitem(last=False)
+            evicted.close()
+        return session_id
+
+    def get(self, session_id):
+        """Return (session, lock) or raise a 404"""
+        entry = self._sessions.get(session_id)
+        if entry is None or time.monotonic() - entry[2] > self.idle_timeout:
+            self.delete(session_id)
+            raise HTTPError(404, f"Unknown session '{session_id}'")
+        entry[2] = time.monotonic()
+        self._sessions.move_to_end(session_id)
+        return entry[0], entry[1]
+
+    def delete(self, session_id):
+        entry = self._sessions.pop(session_id, None)
+        if entry is not None:
+            entry[0].close()
+        return entry is not None
+
+    def clear(self):
+        for session_id in list(self._sessions):
+            self.delete(session_id)
+
+
+def _error_status(error):
+    if isinstance(error, RateLimitedError):
+        return 429
+    if isinstance(error, LLMTimeoutError):
+        return 504
+    return 502
+
+
+async def _read_json(receive, max_size=MAX_REQUEST_BODY_BYTES):
+    body = b""
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            raise HTTPError(400, "Client disconnected")
+        body += message.get("body", b"")
+        if len(body) > max_size:
+            raise HTTPError(413, f"Request body is larger than {max_size} bytes")
+        if not message.get("more_body"):
+            break
+    if not body:
+        return {}
+    try:
+        data = json.loads(body)
+    except ValueError:
+        raise HTTPError(400, "Request body must be JSON")
+    if not isinstance(data, dict):
+        raise HTTPError(400, "Request body must be a JSON object")
+    return data
+
+
+async def _send_json(send, status, payload):
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+def _sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8")
+
+
+def _validate_persona(persona):
+    if persona not in llm_helpers.SYSTEM_PROMPTS:
+        available = ", ".join(llm_helpers.get_available_personas())
+        raise HTTPError(400, f"Invalid persona '{persona}'. Available: {available}")
+    return persona
+
+
+class ChatAPI:
+    """ASGI application
+
+    POST   /sessions                  {"persona", "user"}   create a session
+    DELETE /sessions/{id}                                   end a session
+    PUT    /sessions/{id}/persona     {"persona"}           switch persona (clears history)
+    POST   /sessions/{id}/chat        {"message", "stream"} reply as JSON, or SSE when stream is true
+    GET    /sessions/{id}/history                           message history
+    GET    /sessions/{id}/stats                             conversation stats
+    GET    /personas, /metrics, /health
+
+    All sessions share llm_helpers' per-event-loop AsyncOpenAI client, so
+    upstream connections are pooled and reused across requests. Unexpected
+    errors are logged and answered with a JSON 500.
+    """
+
+    def __init__(self, max_sessions=1000, idle_timeout=3600, max_body_size=MAX_REQUEST_BODY_BYTES):
+        self.sessions = SessionStore(max_sessions=max_sessions, idle_timeout=idle_timeout)
+        self.max_body_size = max_body_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+        try:
+            await self._route(scope, receive, send)
+        except HTTPError as e:
+            await _send_json(send, e.status, {"error": str(e)})
+        except LLMError as e:
+            await _send_json(send, _error_status(e), {"error": str(e)})
+        except Exception:
+            logger.exception("Unhandled error serving %s %s", scope["method"], scope["path"])
+            await _send_json(send, 500, {"error": "Internal server error"})
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self.sessions.clear()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _route(self, scope, receive, send):
+        method = scope["method"]
+        parts = [part for part in scope["path"].split("/") if part]
+
+        if parts == ["health"] and method == "GET":
+            await _send_json(send, 200, {"status": "ok", "sessions": len(self.sessions)})
+        elif parts == ["personas"] and method == "GET":
+            await _send_json(send, 200, {name: info["name"] for name, info in llm_helpers.SYSTEM_PROMPTS.items()})
+        elif parts == ["metrics"] and method == "GET":
+            body = llm_helpers.export_metrics().encode("utf-8")
+            await send({
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [(b"content-type", b"text/plain; version=0.0.4"), (b"content-length", str(len(body)).encode())],
+            })
+            await send({"type": "http.response.body", "body": body})
+        elif parts == ["sessions"] and method == "POST":
+            data = await _read_json(receive, self.max_body_size)
+            persona = _validate_persona(data.get("persona") or llm_helpers.default_persona())
+            user = data.get("user")
+            if user is not None and not isinstance(user, str):
+                raise HTTPError(400, "'user' must be a string")
+            session_id = self.sessions.create(persona, user)
+            await _send_json(send, 201, {"session_id": session_id, "persona": persona})
+        elif len(parts) >= 2 and parts[0] == "sessions":
+            await self._session_route(method, parts[1], parts[2:], receive, send)
+        else:
+            raise HTTPError(404, f"No route for {method} {scope['path']}")
+
+    async def _session_route(self, method, session_id, action, receive, send):
+        if action == [] and method == "DELETE":
+            if not self.sessions.delete(session_id):
+                raise HTTPError(404, f"Unknown session '{session_id}'")
+            await _send_json(send, 200, {"deleted": session_id})
+            return
+
+        session, lock = self.sessions.get(session_id)
+        if action == ["persona"] and method in ("PUT", "POST"):
+            persona = _validate_persona((await _read_json(receive, self.max_body_size)).get("persona"))
+            async with lock:
+                session.set_system_prompt(persona)
+            await _send_json(send, 200, {"session_id": session_id, "persona": persona})
+        elif action == ["chat"] and method == "POST":
+            data = await _read_json(receive, self.max_body_size)
+            message = data.get("message")
+            if not isinstance(message, str) or not message.strip():
+                raise HTTPError(400, "'message' must be a non-empty string")
+            if data.get("stream"):
+                await self._chat_stream(session, lock, message, send)
+            else:
+                async with lock:
+                    reply = await session.achat(message)
+                await _send_json(send, 200, {
+                    "reply": reply,
+                    "timing": session.get_last_response_timing(),
+                    "usage": session.get_last_usage(),
+                })
+        elif action == ["history"] and method == "GET":
+            await _send_json(send, 200, {
+                "persona": session.get_current_persona(),
+                "messages": as_dicts(session.get_conversation_history()),
+            })
+        elif action == ["stats"] and method == "GET":
+            await _send_json(send, 200, session.get_conversation_stats())
+        else:
+            raise HTTPError(404, f"No route for {method} /sessions/{session_id}/{'/'.join(action)}")
+
+    async def _chat_stream(self, session, lock, message, send):
+        """Stream the reply as SSE: "delta" events, then "done" (or "error")"""
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"content-type", b"text/event-stream"), (b"cache-control", b"no-cache")],
+        })
+        async with lock:
+            stream = session.achat_stream(message)
+            try:
+                async for delta in stream:
+                    await send({"type": "http.response.body", "body": _sse_event("delta", {"content": delta}), "more_body": True})
+                final = _sse_event("done", {
+                    "timing": session.get_last_response_timing(),
+                    "usage": session.get_last_usage(),
+                })
+            except LLMError as e:
+                # Headers are already sent, so failures are reported in-band
+                final = _sse_event("error", {"error": str(e), "status": _error_status(e)})
+            except Exception:
+                logger.exception("Unhandled error streaming a reply")
+                final = _sse_event("error", {"error": "Internal server error", "status": 500})
+            finally:
+                await stream.aclose()
+        await send({"type": "http.response.body", "body": final})
+
+
+app = ChatAPI()
+
+
+def serve(host="127.0.0.1", port=8000):
+    try:
+        import uvicorn
+    except ImportError:
+        from utils.asgi_server import ASGIServer
+        print(f"Serving on http://{host}:{port} (built-in server; install uvicorn for production)")
+        ASGIServer(app, host, port).serve_forever()
+    else:
+        uvicorn.run(app, host=host, port=port)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chatbot HTTP API server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+    try:
+        serve(args.host, args.port)
+    except KeyboardInterrupt:
+        print("\nServer stopped")
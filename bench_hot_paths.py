@@ -0,0 +1,147 @@
+"""
+Regression benchmarks for the chat hot paths (pytest-benchmark)
+Every case runs offline against the mock backend at conversation sizes from
+10 to 100k messages. `python bench_hot_paths.py` saves each run under
+.benchmarks/ and fails when a case got more than 25% slower than the last
+saved run; pass extra pytest options after it, e.g. -k context_window.
+"""
+
+import glob
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+from utils import llm_helpers
+
+SIZES = [10, 100, 1_000, 10_000, 100_000]
+# Allowed slowdown of the mean against the previous saved run
+REGRESSION_THRESHOLD = "mean:25%"
+
+
+def make_history(size):
+    """size alternating user/assistant messages of about 20 words each"""
+    return [
+        {"role": "user" if i % 2 == 0 else "assistant",
+         "content": f"Message {i} about budgets, forecasts and quarterly planning for the team offsite in spring"}
+        for i in range(size)
+    ]
+
+
+def make_session(size, **options):
+    session = llm_helpers.ChatSession("professional", **options)
+    session.message_history.extend(make_history(size))
+    return session
+
+
+@pytest.fixture(scope="module", autouse=True)
+def mock_backend():
+    server = llm_helpers.use_backend("mock")
+    yield server
+    llm_helpers.use_backend("api")
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_chat_overhead(benchmark, size):
+    """One chat() round trip against an instant local endpoint: everything but the model"""
+    history = make_history(size)
+    session = make_session(0)
+
+    def setup():
+        # Every round starts from size messages, not the previous rounds' replies on top
+        session.message_history[1:] = history
+        return ("What should we plan next?",), {}
+
+    benchmark.pedantic(session.chat, setup=setup, rounds=20)
+    assert len(session.message_history) == size + 3
+
+
+@pytest.mark.parametrize("packing", llm_helpers.HISTORY_PACKING_MODES)
+@pytest.mark.parametrize("size", SIZES)
+def test_context_window(benchmark, size, packing):
+    """Trimming the history to the prompt token budget"""
+    session = make_session(size, packing=packing)
+    window = benchmark(session.get_context_window)
+    assert window[0]["role"] == "system"
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_conversation_stats(benchmark, size):
+    session = make_session(size)
+    stats = benchmark(session.get_conversation_stats)
+    assert stats["total_messages"] == size
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_persona_switch(benchmark, size):
+    """set_system_prompt() on a conversation of size messages"""
+    history = make_history(size)
+    session = make_session(0)
+
+    def setup():
+        session.message_history[1:] = history
+        return ("creative",), {}
+
+    benchmark.pedantic(session.set_system_prompt, setup=setup, rounds=20)
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_save_snapshot(benchmark, size, tmp_path):
+    session = make_session(size)
+    path = str(tmp_path / "conversation.json")
+    benchmark.pedantic(session.save_conversation, args=(path,), rounds=5 if size >= 10_000 else 20)
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_load_snapshot(benchmark, size, tmp_path):
+    path = str(tmp_path / "conversation.json")
+    make_session(size).save_conversation(path)
+    session = llm_helpers.ChatSession()
+    benchmark.pedantic(session.load_conversation, args=(path,), rounds=5 if size >= 10_000 else 20)
+    assert len(session.message_history) == size + 1
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_journal_resume(benchmark, size, tmp_path):
+    """Resuming a JSON Lines journal reads only the tail the context window needs"""
+    path = str(tmp_path / "conversation.jsonl")
+    writer = make_session(size)
+    writer.save_conversation(path)
+    writer.close()
+    session = llm_helpers.ChatSession()
+
+    def resume():
+        session.load_conversation(path)
+        session.close()
+
+    benchmark.pedantic(resume, rounds=20)
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_streamlit_state_sync(benchmark, size):
+    """One script run of streamlit_app.py with size messages held in st.session_state"""
+    AppTest = pytest.importorskip("streamlit.testing.v1").AppTest
+    messages = make_history(size)
+    session = make_session(0)
+
+    def setup():
+        app = AppTest.from_file("streamlit_app.py", default_timeout=60)
+        app.session_state["chat_session"] = session
+        app.session_state["messages"] = messages
+        return (app,), {}
+
+    def run(app):
+        app.run()
+        assert not app.exception
+
+    benchmark.pedantic(run, setup=setup, rounds=5)
+
+
+if __name__ == "__main__":
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    options = ["--benchmark-autosave", "--benchmark-columns=mean,stddev,rounds"]
+    if glob.glob(os.path.join(".benchmarks", "*", "*.json")):
+        options += ["--benchmark-compare", f"--benchmark-compare-fail={REGRESSION_THRESHOLD}"]
+    sys.exit(pytest.main([__file__, "-q", "-p", "no:cacheprovider", *options, *sys.argv[1:]]))
@@ -0,0 +1,471 @@
+"""
+Performance Benchmarks for Custom ChatBot
+Runs against the local mock LLM server, so no API key or network is needed
+"""
+
+from utils import llm_helpers
+from utils.mock_server import MockLLMServer
+import asyncio
+import sys
+import time
+
+def _print_header(title):
+    print("\n" + "=" * 60)
+    print(title)
+    print("=" * 60)
+
+def benchmark_async_throughput(sync_requests=20, async_requests=200, latency=0.2):
+    """Compare requests/sec of the sync chat() against concurrent achat()"""
+    _print_header("ASYNC VS SYNC THROUGHPUT")
+    print(f"Mock endpoint latency: {latency * 1000:.0f} ms per request")
+
+    with MockLLMServer(latency=latency) as server:
+        llm_helpers.configure_client(base_url=server.base_url, api_key="benchmark")
+
+        start = time.perf_counter()
+        for i in range(sync_requests):
+            llm_helpers.ChatSession().chat(f"Question {i}")
+        sync_elapsed = time.perf_counter() - start
+
+        async def run_async():
+            sessions = [llm_helpers.ChatSession() for _ in range(async_requests)]
+            await asyncio.gather(*(s.achat(f"Question {i}") for i, s in enumerate(sessions)))
+
+        start = time.perf_counter()
+        asyncio.run(run_async())
+        async_elapsed = time.perf_counter() - start
+
+    sync_rps = sync_requests / sync_elapsed
+    async_rps = async_requests / async_elapsed
+    print(f"{'Mode':<10}{'Requests':>10}{'Seconds':>10}{'Req/sec':>10}")
+    print(f"{'sync':<10}{sync_requests:>10}{sync_elapsed:>10.2f}{sync_rps:>10.1f}")
+    print(f"{'async':<10}{async_requests:>10}{async_elapsed:>10.2f}{async_rps:>10.1f}")
+    print(f"Speedup: {async_rps / sync_rps:.1f}x")
+    return {"sync_rps": sync_rps, "async_rps": async_rps}
+
+def benchmark_summary_prompt_tokens(turns=200, max_prompt_tokens=2000):
+    """Prompt tokens for a long synthetic chat: full history vs window + rolling summary"""
+    from utils.token_counter import message_tokens
+
+    _print_header("ROLLING SUMMARY PROMPT TOKENS")
+
+    def stub_summarize(previous_summary, messages):
+        # Stand-in for the model: keep the last 100 words of everything seen
+        words = (previous_summary + " " + " ".join(m["content"] for m in messages)).split()
+        return " ".join(words[-100:])
+
+    reply = "Here is a detailed answer with several sentences of explanation. " * 8
+    session = llm_helpers.ChatSession("technical", max_prompt_tokens=max_prompt_tokens, summarize_fn=stub_summarize)
+    full_history_tokens = 0
+    with MockLLMServer(reply=reply) as server:
+        llm_helpers.configure_client(base_url=server.base_url, api_key="benchmark")
+        for turn in range(turns):
+            session.chat(f"Follow-up question number {turn} about the topic?")
+            # What an untrimmed request would have sent on this turn
+            full_history_tokens += sum(message_tokens(m) for m in session.message_history[:-1])
+            session.summarizer.wait()
+        sent_tokens = sum(message_tokens(m) for body in server.requests for m in body["messages"])
+
+    print(f"Turns: {turns}, prompt budget: {max_prompt_tokens} tokens")
+    print(f"{'Full history prompt tokens:':<34}{full_history_tokens:>12,}")
+    print(f"{'Window + summary prompt tokens:':<34}{sent_tokens:>12,}")
+    print(f"Reduction: {100 * (1 - sent_tokens / full_history_tokens):.1f}%")
+    return {"full_history_tokens": full_history_tokens, "summary_tokens": sent_tokens}
+
+def benchmark_journal(messages=100_000):
+    """Append, snapshot and resume costs for a very long conversation"""
+    import os
+    from utils.conversation_store import ConversationJournal, compact_journal, read_journal, read_journal_tail
+
+    _print_header("CONVERSATION JOURNAL")
+    history = [
+        {"role": "user" if i % 2 == 0 else "assistant", "content": f"Message {i}: " + "lorem ipsum " * 20}
+        for i in range(messages)
+    ]
+    path = "benchmark_journal.jsonl"
+    snapshot_path = "benchmark_snapshot.json"
+    try:
+        journal = ConversationJournal(path, "technical", fsync="never")
+        start = time.perf_counter()
+        for message in history:
+            journal.append(message)
+        append_elapsed = time.perf_counter() - start
+        journal.close()
+
+        # The old save_conversation() rewrote everything on every save
+        session = llm_helpers.ChatSession("technical")
+        session.message_history.extend(history)
+        start = time.perf_counter()
+        session.save_conversation(snapshot_path)
+        snapshot_elapsed = time.perf_counter() - start
+
+        start = time.perf_counter()
+        session.load_conversation(snapshot_path)
+        snapshot_load_elapsed = time.perf_counter() - start
+
+        start = time.perf_counter()
+        read_journal(path)
+        full_read_elapsed = time.perf_counter() - start
+
+        start = time.perf_counter()
+        _, tail = read_journal_tail(path, max_tokens=4000)
+        tail_elapsed = time.perf_counter() - start
+
+        start = time.perf_counter()
+        compact_journal(path)
+        compact_elapsed = time.perf_counter() - start
+    finally:
+        for leftover in (path, snapshot_path):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+
+    print(f"Conversation size: {messages:,} messages")
+    print(f"{'Journal append (per message)':<40}{append_elapsed / messages * 1e6:>10.1f} us")
+    print(f"{'JSON snapshot rewrite (per save)':<40}{snapshot_elapsed * 1000:>10.1f} ms")
+    print(f"{'JSON snapshot load':<40}{snapshot_load_elapsed * 1000:>10.1f} ms")
+    print(f"{'Journal full read':<40}{full_read_elapsed * 1000:>10.1f} ms")
+    print(f"{'Journal tail resume (' + str(len(tail)) + ' messages)':<40}{tail_elapsed * 1000:>10.1f} ms")
+    print(f"{'Journal compaction':<40}{compact_elapsed * 1000:>10.1f} ms")
+    return {
+        "append_us": append_elapsed / messages * 1e6,
+        "snapshot_ms": snapshot_elapsed * 1000,
+        "tail_resume_ms": tail_elapsed * 1000,
+    }
+
+def benchmark_prompt_caching(turns=100, max_prompt_tokens=2000, prefill_delay=0.0001):
+    """Provider prefix-cache hits and latency: sliding vs stable history packing"""
+    _print_header("PROMPT PREFIX CACHING")
+    print(f"Mock prefill cost: {prefill_delay * 1e6:.0f} us per uncached prompt token")
+    print(f"{'Packing':<10}{'Prompt tok':>12}{'Cached':>10}{'Hit rate':>10}{'Seconds':>10}")
+    results = {}
+    reply = "A reasonably detailed answer with a few words " * 6
+    for packing in llm_helpers.HISTORY_PACKING_MODES:
+        with MockLLMServer(reply=reply, prompt_cache=True, prefill_delay=prefill_delay) as server:
+            llm_helpers.configure_client(base_url=server.base_url, api_key="benchmark")
+            session = llm_helpers.ChatSession("technical", max_prompt_tokens=max_prompt_tokens, packing=packing)
+            start = time.perf_counter()
+            for turn in range(turns):
+                session.chat(f"Follow-up question number {turn} about the topic?")
+            elapsed = time.perf_counter() - start
+        stats = session.get_conversation_stats()
+        hit_rate = stats["cached_tokens"] / stats["prompt_tokens"]
+        print(f"{packing:<10}{stats['prompt_tokens']:>12,}{stats['cached_tokens']:>10,}{hit_rate:>10.1%}{elapsed:>10.2f}")
+        results[packing] = {"hit_rate": hit_rate, "seconds": elapsed}
+    return results
+
+def _import_times(statement, runs=5):
+    """Best-of-runs `python -X importtime` cumulative microseconds per top-level import"""
+    import subprocess
+    import sys
+
+    best = {}
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-X", "importtime", "-c", statement],
+                                capture_output=True, text=True, check=True).stderr
+        times = {}
+        for line in output.splitlines():
+            if not line.startswith("import time:") or "|" not in line:
+                continue
+            _, cumulative, name = line.split("|")
+            # Top-level imports are the ones indented by a single space
+            if cumulative.strip().isdigit() and name.startswith(" ") and not name.startswith("  "):
+                times[name.strip()] = int(cumulative)
+        best = {name: min(us, best.get(name, us)) for name, us in times.items()}
+    return best
+
+def benchmark_import_time():
+    """Cold import cost of utils.llm_helpers and whether it pulls in the openai SDK"""
+    import subprocess
+    import sys
+
+    _print_header("IMPORT TIME")
+    helpers_us = _import_times("import utils.llm_helpers").get("utils.llm_helpers", 0)
+    openai_us = _import_times("import openai").get("openai", 0)
+    check = "import sys, utils.llm_helpers as h; h.ChatSession('technical'); print('openai' in sys.modules)"
+    imports_openai = subprocess.run([sys.executable, "-c", check], capture_output=True, text=True, check=True).stdout.strip()
+
+    nested = _import_times("import utils.llm_helpers as h; h.get_client()")
+    print(f"{'import utils.llm_helpers':<40}{helpers_us / 1000:>10.1f} ms")
+    print(f"{'import openai (deferred to first call)':<40}{openai_us / 1000:>10.1f} ms")
+    print(f"{'openai imported before first call':<40}{imports_openai:>10}")
+    slowest = sorted(nested.items(), key=lambda item: -item[1])[:5]
+    print("Slowest imports including the first client:")
+    for name, us in slowest:
+        print(f"   {name:<37}{us / 1000:>10.1f} ms")
+    return {"llm_helpers_ms": helpers_us / 1000, "openai_ms": openai_us / 1000}
+
+def benchmark_streamlit_render(sizes=(10, 100, 1000, 5000), runs=3):
+    """Script run time of streamlit_app.py as the conversation grows: paged view vs every message"""
+    _print_header("STREAMLIT RENDER TIME")
+    try:
+        from streamlit.testing.v1 import AppTest
+    except ImportError:
+        print("Streamlit is not installed; run `pip install -r requirements.txt` first")
+        return None
+    import logging
+    # AppTest writes session_state from the main thread, which logs a missing-ScriptRunContext warning each time
+    logging.getLogger("streamlit.runtime.scriptrunner_utils.script_run_context").addFilter(lambda record: False)
+
+    def run_app(session, messages, visible):
+        best = float("inf")
+        for _ in range(runs):
+            app = AppTest.from_file("streamlit_app.py", default_timeout=120)
+            app.session_state["chat_session"] = session
+            app.session_state["messages"] = messages
+            if visible is not None:
+                app.session_state["visible_messages"] = visible
+            start = time.perf_counter()
+            app.run()
+            best = min(best, time.perf_counter() - start)
+        return best, len(app.chat_message)
+
+    results = {}
+    print(f"{'Messages':>10}{'Paged ms':>10}{'Shown':>8}{'All ms':>10}{'Shown':>8}")
+    for size in sizes:
+        session = llm_helpers.ChatSession("professional")
+        messages = []
+        for i in range(size):
+            role = "user" if i % 2 == 0 else "assistant"
+            message = {"role": role, "content": f"Message {i} " + "lorem ipsum " * 20}
+            session.message_history.append(dict(message))
+            if role == "assistant":
+                message.update(timestamp="12:00:00", persona="Professional Assistant")
+            messages.append(message)
+        paged, paged_shown = run_app(session, messages, None)
+        full, full_shown = run_app(session, messages, size)
+        results[size] = {"paged": paged, "all": full}
+        print(f"{size:>10}{paged * 1000:>10.1f}{paged_shown:>8}{full * 1000:>10.1f}{full_shown:>8}")
+    return results
+
+def benchmark_rate_limit(requests=100, quota=(20, 1.0)):
+    """A burst against a provider quota, with and without the client-side rate limiter"""
+    from utils.resilience import LLMError
+
+    _print_header("RATE LIMITER")
+    limit, window = quota
+    print(f"Mock provider quota: {limit} requests per {window:.0f}s; {requests} concurrent requests")
+
+    async def burst():
+        sessions = [llm_helpers.ChatSession("technical") for _ in range(requests)]
+        results = await asyncio.gather(*(session.achat(f"Question {i}") for i, session in enumerate(sessions)),
+                                       return_exceptions=True)
+        return sum(isinstance(result, LLMError) for result in results)
+
+    results = {}
+    # Just under the quota: 95% of it, with bursts of at most a quarter window
+    for label, per_minute in (("No limiter", None), ("Token bucket", limit * 60 / window * 0.95)):
+        if per_minute:
+            llm_helpers.enable_rate_limit(requests_per_minute=per_minute, burst_seconds=window / 4)
+        with MockLLMServer(latency=0.02, quota=quota) as server:
+            llm_helpers.configure_client(base_url=server.base_url, api_key="benchmark")
+            start = time.perf_counter()
+            failed = asyncio.run(burst())
+            elapsed = time.perf_counter() - start
+        llm_helpers.disable_rate_limit()
+        results[label] = {"failed": failed, "rejected": server.rejected, "elapsed": elapsed}
+        print(f"{label:<14} {requests - failed:>4} ok {failed:>4} failed {server.rejected:>5} upstream 429s "
+              f"{elapsed:>6.2f}s  {(requests - failed) / elapsed:>5.1f} ok/s")
+    return results
+
+# Paraphrases of persona_test.TEST_QUESTIONS, in the same order, and questions that must not match them
+PARAPHRASES = [
+    ["how to start a business", "How can I start my own business?",
+     "What are the steps to starting a business?", "how to start a company"],
+    ["Write a short story about a robot that discovers emotions", "Tell me a short story of a robot discovering feelings",
+     "short story: a robot discovers its emotions", "Can you write a story about a robot learning emotions?"],
+    ["How does machine learning work?", "Explain machine learning to me",
+     "Can you explain how machine learning works?", "what is machine learning and how does it work"],
+    ["What is the best way to manage a team?", "How should I manage my team?",
+     "best ways to manage a team", "Tips for managing a team well"],
+    ["How can I overcome creative blocks?", "How do I get past a creative block?",
+     "solving creative block", "ways to solve a creative block"],
+]
+UNRELATED_QUESTIONS = [
+    "How do I bake sourdough bread?", "Write a poem about the ocean", "Explain how vaccines work",
+    "What's the best way to learn guitar?", "How do I fix a flat tire?", "Explain how blockchain works",
+    "How do I start a podcast?", "Write a short story about a dragon", "What is the capital of France?",
+    "How do I manage my time better?",
+]
+NEAR_MISSES = [
+    ("Is Python faster than Java?", "Is Java faster than Python?"),
+    ("Write a short story about a dog", "Write a short poem about a dog"),
+    ("Why does my code work?", "Why does my code fail?"),
+    ("Convert celsius to fahrenheit", "Convert fahrenheit to celsius"),
+    ("Should I buy a house?", "Should I not buy a house?"),
+    ("How do I start a business?", "How do I start a podcast?"),
+    ("Explain how machine learning works", "Explain how machine learning fails"),
+    ("What is the best way to manage a team?", "What is the worst way to manage a team?"),
+]
+
+def _semantic_hit_rates(make_cache):
+    """(hit rate, correct hits, false hits, look-alike hits) of the caches make_cache() builds"""
+    from persona_test import TEST_QUESTIONS
+
+    cache = make_cache()
+    for question in TEST_QUESTIONS:
+        cache.store("professional", question, question)
+    hits = correct = 0
+    for original, group in zip(TEST_QUESTIONS, PARAPHRASES):
+        for paraphrase in group:
+            match = cache.lookup("professional", paraphrase)
+            hits += match is not None
+            correct += match is not None and match[0] == original
+    false_hits = sum(cache.lookup("professional", q) is not None for q in UNRELATED_QUESTIONS)
+    # Each look-alike is asked against a cache holding only its partner, so any hit is a wrong answer
+    wrong = 0
+    for cached, asked in NEAR_MISSES:
+        cache = make_cache()
+        cache.store("professional", cached, cached)
+        wrong += cache.lookup("professional", asked) is not None
+    return hits / sum(len(group) for group in PARAPHRASES), correct, false_hits, wrong
+
+def benchmark_semantic_cache(thresholds=(0.8, 0.85, 0.9, 0.95), index_sizes=(1_000, 10_000, 100_000), dimensions=384):
+    """Hit rate on paraphrased persona_test questions, wrong answers on look-alikes, and index search latency"""
+    import numpy as np
+    from persona_test import TEST_QUESTIONS
+    from utils.semantic_cache import BruteForceIndex, HNSWIndex, SemanticCache, local_embedder
+
+    _print_header("SEMANTIC CACHE")
+    paraphrases = [p for group in PARAPHRASES for p in group]
+    print(f"{len(TEST_QUESTIONS)} cached questions, {len(paraphrases)} paraphrases, {len(UNRELATED_QUESTIONS)} unrelated, "
+          f"{len(NEAR_MISSES)} look-alike pairs")
+    print(f"{'Matching':>22}{'Hit rate':>10}{'Correct':>10}{'False hits':>12}{'Look-alikes':>13}")
+    results = {"matching": {}}
+    rows = [("content words", lambda: SemanticCache())]
+    try:
+        embed = local_embedder()
+        rows += [(f"model >= {threshold:.2f}", lambda threshold=threshold: SemanticCache(threshold=threshold, embed_fn=embed))
+                 for threshold in thresholds]
+    except ValueError as e:
+        print(f"({e}; skipping the embedding model)")
+    for label, make_cache in rows:
+        hit_rate, correct, false_hits, wrong = _semantic_hit_rates(make_cache)
+        results["matching"][label] = {"hit_rate": hit_rate, "correct": correct, "false_hits": false_hits,
+                                      "look_alike_hits": wrong}
+        print(f"{label:>22}{hit_rate:>10.0%}{correct:>10}{false_hits:>12}{wrong:>13}")
+
+    # End to end through ChatSession with the default content-word matching: upstream calls saved per persona
+    llm_helpers.enable_semantic_cache()
+    with MockLLMServer(latency=0.05) as server:
+        llm_helpers.configure_client(base_url=server.base_url, api_key="benchmark")
+        personas = llm_helpers.get_available_personas()
+        start = time.perf_counter()
+        for persona in personas:
+            for question in TEST_QUESTIONS + paraphrases + UNRELATED_QUESTIONS:
+                llm_helpers.ChatSession(persona).chat(question)
+        elapsed = time.perf_counter() - start
+    stats = llm_helpers.semantic_cache.stats()
+    llm_helpers.disable_semantic_cache()
+    asked = len(personas) * (len(TEST_QUESTIONS) + len(paraphrases) + len(UNRELATED_QUESTIONS))
+    print(f"\nChatSession, {len(personas)} personas: {asked} questions -> {server.request_count} upstream calls "
+          f"in {elapsed:.2f}s, hit rate {stats['semantic_hit_rate']:.0%}, "
+          f"{stats['semantic_avg_lookup_ms']:.2f} ms per lookup")
+    results["chat"] = {"asked": asked, "upstream": server.request_count, **stats}
+
+    # Vector search as the index grows (random unit vectors of an embedding model's size): NumPy vs HNSW
+    backends = [("NumPy brute force", BruteForceIndex)]
+    try:
+        import hnswlib  # noqa: F401
+        backends.append(("HNSW (hnswlib)", HNSWIndex))
+    except ImportError:
+        print("(hnswlib not installed; skipping the ANN backend)")
+    rng = np.random.default_rng(0)
+    queries = rng.standard_normal((100, dimensions), dtype=np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    print(f"\n{'Entries':>10}" + "".join(f"{name + ' ms':>24}" for name, _ in backends))
+    results["search_ms"] = {}
+    for size in index_sizes:
+        vectors = rng.standard_normal((size, dimensions), dtype=np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        row = []
+        for name, factory in backends:
+            index = factory(dimensions, size)
+            for slot, vector in enumerate(vectors):
+                index.set(slot, vector)
+            start = time.perf_counter()
+            for query in queries:
+                index.search(query, k=3)
+            row.append(1000 * (time.perf_counter() - start) / len(queries))
+        results["search_ms"][size] = dict(zip((name for name, _ in backends), row))
+        print(f"{size:>10}" + "".join(f"{ms:>24.3f}" for ms in row))
+    return results
+
+def benchmark_history_memory(messages=100_000):
+    """Memory per message and stats/history cost: list of dicts vs MessageHistory"""
+    import json
+    import tracemalloc
+    from utils.message_history import MessageHistory
+
+    _print_header("HISTORY MEMORY")
+    # Serialized and parsed back, like a conversation loaded from a file
+    text = json.dumps([
+        {"role": "user" if i % 2 == 0 else "assistant", "content": f"Message {i}: " + "lorem ipsum " * 20}
+        for i in range(messages)
+    ])
+
+    def traced(build):
+        tracemalloc.start()
+        value = build()
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        return value, size
+
+    dicts, dict_bytes = traced(lambda: json.loads(text))
+    history, history_bytes = traced(lambda: MessageHistory(json.loads(text)))
+    content_bytes = sum(sys.getsizeof(m["content"]) for m in dicts)
+
+    def timed(fn, runs=20):
+        start = time.perf_counter()
+        for _ in range(runs):
+            fn()
+        return (time.perf_counter() - start) / runs * 1000
+
+    # What get_conversation_stats() and get_conversation_history() did before
+    scan_ms = timed(lambda: (len([m for m in dicts if m["role"] == "user"]),
+                             len([m for m in dicts if m["role"] == "assistant"])))
+    counts_ms = timed(lambda: (history.role_count("user"), history.role_count("assistant")))
+    copy_ms = timed(dicts.copy)
+    view_ms = timed(history.view)
+
+    print(f"Conversation size: {messages:,} messages ({content_bytes / messages:.0f} bytes of content each)")
+    print(f"{'':<28}{'list of dicts':>16}{'MessageHistory':>16}")
+    print(f"{'Bytes per message':<28}{dict_bytes / messages:>16.0f}{history_bytes / messages:>16.0f}")
+    print(f"{'  excluding content':<28}{(dict_bytes - content_bytes) / messages:>16.0f}"
+          f"{(history_bytes - content_bytes) / messages:>16.0f}")
+    print(f"{'Role counts (ms)':<28}{scan_ms:>16.3f}{counts_ms:>16.4f}")
+    print(f"{'get_conversation_history':<28}{copy_ms:>13.3f} ms{view_ms:>13.4f} ms")
+    return {
+        "dict_bytes_per_message": dict_bytes / messages,
+        "history_bytes_per_message": history_bytes / messages,
+        "scan_ms": scan_ms,
+        "counts_ms": counts_ms,
+    }
+
+BENCHMARKS = {
+    "1": ("Async vs sync throughput", benchmark_async_throughput),
+    "2": ("Rolling summary prompt tokens", benchmark_summary_prompt_tokens),
+    "3": ("Conversation journal (100k messages)", benchmark_journal),
+    "4": ("Prompt prefix caching (sliding vs stable packing)", benchmark_prompt_caching),
+    "5": ("Import time", benchmark_import_time),
+    "6": ("Streamlit render time", benchmark_streamlit_render),
+    "7": ("Client-side rate limiter vs provider quota", benchmark_rate_limit),
+    "8": ("Semantic cache on paraphrased questions", benchmark_semantic_cache),
+    "9": ("History memory and stats (100k messages)", benchmark_history_memory),
+}
+
+if __name__ == "__main__":
+    print("ChatBot Benchmark Suite")
+    print("Choose a benchmark:")
+    for key, (title, _) in BENCHMARKS.items():
+        print(f"{key}. {title}")
+    print("a. Run all")
+
+    choice = input("\nEnter choice: ").strip().lower()
+
+    if choice == "a":
+        for _, benchmark in BENCHMARKS.values():
+            benchmark()
+    elif choice in BENCHMARKS:
+        BENCHMARKS[choice][1]()
+    else:
+        print("Invalid choice")
@@ -1,12 +1,90 @@
-from dotenv import load_dotenv
+import json
 import os
 
-load_dotenv()
+
+def _load_env_file():
+    """Load the nearest .env (this directory or a parent) into os.environ
+
+    python-dotenv is only imported when a .env file exists, which keeps
+    imports fast for deployments that configure the environment directly.
+    """
+    directory = os.path.dirname(os.path.abspath(__file__))
+    while True:
+        path = os.path.join(directory, ".env")
+        if os.path.isfile(path):
+            from dotenv import load_dotenv
+            load_dotenv(path)
+            return
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            return
+        directory = parent
+
+
+_load_env_file()
 
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 OPEN_ROUTER_API_KEY = os.getenv("OPEN_ROUTER_KEY")
 
 OPEN_ROUTER_BASE_URL = "https://openrouter.ai/api/v1"
+GEMINI_BASE_URL = "https://generativelanguage.googleapis.com/v1beta/openai/"
+
+# Where requests go: "api" (OPEN_ROUTER_BASE_URL) or "mock" (a local mock server, no network or key needed)
+LLM_BACKEND = os.getenv("LLM_BACKEND", "api")
+# JSON options for the backend, e.g. {"latency": 0.3, "tokens_per_second": 40, "error_rate": 0.05} for "mock"
+LLM_BACKEND_OPTIONS = json.loads(os.getenv("LLM_BACKEND_OPTIONS") or "{}")
 
 DEFAULT_GEMINI_MODEL = "gemini-2.5-flash"
 DEFAULT_OPENAI_MODEL = "openai/gpt-4o"
+
+# Upper bound on in-flight requests for the async chat API
+MAX_CONCURRENT_REQUESTS = int(os.getenv("MAX_CONCURRENT_REQUESTS", "100"))
+
+# Optional SQLite file for the response cache; the cache is disabled when unset
+RESPONSE_CACHE_DB = os.getenv("RESPONSE_CACHE_DB")
+
+# First-turn questions reuse answers to questions with the same content words (off unless set)
+SEMANTIC_CACHE = os.getenv("SEMANTIC_CACHE", "").lower() in ("1", "true", "yes")
+# Optional local sentence-transformers model; paraphrases at or above this cosine similarity hit too
+SEMANTIC_CACHE_MODEL = os.getenv("SEMANTIC_CACHE_MODEL")
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.9"))
+
+# Prompt token budget for the context window sent with each request
+MAX_PROMPT_TOKENS = int(os.getenv("MAX_PROMPT_TOKENS", "4000"))
+
+# Fold messages evicted from the context window into a running summary
+SUMMARIZE_HISTORY = os.getenv("SUMMARIZE_HISTORY", "").lower() in ("1", "true", "yes")
+
+# SQLite database for saved conversations and persona test results
+CONVERSATION_DB_PATH = os.getenv("CONVERSATION_DB", "conversations.db")
+# Persona test runs are indexed in the database only when it is named explicitly
+CONVERSATION_DB_CONFIGURED = bool(os.getenv("CONVERSATION_DB"))
+
+# Resilience: per-attempt timeout, overall deadline (seconds) and attempts per request
+REQUEST_TIMEOUT = float(os.getenv("REQUEST_TIMEOUT", "30"))
+TOTAL_REQUEST_TIMEOUT = float(os.getenv("TOTAL_REQUEST_TIMEOUT", "60"))
+MAX_REQUEST_ATTEMPTS = int(os.getenv("MAX_REQUEST_ATTEMPTS", "3"))
+
+# Route requests across OpenRouter and Gemini by observed latency/errors
+PROVIDER_ROUTING = os.getenv("PROVIDER_ROUTING", "").lower() in ("1", "true", "yes")
+# Also call the next-best provider when the first has not answered within this many seconds
+HEDGE_AFTER_SECONDS = float(os.getenv("HEDGE_AFTER_SECONDS", "2.0"))
+
+# History packing: "sliding" trims one message at a time, "stable" keeps the
+# prompt prefix byte-identical between window jumps so providers can cache it
+HISTORY_PACKING = os.getenv("HISTORY_PACKING", "sliding")
+
+# Directory of persona definitions (one .yaml/.yml/.json file per persona)
+PERSONAS_DIR = os.getenv("PERSONAS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "personas"))
+
+# Concurrent identical requests share one upstream call (and one stream). Off by default:
+# at temperature > 0 callers would silently share one sampled reply
+COALESCE_REQUESTS = os.getenv("COALESCE_REQUESTS", "false").lower() in ("1", "true", "yes")
+
+# Client-side rate limit (0 = off); bursts are capped at RATE_LIMIT_BURST_SECONDS worth of quota
+RATE_LIMIT_RPM = int(os.getenv("RATE_LIMIT_RPM", "0"))
+RATE_LIMIT_TPM = int(os.getenv("RATE_LIMIT_TPM", "0"))
+RATE_LIMIT_BURST_SECONDS = float(os.getenv("RATE_LIMIT_BURST_SECONDS", "10"))
+
+# Largest request body the HTTP API accepts (bytes); larger requests get a 413
+MAX_REQUEST_BODY_BYTES = int(os.getenv("MAX_REQUEST_BODY_BYTES", str(1024 * 1024)))
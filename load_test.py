@@ -0,0 +1,89 @@
+"""
+Load test for the HTTP API server (api_server.py)
+Runs the API against the local mock LLM server and reports throughput and
+latency percentiles at several concurrency levels. No API key needed.
+
+Usage: python load_test.py [--concurrency 1,10,50,100] [--requests 20] [--latency 0.05] [--stream]
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from http.client import HTTPConnection
+from urllib.parse import urlsplit
+from utils import llm_helpers
+from utils.asgi_server import ASGIServer
+from utils.mock_server import MockLLMServer
+import api_server
+import argparse
+import json
+import time
+
+
+def _percentile(sorted_values, p):
+    return sorted_values[min(len(sorted_values) - 1, int(p * len(sorted_values)))]
+
+
+def _request(conn, method, path, payload=None):
+    body = json.dumps(payload).encode("utf-8") if payload is not None else None
+    headers = {"Content-Type": "application/json"} if body else {}
+    conn.request(method, path, body=body, headers=headers)
+    response = conn.getresponse()
+    data = response.read()
+    if response.status >= 400:
+        raise RuntimeError(f"{method} {path} -> {response.status}: {data.decode('utf-8', 'replace')}")
+    return data
+
+
+def _client(base_url, requests_per_client, stream):
+    """One simulated user: a session plus sequential chats on a keep-alive connection"""
+    address = urlsplit(base_url)
+    conn = HTTPConnection(address.hostname, address.port, timeout=60)
+    session_id = json.loads(_request(conn, "POST", "/sessions", {"persona": "technical"}))["session_id"]
+    latencies = []
+    for i in range(requests_per_client):
+        start = time.perf_counter()
+        _request(conn, "POST", f"/sessions/{session_id}/chat", {"message": f"Question {i}", "stream": stream})
+        latencies.append(time.perf_counter() - start)
+    _request(conn, "DELETE", f"/sessions/{session_id}")
+    conn.close()
+    return latencies
+
+
+def run_level(base_url, concurrency, requests_per_client, stream=False):
+    """Run `concurrency` clients at once; returns throughput and latency percentiles"""
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [pool.submit(_client, base_url, requests_per_client, stream) for _ in range(concurrency)]
+        latencies = sorted(latency for future in futures for latency in future.result())
+    elapsed = time.perf_counter() - start
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "throughput": len(latencies) / elapsed,
+        "p50": _percentile(latencies, 0.50),
+        "p99": _percentile(latencies, 0.99),
+    }
+
+
+def run_load_test(levels=(1, 10, 50, 100), requests_per_client=20, latency=0.05, stream=False):
+    mode = "streaming" if stream else "JSON"
+    print(f"Mock LLM latency {latency * 1000:.0f} ms, {requests_per_client} {mode} chats per client")
+    print(f"{'Clients':>8}{'Requests':>10}{'Req/sec':>10}{'p50 ms':>10}{'p99 ms':>10}")
+    results = []
+    with MockLLMServer(latency=latency) as mock, ASGIServer(api_server.ChatAPI(), port=0) as server:
+        llm_helpers.configure_client(base_url=mock.base_url, api_key="load-test")
+        for concurrency in levels:
+            result = run_level(server.base_url, concurrency, requests_per_client, stream)
+            results.append(result)
+            print(f"{result['concurrency']:>8}{result['requests']:>10}{result['throughput']:>10.1f}"
+                  f"{result['p50'] * 1000:>10.1f}{result['p99'] * 1000:>10.1f}")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the chatbot HTTP API against a mock LLM")
+    parser.add_argument("--concurrency", default="1,10,50,100", help="comma-separated client counts")
+    parser.add_argument("--requests", type=int, default=20, help="chats per client")
+    parser.add_argument("--latency", type=float, default=0.05, help="mock LLM latency in seconds")
+    parser.add_argument("--stream", action="store_true", help="use SSE streaming chats")
+    args = parser.parse_args()
+    run_load_test([int(level) for level in args.concurrency.split(",")], args.requests, args.latency, args.stream)
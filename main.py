@@ -1,5 +1,9 @@
 from utils import llm_helpers
+from utils.persona_compare import PersonaComparison
+from contextlib import closing
+import argparse
 import sys
+import time
 
 def show_help():
     """Display available commands"""
@@ -9,20 +13,100 @@ def show_help():
     print("Just type your message to chat")
     print("/persona [name] - Change AI persona (professional/creative/technical)")
     print("/list          - List available personas")
+    print("/compare [question] - Ask every persona at once and compare answers")
     print("/clear         - Clear conversation history")
-    print("/save          - Save conversation to file")
-    print("/load [file]   - Load conversation from file") 
+    print("/save          - Save conversation to file (then autosave every message)")
+    print("/load [file|id] - Load conversation from file or database id")
+    print("/history [persona] - List recently saved conversations")
+    print("/search [text] - Search all saved messages")
     print("/stats         - Show conversation statistics")
+    print("/metrics [json] - Export LLM call metrics (Prometheus text or JSON)")
     print("/help          - Show this help message")
     print("/exit          - Exit the chatbot")
     print("="*50)
 
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Custom ChatBot")
+    parser.add_argument("--persona", help="persona to start with")
+    parser.add_argument("--batch", metavar="PROMPTS.jsonl", help="answer every prompt in a JSON Lines file and exit")
+    parser.add_argument("--out", metavar="RESULTS.jsonl", help="batch output file (default: <input>.results.jsonl)")
+    parser.add_argument("--concurrency", type=int, default=8, help="batch requests in flight at once")
+    parser.add_argument("--rps", type=float, help="batch request starts per second (default: unlimited)")
+    parser.add_argument("--export", metavar="FILE",
+                        help="export stored conversations (.jsonl, .md, .csv or .parquet) and exit; --persona filters")
+    parser.add_argument("--test-results", action="store_true", help="export persona test results instead of conversations")
+    parser.add_argument("--since", metavar="DATE", help="export only from this ISO date/time on")
+    parser.add_argument("--until", metavar="DATE", help="export only before this ISO date/time")
+    args = parser.parse_args(argv)
+    # Checked here rather than with choices=, which would parse every persona file on every start;
+    # an export may filter by a persona whose file has since been removed
+    if args.persona and not args.export and args.persona not in llm_helpers.SYSTEM_PROMPTS:
+        parser.error(f"argument --persona: invalid choice: '{args.persona}' "
+                     f"(choose from {', '.join(llm_helpers.get_available_personas())})")
+    return args
+
+def run_batch_mode(args):
+    """Non-interactive batch mode; rerun the same command to resume a killed run"""
+    from utils.batch_runner import run_batch
+
+    out_path = args.out or f"{args.batch.rsplit('.', 1)[0]}.results.jsonl"
+    persona = args.persona or llm_helpers.default_persona()
+    print(f"Batch: {args.batch} -> {out_path} ({persona}, {args.concurrency} concurrent)")
+    stats = run_batch(args.batch, out_path, persona=persona, concurrency=args.concurrency, requests_per_second=args.rps)
+    print(f"Completed {stats['completed']}, failed {stats['failed']}, "
+          f"skipped {stats['skipped']} already done, in {stats['elapsed']:.1f}s")
+
+def run_export_mode(args):
+    """Stream conversations or test results from the database into a file"""
+    from utils import exporters
+
+    db = llm_helpers.get_conversation_db()
+    if args.test_results:
+        records = exporters.test_result_records(db, persona=args.persona, since=args.since, until=args.until)
+        fields = exporters.TEST_RESULT_FIELDS
+    else:
+        records = exporters.conversation_records(db, persona=args.persona, since=args.since, until=args.until)
+        fields = exporters.CONVERSATION_FIELDS
+    try:
+        count = exporters.export_records(records, args.export, fields=fields)
+    except ValueError as e:
+        print(f"Export failed: {e}")
+        sys.exit(1)
+    print(f"Exported {count} records to {args.export}")
+
+def run_comparison(comparison, question):
+    """Ask every persona concurrently and print each answer as soon as it is complete"""
+    start = time.perf_counter()
+    parts = {}
+    for persona, kind, value in comparison.stream(question):
+        if kind == "delta":
+            parts.setdefault(persona, []).append(value)
+            continue
+        elapsed = time.perf_counter() - start
+        print(f"\n--- {llm_helpers.get_persona_name(persona)} ({elapsed:.2f}s) ---")
+        print("".join(parts.get(persona, [])) if kind == "done" else f"Error getting response: {value}")
+    print(f"\nAll personas answered in {time.perf_counter() - start:.2f}s")
+
 def main():
+    args = parse_args()
+    if args.batch:
+        run_batch_mode(args)
+        return
+    if args.export:
+        run_export_mode(args)
+        return
+    if args.persona:
+        llm_helpers.set_system_prompt(args.persona)
+    
     print("Welcome to Custom ChatBot!")
     print("="*40)
     print("Type '/help' for available commands")
     print(f"Current persona: {llm_helpers.get_current_persona()}")
+    if llm_helpers.get_backend_name() != "api":
+        print(f"Backend: {llm_helpers.get_backend_name()}")
     print("Ready to chat!\n")
+    # Per-persona conversations for /compare, separate from the main chat
+    comparison = PersonaComparison()
     
     try:
         user_input = input("You: ").strip()
@@ -42,6 +126,7 @@ def main():
                     show_help()
                 elif command[0] == 'clear':
                     llm_helpers.clear_history()
+                    comparison.clear()
                     print("Conversation history cleared!")
                 elif command[0] == 'list':
                     personas = llm_helpers.get_available_personas()
@@ -51,22 +136,51 @@ def main():
                         marker = ">" if persona == current else " "
                         print(f"  {marker} {persona}")
                     print()
+                elif command[0] == 'compare':
+                    # The question keeps its original case
+                    question = user_input[len('/compare'):].strip()
+                    if question:
+                        run_comparison(comparison, question)
+                    else:
+                        print("Usage: /compare [question]")
                 elif command[0] == 'persona' and len(command) > 1:
                     result = llm_helpers.set_system_prompt(command[1])
                     print(result)
                 elif command[0] == 'save':
                     try:
                         filename = llm_helpers.save_conversation()
-                        print(f"Conversation saved to: {filename}")
+                        conversation_id = llm_helpers.record_to_database()
+                        print(f"Conversation saved to: {filename} (database id {conversation_id})")
+                        print("New messages will be saved automatically.")
                     except Exception as e:
                         print(f"Error saving: {e}")
                 elif command[0] == 'load' and len(command) > 1:
                     try:
-                        llm_helpers.load_conversation(command[1])
+                        if command[1].isdigit():
+                            llm_helpers.load_from_database(int(command[1]))
+                        else:
+                            llm_helpers.load_conversation(command[1])
                         print(f"Conversation loaded from: {command[1]}")
                         print(f"Current persona: {llm_helpers.get_current_persona()}")
                     except Exception as e:
                         print(f"Error loading: {e}")
+                elif command[0] == 'history':
+                    persona = command[1] if len(command) > 1 else None
+                    conversations = llm_helpers.list_saved_conversations(persona=persona)
+                    if not conversations:
+                        print("No saved conversations yet. Use /save to start one.")
+                    else:
+                        print("\nSaved Conversations:")
+                        for conv in conversations:
+                            title = conv['title'] or "(untitled)"
+                            print(f"  #{conv['id']:<5} {conv['updated'][:16]}  {conv['persona']:<12} {conv['message_count']:>4} msgs  {title[:40]}")
+                        print("Use /load [id] to resume one.")
+                elif command[0] == 'search' and len(command) > 1:
+                    matches = llm_helpers.search_conversations(" ".join(command[1:]))
+                    if not matches:
+                        print("No matching messages found.")
+                    for match in matches:
+                        print(f"  #{match['conversation_id']:<5} {match['persona']:<12} {match['role']:<9} {match['snippet']}")
                 elif command[0] == 'stats':
                     stats = llm_helpers.get_conversation_stats()
                     print(f"\nConversation Statistics:")
@@ -74,15 +188,46 @@ def main():
                     print(f"   Your Messages: {stats['user_messages']}")
                     print(f"   AI Responses: {stats['assistant_messages']}")
                     print(f"   Total Messages: {stats['total_messages']}")
+                    if llm_helpers.response_cache is not None or llm_helpers.semantic_cache is not None:
+                        print(f"   Cache Hits/Misses: {stats['cache_hits']}/{stats['cache_misses']}")
+                    if llm_helpers.semantic_cache is not None:
+                        semantic = llm_helpers.semantic_cache.stats()
+                        print(f"   Semantic Cache: {semantic['semantic_hit_rate']:.0%} hit rate, "
+                              f"{semantic['semantic_avg_lookup_ms']:.2f} ms per lookup, {semantic['semantic_entries']} entries")
+                    if stats["llm_calls"]:
+                        last = stats["last_call"]
+                        print(f"   LLM Calls: {stats['llm_calls']} (avg {stats['avg_response_time']:.2f}s)")
+                        print(f"   Tokens: {stats['prompt_tokens']} prompt ({stats['cached_tokens']} cached) / {stats['completion_tokens']} completion")
+                        ttft = f"{last['time_to_first_token']:.2f}s" if last["time_to_first_token"] is not None else "-"
+                        print(f"   Last Call: {last['wall_time']:.2f}s, first token {ttft}, {last['retries']} retries")
+                        summary = llm_helpers.get_metrics_summary()
+                        print(f"   Latency p50/p95: {summary['wall_time_p50']:.2f}s / {summary['wall_time_p95']:.2f}s")
+                    rate_stats = llm_helpers.get_rate_limit_stats()
+                    if rate_stats:
+                        print(f"   Rate Limit: {rate_stats['granted']} sent, {rate_stats['queued']} queued, "
+                              f"avg wait {rate_stats['avg_wait']:.2f}s, {rate_stats['pauses']} pauses after 429s")
+                    provider_stats = llm_helpers.get_provider_stats()
+                    if provider_stats:
+                        print("   Providers (best first):")
+                        for name, p in provider_stats["providers"].items():
+                            p50 = f"{p['p50'] * 1000:.0f}ms" if p["p50"] is not None else "-"
+                            p95 = f"{p['p95'] * 1000:.0f}ms" if p["p95"] is not None else "-"
+                            print(f"     {name:<12} p50 {p50:>7}  p95 {p95:>7}  errors {p['error_rate']:.0%}  ({p['requests']} calls)")
+                elif command[0] == 'metrics':
+                    print(llm_helpers.export_metrics("json" if command[1:] == ["json"] else "prometheus"))
                 else:
                     print(f"Unknown command: /{command[0]}. Type '/help' for available commands.")
             else:
                 # Regular chat message
+                print("Assistant: ", end="", flush=True)
                 try:
-                    response = llm_helpers.chat(user_input)
-                    print(f"Assistant: {response}")
+                    # closing(): on Ctrl-C the part already printed is kept as the reply
+                    with closing(llm_helpers.chat_stream(user_input)) as stream:
+                        for delta in stream:
+                            print(delta, end="", flush=True)
+                    print()
                 except Exception as e:
-                    print(f"Error getting response: {str(e)}")
+                    print(f"\nError getting response: {str(e)}")
             
             user_input = input("\nYou: ").strip()
             
@@ -92,6 +237,7 @@ def main():
         print(f"Fatal error: {e}")
         sys.exit(1)
     
+    llm_helpers.get_default_session().close()
     print("Goodbye!")
 
 if __name__ == "__main__":
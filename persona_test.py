@@ -3,21 +3,72 @@ Persona Testing Script for Week 2 Assignment Part 2
 Tests all 3 personas with identical questions to demonstrate differences
 """
 
-from utils import llm_helpers
+from utils import exporters, llm_helpers
+from utils.resilience import RateLimitedError, RequestPacer
+import asyncio
+import itertools
 import json
+import random
+import time
 from datetime import datetime
 
+# A script, not a test module: keep pytest from collecting test_personas(), which calls the API and saves results
+__test__ = False
+
+# Test questions covering different domains
+TEST_QUESTIONS = [
+    "How do I start a business?",
+    "Write a short story about a robot discovering emotions",
+    "Explain how machine learning works",
+    "What's the best way to manage a team?",
+    "How do I solve creative blocks?"
+]
+
+def _save_results(results):
+    """Save results to a timestamped JSON file and return its name"""
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    filename = f"persona_test_results_{timestamp}.json"
+    
+    with open(filename, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+    
+    # Also index the run in the database so the latest results are a single query away
+    db = llm_helpers.get_results_db()
+    if db is None:
+        print(f"\nResults saved to: {filename}")
+    else:
+        print(f"\nResults saved to: {filename} (database run {db.save_test_results(results)})")
+    return filename
+
+def _load_latest_results():
+    """Load the most recent test results from the database, falling back to JSON files"""
+    db = llm_helpers.get_results_db()
+    results = db.latest_test_results() if db is not None else None
+    if results:
+        print(f"Loading results from database (test date {results['test_date']})")
+        return results
+    return _load_latest_file()
+
+def _load_latest_file():
+    """Load the most recent persona_test_results_*.json file, or None"""
+    import os
+    import glob
+    
+    test_files = glob.glob("persona_test_results_*.json")
+    if not test_files:
+        return None
+    
+    # Load most recent file
+    latest_file = max(test_files, key=os.path.getctime)
+    print(f"Loading results from: {latest_file}")
+    
+    with open(latest_file, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
 def test_personas():
     """Test all personas with the same questions and save results"""
     
-    # Test questions covering different domains
-    test_questions = [
-        "How do I start a business?",
-        "Write a short story about a robot discovering emotions",
-        "Explain how machine learning works",
-        "What's the best way to manage a team?",
-        "How do I solve creative blocks?"
-    ]
+    test_questions = TEST_QUESTIONS
     
     personas = llm_helpers.get_available_personas()
     results = {
@@ -62,13 +113,87 @@ def test_personas():
                 }
     
     # Save results to JSON
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"persona_test_results_{timestamp}.json"
+    _save_results(results)
+    return results
+
+def _rate_limit_delay(error, attempt):
+    """Seconds to wait before retrying a rate-limited call, or None if not rate limited"""
+    if not isinstance(error, RateLimitedError):
+        return None
+    if error.retry_after is not None:
+        return error.retry_after
+    return min(2 ** attempt, 30) + random.uniform(0, 1)
+
+async def _ask_persona(persona, question, semaphore, pacer):
+    """Ask one question in a fresh session and collect the response with timing
     
-    with open(filename, 'w', encoding='utf-8') as f:
-        json.dump(results, f, indent=2, ensure_ascii=False)
+    Retries and backoff come from the session's retry policy; attempts is the
+    number of upstream calls it made.
+    """
+    session = llm_helpers.ChatSession(persona)
+    result = {"persona_info": session.get_current_persona_info()}
+    
+    async with semaphore:
+        start = time.perf_counter()
+        await pacer.wait()
+        try:
+            result["response"] = await session.achat(question)
+            result["attempts"] = session.last_attempts
+        except Exception as e:
+            result["error"] = str(e)
+            result["attempts"] = getattr(e, "attempts", 1)
+            # Still rate limited after the session's retries: hold back the other workers too
+            delay = _rate_limit_delay(e, result["attempts"])
+            if delay is not None:
+                pacer.pause(delay)
+        
+        result["latency"] = round(time.perf_counter() - start, 3)
+        if "response" in result:
+            result.update(session.get_last_usage())
     
-    print(f"\nResults saved to: {filename}")
+    return result
+
+async def _run_personas_parallel(personas, questions, max_workers, requests_per_second):
+    semaphore = asyncio.Semaphore(max_workers)
+    pacer = RequestPacer(requests_per_second)
+    pairs = [(persona, question) for persona in personas for question in questions]
+    
+    tasks = [_ask_persona(persona, question, semaphore, pacer) for persona, question in pairs]
+    outcomes = await asyncio.gather(*tasks)
+    return zip(pairs, outcomes)
+
+def run_personas_parallel(max_workers=8, questions=None, requests_per_second=None, save=True):
+    """Test every (persona, question) pair concurrently and save results
+    
+    Produces the same results schema as test_personas(), with per-call latency
+    (seconds), upstream attempts and token usage added to every entry.
+    Retries follow the session retry policy (MAX_REQUEST_ATTEMPTS).
+    """
+    questions = questions or TEST_QUESTIONS
+    personas = llm_helpers.get_available_personas()
+    results = {
+        "test_date": datetime.now().isoformat(),
+        "questions": questions,
+        # Pre-build in persona/question order so the JSON layout matches the sequential run
+        "results": {persona: {} for persona in personas}
+    }
+    
+    print("PARALLEL PERSONA TESTING STARTED")
+    print("=" * 60)
+    print(f"Testing {len(personas)} personas with {len(questions)} questions ({max_workers} workers)")
+    print("=" * 60)
+    
+    start = time.perf_counter()
+    outcomes = asyncio.run(_run_personas_parallel(personas, questions, max_workers, requests_per_second))
+    for (persona, question), result in outcomes:
+        results["results"][persona][question] = result
+        status = f"{len(result['response'])} chars" if "response" in result else f"Error: {result['error']}"
+        print(f"  [{persona}] {question[:40]}... {status} in {result['latency']:.2f}s")
+    results["total_time"] = round(time.perf_counter() - start, 3)
+    
+    print(f"\nCompleted {len(personas) * len(questions)} calls in {results['total_time']:.2f}s")
+    if save:
+        _save_results(results)
     return results
 
 def display_comparison(results=None):
@@ -76,20 +201,10 @@ def display_comparison(results=None):
     
     if not results:
         # Try to load the most recent test results
-        import os
-        import glob
-        
-        test_files = glob.glob("persona_test_results_*.json")
-        if not test_files:
+        results = _load_latest_results()
+        if not results:
             print("No test results found. Run test_personas() first.")
             return
-        
-        # Load most recent file
-        latest_file = max(test_files, key=os.path.getctime)
-        print(f"Loading results from: {latest_file}")
-        
-        with open(latest_file, 'r', encoding='utf-8') as f:
-            results = json.load(f)
     
     print("\n" + "=" * 80)
     print("PERSONA COMPARISON RESULTS")
@@ -114,23 +229,37 @@ def display_comparison(results=None):
                     print(f"{display_response}")
                 print("-" * 40)
 
-def generate_comparison_report():
-    """Generate a markdown report comparing personas"""
+def _latest_result_records(persona=None):
+    """(test date, questions, records_for) of the most recent test run, or None
+
+    records_for(question) streams that question's result records, from the
+    database page by page or, without a stored run, from the newest JSON file.
+    """
+    db = llm_helpers.get_results_db()
+    run = db.latest_test_run() if db is not None else None
+    if run:
+        print(f"Loading results from database (test date {run['test_date']})")
+        return run["test_date"], run["questions"], lambda question: exporters.test_result_records(
+            db, persona=persona, runs=[dict(run, questions=[question])])
     
-    # Try to load the most recent test results
-    import os
-    import glob
+    results = _load_latest_file()
+    if not results:
+        return None
+    return results["test_date"], results["questions"], lambda question: exporters.results_records(
+        dict(results, questions=[question]), persona=persona)
+
+def generate_comparison_report(persona=None):
+    """Generate a markdown report comparing personas (all, or persona: a key or a list of keys)
     
-    test_files = glob.glob("persona_test_results_*.json")
-    if not test_files:
+    The report is written one question at a time as the results stream in,
+    so even a large run is never loaded whole.
+    """
+    
+    latest = _latest_result_records(persona)
+    if not latest:
         print("No test results found. Run test_personas() first.")
         return
-    
-    # Load most recent file
-    latest_file = max(test_files, key=os.path.getctime)
-    
-    with open(latest_file, 'r', encoding='utf-8') as f:
-        results = json.load(f)
+    test_date, questions, records_for = latest
     
     # Generate markdown report
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -138,33 +267,21 @@ def generate_comparison_report():
     
     with open(report_filename, 'w', encoding='utf-8') as f:
         f.write("# Persona Comparison Report\n\n")
-        f.write(f"**Test Date:** {results['test_date']}\n\n")
+        f.write(f"**Test Date:** {test_date}\n\n")
         
         f.write("## Personas Tested\n\n")
-        personas = list(results["results"].keys())
-        for persona in personas:
-            # Get persona info from first question
-            first_question = results["questions"][0]
-            persona_info = results["results"][persona][first_question]["persona_info"]
+        # Persona info from the first question's results
+        for record in records_for(questions[0]) if questions else ():
+            persona_info = record["persona_info"]
             f.write(f"### {persona_info['name']}\n")
             f.write(f"**System Prompt:** {persona_info['prompt']}\n\n")
         
         f.write("## Question-by-Question Analysis\n\n")
         
-        for i, question in enumerate(results["questions"], 1):
-            f.write(f"### Question {i}: {question}\n\n")
-            
-            for persona in personas:
-                if question in results["results"][persona]:
-                    persona_name = results["results"][persona][question]["persona_info"]["name"]
-                    response = results["results"][persona][question].get("response", "ERROR")
-                    
-                    f.write(f"**{persona_name}:**\n")
-                    if "error" in results["results"][persona][question]:
-                        f.write(f"*Error: {results['results'][persona][question]['error']}*\n\n")
-                    else:
-                        f.write(f"{response}\n\n")
-            
+        records = itertools.chain.from_iterable(records_for(question) for question in questions)
+        for chunk in exporters.markdown_chunks(records):
+            f.write(chunk)
+        if questions:
             f.write("---\n\n")
         
         f.write("## Key Observations\n\n")
@@ -182,11 +299,15 @@ if __name__ == "__main__":
     print("1. Run persona tests")
     print("2. Display comparison")
     print("3. Generate markdown report")
+    print("4. Run persona tests in parallel")
     
-    choice = input("\nEnter choice (1-3): ").strip()
+    choice = input("\nEnter choice (1-4): ").strip()
     
-    if choice == "1":
-        results = test_personas()
+    if choice in ("1", "4"):
+        use_cache = input("Reuse cached responses from earlier runs? (y/n): ").strip().lower()
+        if use_cache == 'y':
+            llm_helpers.enable_response_cache(db_path="persona_test_cache.db")
+        results = test_personas() if choice == "1" else run_personas_parallel()
         print("\nTesting complete!")
         
         show_results = input("\nShow results now? (y/n): ").strip().lower()
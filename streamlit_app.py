@@ -4,10 +4,12 @@ Week 2 Assignment Part 3 - Streamlit Interface
 """
 
 import streamlit as st
-from utils import llm_helpers
-import json
+from utils import exporters, llm_helpers
+from utils.persona_compare import PersonaComparison
+from contextlib import closing
 from datetime import datetime
 import io
+import uuid
 
 # Page configuration
 st.set_page_config(
@@ -17,29 +19,208 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+# Only the newest messages are rendered on each run, so render time stays flat as the chat grows
+MESSAGES_PER_PAGE = 50
+# Newest comparison rounds shown in compare mode; each round is one row of columns
+COMPARE_ROUNDS_SHOWN = 10
+
 def initialize_session_state():
     """Initialize session state variables"""
     if "messages" not in st.session_state:
         st.session_state.messages = []
+    if "visible_messages" not in st.session_state:
+        st.session_state.visible_messages = MESSAGES_PER_PAGE
+    if "chat_session" not in st.session_state:
+        # Each browser session gets its own conversation state and fair share of the rate limit
+        st.session_state.chat_session = llm_helpers.ChatSession(user=uuid.uuid4().hex)
     if "current_persona" not in st.session_state:
-        st.session_state.current_persona = llm_helpers.get_current_persona()
-
-def export_chat_history():
-    """Export chat history as JSON"""
-    if st.session_state.messages:
-        export_data = {
-            "export_date": datetime.now().isoformat(),
-            "persona": st.session_state.current_persona,
-            "persona_info": llm_helpers.get_current_persona_info(),
-            "messages": st.session_state.messages,
-            "stats": llm_helpers.get_conversation_stats()
+        st.session_state.current_persona = st.session_state.chat_session.get_current_persona()
+    if "comparison" not in st.session_state:
+        # One conversation per persona for compare mode, sharing the browser session's rate-limit queue
+        st.session_state.comparison = PersonaComparison(user=st.session_state.chat_session.user)
+        st.session_state.compare_rounds = []
+
+def reset_chat_view():
+    st.session_state.messages = []
+    st.session_state.visible_messages = MESSAGES_PER_PAGE
+
+def change_persona():
+    """Selectbox callback: runs before the rerun, so no extra st.rerun() is needed"""
+    persona = st.session_state.persona_select
+    st.session_state.current_persona = persona
+    st.session_state.chat_session.set_system_prompt(persona)
+    # Clear messages when changing persona
+    reset_chat_view()
+
+def clear_conversation():
+    st.session_state.chat_session.clear_history()
+    st.session_state.comparison.clear()
+    st.session_state.compare_rounds = []
+    reset_chat_view()
+
+def show_earlier_messages():
+    st.session_state.visible_messages += MESSAGES_PER_PAGE
+
+def export_chat_history(messages, persona, format="jsonl"):
+    """Export chat history as bytes in format, written record by record"""
+    buffer = io.BytesIO()
+    records = exporters.session_records(messages, persona)
+    if format == "parquet":
+        exporters.write_parquet(records, buffer)
+    else:
+        for chunk in exporters.export_chunks(records, format):
+            buffer.write(chunk.encode("utf-8"))
+    return buffer.getvalue()
+
+def render_message(message):
+    with st.chat_message(message["role"]):
+        st.write(message["content"])
+        if message["role"] == "assistant":
+            st.caption(f"Generated at {message.get('timestamp', 'Unknown time')} using {message.get('persona', 'Unknown persona')}")
+
+@st.fragment
+def chat_history():
+    """Newest messages only; "show earlier" reruns just this fragment, not the page"""
+    messages = st.session_state.messages
+    hidden = max(0, len(messages) - st.session_state.visible_messages)
+    if hidden:
+        st.button(f"Show earlier messages ({hidden} hidden)", on_click=show_earlier_messages)
+    for message in messages[hidden:]:
+        render_message(message)
+
+def render_round(round_):
+    """One comparison: the question, then each persona's answer in its own column"""
+    with st.chat_message("user"):
+        st.write(round_["question"])
+    for column, (persona, answer) in zip(st.columns(len(round_["answers"])), round_["answers"].items()):
+        with column:
+            st.markdown(f"**{llm_helpers.get_persona_name(persona)}**")
+            st.write(answer)
+
+def compare_history():
+    rounds = st.session_state.compare_rounds
+    hidden = max(0, len(rounds) - COMPARE_ROUNDS_SHOWN)
+    if hidden:
+        st.caption(f"{hidden} earlier comparisons hidden")
+    for round_ in rounds[hidden:]:
+        render_round(round_)
+
+def run_comparison(question):
+    """Stream every persona's answer into its own column as the tokens arrive"""
+    with st.chat_message("user"):
+        st.write(question)
+    comparison = st.session_state.comparison
+    personas = comparison.personas or llm_helpers.get_available_personas()
+    areas = {}
+    for column, persona in zip(st.columns(len(personas)), personas):
+        with column:
+            st.markdown(f"**{llm_helpers.get_persona_name(persona)}**")
+            areas[persona] = (st.empty(), st.empty())
+    answers = dict.fromkeys(personas, "")
+    # The personas answer on worker threads; only this script thread touches the page
+    for persona, kind, value in comparison.stream(question):
+        answer_area, caption_area = areas[persona]
+        if kind == "delta":
+            answers[persona] += value
+            answer_area.write(answers[persona])
+        elif kind == "done":
+            caption_area.caption(f"Answered in {value.get('total_time', 0.0):.2f}s")
+        else:
+            answers[persona] = f"Error: {value}"
+            answer_area.error(answers[persona])
+    st.session_state.compare_rounds.append({
+        "question": question,
+        "answers": answers,
+        "timestamp": datetime.now().strftime("%H:%M:%S")
+    })
+
+def render_stats(chat_session):
+    if not st.session_state.messages:
+        return
+    stats = chat_session.get_conversation_stats()
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        st.metric("Your Messages", stats["user_messages"])
+    with col2:
+        st.metric("AI Responses", stats["assistant_messages"])
+    if stats["llm_calls"]:
+        col1, col2 = st.columns(2)
+        with col1:
+            st.metric("Avg Response", f"{stats['avg_response_time']:.2f}s")
+        with col2:
+            st.metric("Tokens Used", stats["prompt_tokens"] + stats["completion_tokens"])
+        last_ttft = stats["last_call"]["time_to_first_token"]
+        if last_ttft is not None:
+            st.caption(f"Last reply: first token after {last_ttft:.2f}s, {stats['last_call']['retries']} retries")
+
+def render_export():
+    if not st.session_state.messages:
+        st.info("Start chatting to enable export")
+        return
+    format = st.selectbox("Export format", exporters.export_formats(), key="export_format")
+    messages, persona = st.session_state.messages, st.session_state.current_persona
+    # Passing a callable defers the export to the click: reruns build and keep no copy of the file
+    st.download_button(
+        "Download Chat History",
+        lambda: export_chat_history(messages, persona, format),
+        f"chat_history_{persona}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{format}",
+        exporters.FORMATS[format][1] if format in exporters.FORMATS else "application/octet-stream",
+        use_container_width=True
+    )
+
+def chat_view(chat_session):
+    """Single-persona chat with the selected persona"""
+    st.header(f"Chat with {chat_session.get_current_persona_info()['name']}")
+    
+    # Display chat history
+    chat_history()
+
+    # Chat input
+    if user_input := st.chat_input("Type your message here..."):
+        # Add user message to session state
+        user_message = {
+            "role": "user",
+            "content": user_input,
+            "timestamp": datetime.now().strftime("%H:%M:%S")
+        }
+        st.session_state.messages.append(user_message)
+        
+        # Display user message
+        with st.chat_message("user"):
+            st.write(user_input)
+        
+        # Get AI response
+        with st.chat_message("assistant"):
+            try:
+                # The session already holds the history, so no per-turn replay is needed
+                # Render tokens as they arrive instead of waiting for the full reply
+                # closing(): if rendering fails midway, the part already shown is kept as the reply
+                with closing(chat_session.chat_stream(user_input)) as stream:
+                    response = st.write_stream(stream)
+                
+                current_time = datetime.now().strftime("%H:%M:%S")
+                current_persona_info = chat_session.get_current_persona_info()
+                st.caption(f"Generated at {current_time} using {current_persona_info['name']}")
+                
+            except Exception as e:
+                st.error(f"Error: {str(e)}")
+                response = f"Error: {str(e)}"
+        
+        # Add assistant response to session state
+        assistant_message = {
+            "role": "assistant",
+            "content": response,
+            "timestamp": datetime.now().strftime("%H:%M:%S"),
+            "persona": st.session_state.current_persona
         }
-        return json.dumps(export_data, indent=2, ensure_ascii=False)
-    return None
+        st.session_state.messages.append(assistant_message)
+        # Both messages are already on screen; no st.rerun() and no redraw of the history
 
 def main():
     # Initialize
     initialize_session_state()
+    chat_session = st.session_state.chat_session
     
     # Header
     st.title("Custom AI ChatBot")
@@ -49,34 +230,27 @@ def main():
     with st.sidebar:
         st.header("Configuration")
         
-        # Persona selection
+        # Persona selection; the registry re-reads the personas directory when it changes
         personas = llm_helpers.get_available_personas()
-        persona_names = {p: llm_helpers.SYSTEM_PROMPTS[p]["name"] for p in personas}
-        
-        # Display options with full names
-        persona_options = [f"{p} - {persona_names[p]}" for p in personas]
-        current_index = personas.index(st.session_state.current_persona)
+        if st.session_state.current_persona not in personas:
+            # Its file was removed; keep showing it until the user switches
+            personas.append(st.session_state.current_persona)
         
-        selected_option = st.selectbox(
+        st.selectbox(
             "Choose AI Persona:",
-            persona_options,
-            index=current_index,
-            key="persona_select"
+            personas,
+            index=personas.index(st.session_state.current_persona),
+            # Display names come from the registry's parsed-file cache
+            format_func=lambda p: f"{p} - {llm_helpers.get_persona_name(p)}",
+            key="persona_select",
+            on_change=change_persona
         )
         
-        # Extract persona key from selection
-        selected_persona = selected_option.split(" - ")[0]
-        
-        # Update persona if changed
-        if selected_persona != st.session_state.current_persona:
-            st.session_state.current_persona = selected_persona
-            llm_helpers.set_system_prompt(selected_persona)
-            # Clear messages when changing persona
-            st.session_state.messages = []
-            st.rerun()
+        # Ask every persona at once instead of switching and re-asking
+        compare_mode = st.toggle("Compare all personas", key="compare_mode")
         
         # Display current system prompt
-        current_info = llm_helpers.get_current_persona_info()
+        current_info = chat_session.get_current_persona_info()
         with st.expander("View Current System Prompt", expanded=False):
             st.markdown(f"**{current_info['name']}**")
             st.text_area(
@@ -93,37 +267,16 @@ def main():
         st.header("Chat Controls")
         
         # Clear conversation
-        if st.button("Clear Conversation", type="secondary", use_container_width=True):
-            st.session_state.messages = []
-            llm_helpers.clear_history()
-            st.rerun()
+        st.button("Clear Conversation", type="secondary", use_container_width=True, on_click=clear_conversation)
         
-        # Statistics
-        if st.session_state.messages:
-            stats = llm_helpers.get_conversation_stats()
-            
-            col1, col2 = st.columns(2)
-            with col1:
-                st.metric("Your Messages", stats["user_messages"])
-            with col2:
-                st.metric("AI Responses", stats["assistant_messages"])
+        # Statistics and export are filled in after the chat, so a new message shows up without a rerun
+        stats_area = st.container()
         
         st.divider()
         
         # Export functionality
         st.header("Export")
-        if st.session_state.messages:
-            export_data = export_chat_history()
-            if export_data:
-                st.download_button(
-                    "Download Chat History",
-                    export_data,
-                    f"chat_history_{st.session_state.current_persona}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
-                    "application/json",
-                    use_container_width=True
-                )
-        else:
-            st.info("Start chatting to enable export")
+        export_area = st.container()
         
         st.divider()
         
@@ -132,7 +285,7 @@ def main():
             st.markdown("""
             **Getting Started:**
             1. Select different personas to see how they respond
-            2. Ask the same question to different personas
+            2. Ask the same question to different personas, or turn on "Compare all personas"
             3. Notice differences in tone, detail, and approach
             
             **Persona Guide:**
@@ -146,66 +299,18 @@ def main():
             - Export conversations for analysis
             """)
 
-    # Main chat interface
-    st.header(f"Chat with {llm_helpers.get_current_persona_info()['name']}")
+    if compare_mode:
+        st.header("Compare Personas")
+        compare_history()
+        if question := st.chat_input("Ask every persona..."):
+            run_comparison(question)
+    else:
+        chat_view(chat_session)
     
-    # Display chat history
-    chat_container = st.container()
-    with chat_container:
-        for message in st.session_state.messages:
-            with st.chat_message(message["role"]):
-                st.write(message["content"])
-                if message["role"] == "assistant":
-                    st.caption(f"Generated at {message.get('timestamp', 'Unknown time')} using {message.get('persona', 'Unknown persona')}")
-
-    # Chat input
-    if user_input := st.chat_input("Type your message here..."):
-        # Add user message to session state
-        user_message = {
-            "role": "user",
-            "content": user_input,
-            "timestamp": datetime.now().strftime("%H:%M:%S")
-        }
-        st.session_state.messages.append(user_message)
-        
-        # Display user message
-        with st.chat_message("user"):
-            st.write(user_input)
-        
-        # Get AI response
-        with st.chat_message("assistant"):
-            with st.spinner("Thinking..."):
-                try:
-                    # Sync session state with llm_helpers conversation history
-                    llm_helpers.clear_history()
-                    for msg in st.session_state.messages[:-1]:  # Exclude the message we just added
-                        if msg["role"] == "user":
-                            llm_helpers.message_history.append({"role": "user", "content": msg["content"]})
-                        elif msg["role"] == "assistant":
-                            llm_helpers.message_history.append({"role": "assistant", "content": msg["content"]})
-                    
-                    response = llm_helpers.chat(user_input)
-                    st.write(response)
-                    
-                    current_time = datetime.now().strftime("%H:%M:%S")
-                    current_persona_info = llm_helpers.get_current_persona_info()
-                    st.caption(f"Generated at {current_time} using {current_persona_info['name']}")
-                    
-                except Exception as e:
-                    st.error(f"Error: {str(e)}")
-                    response = f"Error: {str(e)}"
-        
-        # Add assistant response to session state
-        assistant_message = {
-            "role": "assistant",
-            "content": response,
-            "timestamp": datetime.now().strftime("%H:%M:%S"),
-            "persona": st.session_state.current_persona
-        }
-        st.session_state.messages.append(assistant_message)
-        
-        # Rerun to update the interface
-        st.rerun()
+    with stats_area:
+        render_stats(chat_session)
+    with export_area:
+        render_export()
 
     # Footer with assignment info
     st.markdown("---")
@@ -3,8 +3,26 @@ Test script to verify all functionality works correctly
 """
 
 from utils import llm_helpers
+from utils.mock_server import MockLLMServer
+from contextlib import contextmanager
+import asyncio
 import json
 import os
+import time
+
+@contextmanager
+def use_mock_server(**server_options):
+    """Run a local mock LLM server and point llm_helpers at it"""
+    original_client = llm_helpers.client
+    original_settings = dict(llm_helpers._async_settings)
+    with MockLLMServer(**server_options) as server:
+        llm_helpers.configure_client(base_url=server.base_url, api_key="test")
+        try:
+            yield server
+        finally:
+            llm_helpers.client = original_client
+            llm_helpers._async_settings.update(original_settings)
+            llm_helpers._async_resources.clear()
 
 def test_basic_functionality():
     """Test basic functionality without API calls"""
@@ -92,6 +110,1604 @@ def test_error_handling():
     except Exception as e:
         print(f"Load non-existent file test: {str(e)[:50]}...")
 
+def test_streaming_chat():
+    """Test token streaming against the local mock SSE server"""
+    print("\n" + "=" * 50)
+    print("TESTING STREAMING CHAT")
+    print("=" * 50)
+    
+    reply = "Streaming works one token at a time."
+    with use_mock_server(reply=reply, latency=0.05, token_delay=0.02) as server:
+        llm_helpers.set_system_prompt("technical")
+        deltas = list(llm_helpers.chat_stream("Hello"))
+    
+    timing = llm_helpers.get_last_response_timing()
+    history = llm_helpers.get_conversation_history()
+    print(f"   Received {len(deltas)} deltas")
+    print(f"   Time to first token: {timing['time_to_first_token']:.3f}s")
+    print(f"   Total time: {timing['total_time']:.3f}s")
+    
+    assert len(deltas) > 1
+    assert "".join(deltas) == reply
+    assert server.requests[0]["stream"] is True
+    assert history[-1] == {"role": "assistant", "content": reply}
+    assert history[-2] == {"role": "user", "content": "Hello"}
+    # First token must arrive well before the rest of the stream finishes
+    assert timing["time_to_first_token"] < timing["total_time"]
+    
+    # Closing after the first chunk keeps what was shown as the reply
+    with use_mock_server(reply=reply, token_delay=0.02) as server:
+        session = llm_helpers.ChatSession("technical")
+        stream = session.chat_stream("Stop early")
+        first = next(stream)
+        stream.close()
+        assert [m["role"] for m in session.get_conversation_history()] == ["system", "user", "assistant"]
+        assert session.get_conversation_history()[-1]["content"] == first
+        
+        # The next request does not carry two user turns in a row
+        "".join(session.chat_stream("Go on"))
+        roles = [m["role"] for m in server.requests[-1]["messages"]]
+        assert roles == ["system", "user", "assistant", "user"]
+    
+    # A failed stream takes the user turn back
+    from utils.resilience import ClientRequestError
+    with use_mock_server(faults=[{"status": 400}]):
+        session = llm_helpers.ChatSession("technical")
+        try:
+            list(session.chat_stream("Rejected"))
+            assert False, "expected ClientRequestError"
+        except ClientRequestError:
+            pass
+        assert [m["role"] for m in session.get_conversation_history()] == ["system"]
+        assert session.get_conversation_stats()["user_messages"] == 0
+    print("   Early close keeps the partial reply; failure drops the user turn")
+
+def test_session_isolation():
+    """Test that separate chat sessions keep separate state"""
+    print("\n" + "=" * 50)
+    print("TESTING SESSION ISOLATION")
+    print("=" * 50)
+    
+    with use_mock_server(reply=lambda messages: f"Seen {len(messages)} messages"):
+        first = llm_helpers.ChatSession("creative")
+        second = llm_helpers.ChatSession("technical")
+        first.chat("Hello")
+        first.chat("Tell me more")
+        second.chat("Hi")
+    
+    print(f"   First session: {first.get_conversation_stats()}")
+    print(f"   Second session: {second.get_conversation_stats()}")
+    
+    assert first.get_current_persona() == "creative"
+    assert second.get_current_persona() == "technical"
+    assert first.get_conversation_stats()["user_messages"] == 2
+    assert second.get_conversation_stats()["user_messages"] == 1
+    assert second.get_conversation_history()[-1]["content"] == "Seen 2 messages"
+    # The module-level default session is untouched
+    assert all(msg["content"] != "Tell me more" for msg in llm_helpers.get_conversation_history())
+
+def test_async_chat():
+    """Test concurrent async chats share the bounded client"""
+    print("\n" + "=" * 50)
+    print("TESTING ASYNC CHAT")
+    print("=" * 50)
+    
+    async def run_conversations(count):
+        sessions = [llm_helpers.ChatSession("professional") for _ in range(count)]
+        replies = await asyncio.gather(*(session.achat(f"Question {i}") for i, session in enumerate(sessions)))
+        streamed = [delta async for delta in sessions[0].achat_stream("Follow up")]
+        return sessions, replies, streamed
+    
+    with use_mock_server(reply="Async reply", latency=0.1) as server:
+        sessions, replies, streamed = asyncio.run(run_conversations(20))
+        print(f"   Completed {len(replies)} concurrent chats, {server.request_count} requests")
+    
+    assert replies == ["Async reply"] * 20
+    assert "".join(streamed) == "Async reply"
+    assert server.request_count == 21
+    assert sessions[0].get_conversation_stats()["assistant_messages"] == 2
+    assert sessions[1].get_conversation_history()[1]["content"] == "Question 1"
+
+def test_parallel_persona_runner():
+    """Test the parallel persona runner keeps the results schema"""
+    print("\n" + "=" * 50)
+    print("TESTING PARALLEL PERSONA RUNNER")
+    print("=" * 50)
+    
+    import persona_test
+    from utils.resilience import RetryPolicy
+    import openai  # noqa: F401 -- warm the SDK's lazy import so it isn't timed
+    
+    questions = ["Question one?", "Question two?"]
+    with use_mock_server(reply="Mock answer", latency=0.2) as server:
+        results = persona_test.run_personas_parallel(max_workers=6, questions=questions, save=False)
+    
+    personas = llm_helpers.get_available_personas()
+    print(f"   {server.request_count} calls in {results['total_time']:.2f}s")
+    
+    assert server.request_count == len(personas) * len(questions)
+    assert list(results["results"]) == personas
+    # 6 calls of 0.2s each with 6 workers should take about one round-trip
+    assert results["total_time"] < 0.2 * len(personas) * len(questions) / 2
+    for persona in personas:
+        for question in questions:
+            entry = results["results"][persona][question]
+            assert entry["response"] == "Mock answer"
+            assert entry["persona_info"] == llm_helpers.SYSTEM_PROMPTS[persona]
+            assert entry["latency"] >= 0.2
+            assert entry["completion_tokens"] == 2
+            assert entry["attempts"] == 1
+    
+    # Retries come from the session's retry policy alone, and attempts counts real upstream calls
+    original_policy = llm_helpers.retry_policy
+    llm_helpers.retry_policy = RetryPolicy(max_attempts=3, base_delay=0.01, attempt_timeout=2, total_timeout=5)
+    try:
+        with use_mock_server(reply="Mock answer", faults=[{"status": 503}, {"status": 503}]) as server:
+            results = persona_test.run_personas_parallel(max_workers=1, questions=["Question one?"], save=False)
+    finally:
+        llm_helpers.retry_policy = original_policy
+    entries = [answers["Question one?"] for answers in results["results"].values()]
+    assert all(entry["response"] == "Mock answer" for entry in entries)
+    assert entries[0]["attempts"] == 3
+    assert sum(entry["attempts"] for entry in entries) == server.request_count == len(personas) + 2
+
+def test_response_cache():
+    """Test identical requests are served from the response cache"""
+    print("\n" + "=" * 50)
+    print("TESTING RESPONSE CACHE")
+    print("=" * 50)
+    
+    from utils.response_cache import ResponseCache
+    
+    with use_mock_server(reply="Cached answer") as server:
+        llm_helpers.enable_response_cache(max_entries=10)
+        try:
+            first = llm_helpers.ChatSession("creative")
+            second = llm_helpers.ChatSession("creative")
+            assert first.chat("Same question") == "Cached answer"
+            assert "".join(second.chat_stream("Same question")) == "Cached answer"
+            # A different persona means a different system prompt, so a different key
+            llm_helpers.ChatSession("technical").chat("Same question")
+        finally:
+            llm_helpers.disable_response_cache()
+    
+    print(f"   Upstream requests: {server.request_count}")
+    print(f"   Second session stats: {second.get_conversation_stats()}")
+    assert server.request_count == 2
+    assert first.get_conversation_stats()["cache_misses"] == 1
+    assert second.get_conversation_stats()["cache_hits"] == 1
+    assert second.get_conversation_history()[-1]["content"] == "Cached answer"
+    
+    # LRU bound, TTL expiry and the SQLite tier
+    from contextlib import closing
+    import sqlite3
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "cache.db")
+        cache = ResponseCache(max_entries=2, ttl=None, db_path=db_path, max_disk_entries=3)
+        try:
+            for key in ("a", "b", "c"):
+                cache.set(key, key.upper())
+            assert cache.stats()["cache_entries"] == 2
+            assert cache.get("a") == "A"  # evicted from memory, promoted from disk
+            cache.ttl = 0
+            assert cache.get("b") is None
+            
+            # The disk tier is bounded too: a write deletes the expired rows...
+            cache.ttl = 0.2
+            time.sleep(0.2)
+            cache.set("d", "D")
+        finally:
+            cache.close()
+        with closing(sqlite3.connect(db_path)) as db:
+            assert [row[0] for row in db.execute("SELECT key FROM responses")] == ["d"]
+        
+        # ...and the oldest rows beyond max_disk_entries
+        cache = ResponseCache(max_entries=1, ttl=None, db_path=db_path, max_disk_entries=3)
+        try:
+            for key in "ghijk":
+                cache.set(key, key.upper())
+                time.sleep(0.01)
+            assert cache.get("h") is None and cache.get("i") == "I"
+        finally:
+            cache.close()
+
+def test_token_budget_window():
+    """Test the context window keeps the newest messages within the token budget"""
+    print("\n" + "=" * 50)
+    print("TESTING TOKEN BUDGET WINDOW")
+    print("=" * 50)
+    
+    from utils import token_counter
+    from utils.token_counter import message_tokens
+    
+    session = llm_helpers.ChatSession("technical", max_prompt_tokens=300)
+    system_tokens = message_tokens(session.message_history[0])
+    long_answer = "word " * 200
+    for i in range(5):
+        session.message_history.append({"role": "user", "content": f"Short question {i}"})
+        session.message_history.append({"role": "assistant", "content": long_answer})
+    session.message_history.append({"role": "user", "content": "Latest question"})
+    
+    window = session.get_context_window()
+    window_tokens = sum(message_tokens(m) for m in window)
+    print(f"   System prompt tokens: {system_tokens}")
+    print(f"   Window: {len(window)} of {len(session.message_history)} messages, {window_tokens} tokens")
+    
+    assert window[0]["role"] == "system"
+    assert window[-1]["content"] == "Latest question"
+    assert window_tokens <= 300
+    # The next-oldest message would not have fitted
+    evicted = session.message_history[-len(window)]
+    assert window_tokens + message_tokens(evicted) > 300
+    
+    # Short chats are not trimmed at all
+    short = llm_helpers.ChatSession("technical")
+    for i in range(30):
+        short.message_history.append({"role": "user", "content": f"Hi {i}"})
+    assert short.get_context_window() == short.message_history
+    
+    # Each message keeps its count, so later turns don't re-tokenize the history
+    counted = []
+    original_count = token_counter.count_tokens
+    token_counter.count_tokens = lambda text: counted.append(text) or original_count(text)
+    try:
+        session.get_context_window()
+    finally:
+        token_counter.count_tokens = original_count
+    assert counted == []
+    assert session.message_history[1].tokens == message_tokens({"role": "user", "content": "Short question 0"})
+
+def test_rolling_summary():
+    """Test evicted history is folded into a summary placed after the stable prompt prefix"""
+    print("\n" + "=" * 50)
+    print("TESTING ROLLING SUMMARY")
+    print("=" * 50)
+    
+    from utils.token_counter import message_tokens
+    
+    folded = []
+    
+    def stub_summarize(previous_summary, messages):
+        folded.extend(messages)
+        return f"{len(folded)} earlier messages"
+    
+    session = llm_helpers.ChatSession("technical", max_prompt_tokens=250, summarize_fn=stub_summarize)
+    with use_mock_server(reply="A fairly long answer " * 10):
+        for i in range(12):
+            session.chat(f"Question {i}")
+            session.summarizer.wait()
+    
+    window = session.get_context_window()
+    print(f"   Summary: {session.summarizer.summary}")
+    print(f"   Window: {len(window)} messages, {sum(message_tokens(m) for m in window)} tokens")
+    
+    assert window[0]["role"] == "system"
+    assert window[-2]["content"].startswith("Summary of the earlier conversation")
+    assert sum(message_tokens(m) for m in window) <= 250
+    # A new summary leaves the system prompt and kept history untouched
+    session.summarizer.summary = "Rewritten summary"
+    assert session.get_context_window()[:-2] == window[:-2]
+    # Every evicted message was summarized exactly once, oldest first
+    assert folded == session.message_history[1:session.summarizer.summarized_upto]
+    assert len(folded) > 0
+    
+    session.clear_history()
+    assert session.summarizer.summary == ""
+    assert len(session.get_context_window()) == 1
+    
+    # The real summarizer goes through the retry policy like chat replies
+    from utils.resilience import RetryPolicy
+    original_policy = llm_helpers.retry_policy
+    llm_helpers.retry_policy = RetryPolicy(max_attempts=2, base_delay=0.01)
+    try:
+        with use_mock_server(reply="Folded summary", faults=[{"status": 503}]) as server:
+            assert llm_helpers.summarize_messages("", [{"role": "user", "content": "Hi"}]) == "Folded summary"
+        assert server.request_count == 2
+    finally:
+        llm_helpers.retry_policy = original_policy
+
+def test_conversation_journal():
+    """Test JSONL autosave, tail resume and compaction"""
+    print("\n" + "=" * 50)
+    print("TESTING CONVERSATION JOURNAL")
+    print("=" * 50)
+    
+    import tempfile
+    from utils.conversation_store import read_journal
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "test_journal.jsonl")
+        session = llm_helpers.ChatSession("creative")
+        with use_mock_server(reply="Journaled reply"):
+            session.chat("Before saving")
+            assert session.save_conversation(path) == path
+            session.chat("After saving")
+            session.set_system_prompt("technical")
+            session.chat("New persona")
+        session.close()
+        
+        with open(path, encoding='utf-8') as f:
+            lines = f.readlines()
+        print(f"   Journal lines: {len(lines)}")
+        # header + 2 messages + 2 autosaved + reset + 2 autosaved
+        assert len(lines) == 8
+        
+        persona, messages = read_journal(path)
+        assert persona == "technical"
+        assert [m["content"] for m in messages] == ["New persona", "Journaled reply"]
+        
+        # A torn line from a crash is ignored on resume
+        with open(path, "a", encoding='utf-8') as f:
+            f.write('{"role": "user", "cont')
+        resumed = llm_helpers.ChatSession()
+        resumed.load_conversation(path)
+        assert resumed.get_current_persona() == "technical"
+        assert resumed.get_conversation_history()[1:] == messages
+        
+        # Tail reads stop at the budget instead of reading the whole conversation
+        small = llm_helpers.ChatSession(max_prompt_tokens=1)
+        small.load_conversation(path)
+        assert len(small.get_conversation_history()) == 2
+        small.close()
+        
+        assert resumed.compact_journal() == 2
+        resumed.close()
+        with open(path, encoding='utf-8') as f:
+            assert len(f.readlines()) == 3
+        print("   Resume and compaction successful")
+        
+        # After a tail resume, stats, snapshots and the database still cover the whole conversation
+        from utils.conversation_db import ConversationDatabase
+        small = llm_helpers.ChatSession(max_prompt_tokens=1)
+        small.load_conversation(path)
+        assert len(small.get_conversation_history()) == 2
+        with use_mock_server(reply="Journaled reply"):
+            small.chat("After resume")
+        expected = ["New persona", "Journaled reply", "After resume", "Journaled reply"]
+        stats = small.get_conversation_stats()
+        assert stats["total_messages"] == 4 and stats["user_messages"] == 2 and stats["assistant_messages"] == 2
+        
+        snapshot = os.path.join(tmp, "snapshot.json")
+        small.save_conversation(snapshot)
+        with open(snapshot, encoding='utf-8') as f:
+            assert [m["content"] for m in json.load(f)["conversation"][1:]] == expected
+        db = ConversationDatabase(os.path.join(tmp, "conversations.db"))
+        try:
+            small.record_to_database(db)
+            assert db.list_conversations()[0]["message_count"] == 4
+        finally:
+            db.close()
+            small.db = None
+        copy = os.path.join(tmp, "copy.jsonl")
+        small.save_conversation(copy)
+        small.close()
+        assert [m["content"] for m in read_journal(copy)[1]] == expected
+        print("   Tail resume keeps full-conversation stats and exports")
+
+def test_conversation_database():
+    """Test the SQLite conversation store: recording, listing, search and test results"""
+    print("\n" + "=" * 50)
+    print("TESTING CONVERSATION DATABASE")
+    print("=" * 50)
+    
+    import tempfile
+    from utils.conversation_db import ConversationDatabase
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        db = ConversationDatabase(os.path.join(tmp, "test_conversations.db"))
+        try:
+            session = llm_helpers.ChatSession("technical")
+            with use_mock_server(reply=lambda messages: f"Answer about {messages[-1]['content']}"):
+                session.chat("quantum entanglement")
+                conversation_id = session.record_to_database(db)
+                session.chat("photosynthesis")
+                session.set_system_prompt("creative")
+                session.chat("poetry")
+            
+            listed = db.list_conversations()
+            print(f"   Conversations: {[(c['id'], c['persona'], c['message_count']) for c in listed]}")
+            assert [c["persona"] for c in listed] == ["creative", "technical"]
+            assert listed[1]["message_count"] == 4
+            assert listed[1]["title"] == "quantum entanglement"
+            assert [c["id"] for c in db.list_conversations(persona="technical")] == [conversation_id]
+            
+            matches = db.search_messages("photosynthesis")
+            print(f"   Search results: {len(matches)} (fts5: {db.has_fts})")
+            assert {m["conversation_id"] for m in matches} == {conversation_id}
+            assert db.search_messages('bad "query (syntax') == []
+            
+            resumed = llm_helpers.ChatSession()
+            resumed.load_from_database(conversation_id, db=db)
+            assert resumed.get_current_persona() == "technical"
+            assert len(resumed.get_conversation_history()) == 5
+            
+            results = {"test_date": "2024-01-01T00:00:00", "questions": ["Q?"],
+                       "results": {"technical": {"Q?": {"response": "A", "persona_info": {"name": "T"}}}}}
+            db.save_test_results(results)
+            assert db.latest_test_results() == results
+        finally:
+            db.close()
+
+def test_retry_and_circuit_breaker():
+    """Test retries, deadlines, typed errors and the circuit breaker against injected faults"""
+    print("\n" + "=" * 50)
+    print("TESTING RETRIES AND CIRCUIT BREAKER")
+    print("=" * 50)
+    
+    from utils.resilience import (
+        CircuitBreaker, CircuitOpenError, ClientRequestError, RateLimitedError, RetryPolicy, LLMTimeoutError,
+        acall_with_retries, call_with_retries)
+    
+    original_policy, original_breaker = llm_helpers.retry_policy, llm_helpers.circuit_breaker
+    llm_helpers.retry_policy = RetryPolicy(max_attempts=3, base_delay=0.01, attempt_timeout=0.5, total_timeout=3)
+    try:
+        # Transient 503 and 429 (with Retry-After) are retried
+        faults = [{"status": 503}, {"status": 429, "retry_after": 0.2}]
+        with use_mock_server(reply="Recovered", faults=faults) as server:
+            session = llm_helpers.ChatSession()
+            start = time.perf_counter()
+            assert session.chat("Hello") == "Recovered"
+            elapsed = time.perf_counter() - start
+        print(f"   Recovered after {session.last_attempts} attempts in {elapsed:.2f}s")
+        assert session.last_attempts == 3 and server.request_count == 3
+        assert elapsed >= 0.2
+        
+        # A hung request is cut off by the per-attempt timeout and retried
+        with use_mock_server(reply="Eventually", faults=[{"delay": 2}]) as server:
+            session = llm_helpers.ChatSession()
+            assert "".join(session.chat_stream("Hello")) == "Eventually"
+        assert session.last_attempts == 2
+        
+        # A stream waiting to retry gives up its concurrency slot meanwhile
+        async def stream_then_chat():
+            finished = []
+            
+            async def stream():
+                async for _ in llm_helpers.ChatSession().achat_stream("Stream"):
+                    pass
+                finished.append("stream")
+            
+            async def chat():
+                await asyncio.sleep(0.1)
+                await llm_helpers.ChatSession().achat("Chat")
+                finished.append("chat")
+            
+            await asyncio.gather(stream(), chat())
+            return finished
+        
+        with use_mock_server(reply="Slot", faults=[{"status": 429, "retry_after": 0.5}]):
+            llm_helpers.configure_client(max_concurrency=1)
+            assert asyncio.run(stream_then_chat()) == ["chat", "stream"]
+        
+        # Client errors are not retried
+        with use_mock_server(faults=[{"status": 400}]) as server:
+            try:
+                llm_helpers.ChatSession().chat("Hello")
+                assert False, "expected ClientRequestError"
+            except ClientRequestError as e:
+                print(f"   Client error: {str(e)[:60]}...")
+                assert e.status_code == 400
+        assert server.request_count == 1
+        
+        # The total deadline bounds the whole call
+        llm_helpers.retry_policy = RetryPolicy(max_attempts=10, attempt_timeout=0.3, total_timeout=0.5)
+        with use_mock_server(faults=[{"delay": 2}] * 3):
+            try:
+                asyncio.run(llm_helpers.ChatSession().achat("Hello"))
+                assert False, "expected LLMTimeoutError"
+            except LLMTimeoutError as e:
+                print(f"   Deadline: {str(e)[:60]}...")
+        
+        # Repeated provider failures open the circuit
+        llm_helpers.retry_policy = RetryPolicy(max_attempts=1)
+        with use_mock_server(faults=[{"status": 500}] * 2) as server:
+            llm_helpers.circuit_breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+            for _ in range(2):
+                try:
+                    llm_helpers.ChatSession().chat("Hello")
+                except Exception:
+                    pass
+            try:
+                llm_helpers.ChatSession().chat("Hello")
+                assert False, "expected CircuitOpenError"
+            except CircuitOpenError as e:
+                print(f"   Circuit: {e}")
+        assert server.request_count == 2
+        assert llm_helpers.circuit_breaker.state == "open"
+        
+        # A cancelled half-open trial (client gone, hedge lost) lets the next call try again
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+        breaker.record_failure()
+        time.sleep(0.05)
+        
+        async def hang(timeout):
+            await asyncio.sleep(10)
+        
+        async def cancel_trial():
+            task = asyncio.create_task(acall_with_retries(hang, RetryPolicy(), breaker))
+            await asyncio.sleep(0.01)
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        
+        asyncio.run(cancel_trial())
+        assert breaker.state == "half-open"
+        assert breaker.before_call() is True
+        
+        # 429s are the rate limiter's business and never open the circuit
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+        
+        def rate_limited(timeout):
+            raise RateLimitedError("slow down", retry_after=0)
+        
+        try:
+            call_with_retries(rate_limited, RetryPolicy(max_attempts=3), breaker)
+            assert False, "expected RateLimitedError"
+        except RateLimitedError as e:
+            assert e.attempts == 3
+        assert breaker.state == "closed"
+    finally:
+        llm_helpers.retry_policy, llm_helpers.circuit_breaker = original_policy, original_breaker
+
+def test_provider_routing():
+    """Test latency-based routing, hedging and failover across two mock providers"""
+    print("\n" + "=" * 50)
+    print("TESTING PROVIDER ROUTING")
+    print("=" * 50)
+    
+    from utils.providers import Provider, ProviderRouter
+    
+    with MockLLMServer(reply="slow", latency=0.6) as slow_server, \
+            MockLLMServer(reply="fast", latency=0.05) as fast_server:
+        slow = Provider("slow", slow_server.base_url, "test", "slow-model")
+        fast = Provider("fast", fast_server.base_url, "test", "fast-model")
+        router = ProviderRouter([slow, fast], hedge_after=0.2)
+        kwargs = {"model": "ignored", "messages": [{"role": "user", "content": "Hi"}], "max_tokens": 10}
+        
+        # Build both clients first so the openai import is not timed when this test runs alone
+        slow.client, fast.client
+        # The unmeasured slow provider goes first, but the hedge answers sooner
+        start = time.perf_counter()
+        first = router.create(kwargs).choices[0].message.content
+        hedged_latency = time.perf_counter() - start
+        time.sleep(0.6)  # let the losing call finish and report its latency
+        
+        # From then on the fast provider is preferred outright
+        replies = [router.create(kwargs).choices[0].message.content for _ in range(3)]
+        replies.append(asyncio.run(router.acreate(kwargs)).choices[0].message.content)
+        stats = router.stats()
+    
+    print(f"   First reply '{first}' in {hedged_latency:.2f}s (hedged {stats['hedged_requests']}x)")
+    print(f"   Provider order: {list(stats['providers'])}")
+    assert first == "fast" and hedged_latency < 0.5
+    assert replies == ["fast"] * 4
+    assert list(stats["providers"]) == ["fast", "slow"]
+    assert fast_server.requests[0]["model"] == "fast-model"
+    
+    # Errors fail over to the next provider
+    with MockLLMServer(faults=[{"status": 500}]) as broken_server, \
+            MockLLMServer(reply="backup") as backup_server:
+        router = ProviderRouter([Provider("broken", broken_server.base_url, "test", "m"),
+                                 Provider("backup", backup_server.base_url, "test", "m")], hedge_after=None)
+        assert router.create(kwargs).choices[0].message.content == "backup"
+        assert router.failovers == 1
+        assert router.stats()["providers"]["broken"]["error_rate"] == 1.0
+    
+    # A provider demoted by one transient error gets probed and wins its traffic back
+    with MockLLMServer(reply="slow", latency=0.2) as slow_server, \
+            MockLLMServer(reply="fast", latency=0.01, faults=[{"status": 503}]) as fast_server:
+        fast = Provider("fast", fast_server.base_url, "test", "m")
+        router = ProviderRouter([Provider("slow", slow_server.base_url, "test", "m"), fast],
+                                hedge_after=None, probe_interval=0.5)
+        demoted = [router.create(kwargs).choices[0].message.content for _ in range(4)]
+        # An error with no latency sample is a finite penalty, not a permanent ban
+        assert demoted == ["slow"] * 4 and fast.health_score() != float("inf")
+        time.sleep(0.6)
+        recovered = [router.create(kwargs).choices[0].message.content for _ in range(4)]
+        print(f"   After a transient error: {demoted} -> probe -> {recovered}")
+        assert recovered == ["fast"] * 4 and router.stats()["probes"] == 1
+
+def test_call_metrics():
+    """Test per-call metrics records, hooks, histograms and exports"""
+    print("\n" + "=" * 50)
+    print("TESTING CALL METRICS")
+    print("=" * 50)
+    
+    llm_helpers.metrics.reset()
+    records = []
+    llm_helpers.metrics.add_hook(records.append)
+    try:
+        with use_mock_server(reply="Metrics are fun ", latency=0.05, faults=[{"status": 503}]):
+            session = llm_helpers.ChatSession(persona="technical")
+            session.chat("Hello")
+            "".join(session.chat_stream("Stream please"))
+    finally:
+        llm_helpers.metrics.remove_hook(records.append)
+    
+    plain, streamed = records
+    print(f"   chat: {plain['wall_time']:.3f}s, {plain['retries']} retries, {plain['completion_tokens']} tokens")
+    print(f"   stream: first token {streamed['time_to_first_token']:.3f}s, {streamed['completion_tokens']} tokens")
+    assert plain["persona"] == "technical" and plain["model"] == llm_helpers.DEFAULT_OPENAI_MODEL
+    assert plain["retries"] == 1 and not plain["cache_hit"] and plain["error"] is None
+    assert plain["wall_time"] >= 0.05
+    # Streams get usage from the final include_usage chunk
+    assert streamed["streamed"] and streamed["completion_tokens"] == 3 and streamed["prompt_tokens"] > 0
+    assert 0 < streamed["time_to_first_token"] <= streamed["wall_time"]
+    
+    stats = session.get_conversation_stats()
+    assert stats["llm_calls"] == 2 and stats["completion_tokens"] == 6
+    assert stats["last_call"] == streamed
+    
+    summary = llm_helpers.get_metrics_summary()
+    assert summary["calls"] == 2 and summary["retries"] == 1
+    assert 0.05 <= summary["wall_time_p50"] <= summary["wall_time_p95"]
+    
+    prometheus = llm_helpers.export_metrics()
+    assert 'chatbot_llm_calls_total{model="%s",persona="technical",outcome="ok"} 2' % llm_helpers.DEFAULT_OPENAI_MODEL in prometheus
+    assert 'chatbot_llm_wall_time_seconds_bucket{le="+Inf"} 2' in prometheus
+    exported = json.loads(llm_helpers.export_metrics("json"))
+    assert exported["histograms"]["completion_tokens"]["count"] == 2
+    
+    # Label values are escaped, so odd persona or model names cannot break the exposition
+    llm_helpers.metrics.record({"model": 'org\\model "v2"', "persona": "two\nlines", "wall_time": 0.1})
+    prometheus = llm_helpers.export_metrics()
+    assert 'chatbot_llm_calls_total{model="org\\\\model \\"v2\\"",persona="two\\nlines",outcome="ok"} 1' in prometheus
+    assert all(line.startswith(("#", "chatbot_llm_")) for line in prometheus.splitlines())
+    llm_helpers.metrics.reset()
+
+def test_api_server():
+    """Test the HTTP API: sessions, persona switching, JSON and SSE chat, history and stats"""
+    print("\n" + "=" * 50)
+    print("TESTING HTTP API SERVER")
+    print("=" * 50)
+    
+    from http.client import HTTPConnection
+    import api_server
+    from utils.asgi_server import ASGIServer
+    
+    def request(conn, method, path, payload=None):
+        body = json.dumps(payload) if payload is not None else None
+        conn.request(method, path, body=body, headers={"Content-Type": "application/json"})
+        response = conn.getresponse()
+        return response.status, response.getheader("Content-Type"), response.read().decode("utf-8")
+    
+    app = api_server.ChatAPI(max_body_size=500)
+    with use_mock_server(reply="Hello from the API "), ASGIServer(app, port=0, max_body_size=1000) as server:
+        conn = HTTPConnection("127.0.0.1", server.port, timeout=10)
+        status, _, body = request(conn, "POST", "/sessions", {"persona": "creative"})
+        assert status == 201
+        first = json.loads(body)["session_id"]
+        second = json.loads(request(conn, "POST", "/sessions", {})[2])["session_id"]
+        
+        status, _, body = request(conn, "POST", f"/sessions/{first}/chat", {"message": "Hi"})
+        assert status == 200 and json.loads(body)["reply"] == "Hello from the API "
+        
+        # SSE streaming over the same keep-alive connection
+        status, content_type, body = request(conn, "POST", f"/sessions/{first}/chat", {"message": "Stream", "stream": True})
+        events = [line.split(": ", 1)[1] for line in body.splitlines() if line.startswith("event: ")]
+        deltas = [json.loads(line[6:])["content"] for line in body.splitlines()
+                  if line.startswith("data: ") and "content" in line]
+        print(f"   SSE events: {events}")
+        assert content_type == "text/event-stream"
+        assert events[-1] == "done" and events.count("delta") == 4
+        assert "".join(deltas) == "Hello from the API "
+        
+        history = json.loads(request(conn, "GET", f"/sessions/{first}/history")[2])
+        assert history["persona"] == "creative" and len(history["messages"]) == 5
+        stats = json.loads(request(conn, "GET", f"/sessions/{first}/stats")[2])
+        assert stats["user_messages"] == 2 and stats["llm_calls"] == 2
+        
+        # Sessions are isolated; switching persona clears only that session
+        assert len(json.loads(request(conn, "GET", f"/sessions/{second}/history")[2])["messages"]) == 1
+        status, _, body = request(conn, "PUT", f"/sessions/{first}/persona", {"persona": "technical"})
+        assert status == 200
+        history = json.loads(request(conn, "GET", f"/sessions/{first}/history")[2])
+        assert history["persona"] == "technical" and len(history["messages"]) == 1
+        
+        assert request(conn, "PUT", f"/sessions/{first}/persona", {"persona": "pirate"})[0] == 400
+        assert request(conn, "POST", f"/sessions/{first}/chat", {"message": ""})[0] == 400
+        assert request(conn, "DELETE", f"/sessions/{second}")[0] == 200
+        assert request(conn, "GET", f"/sessions/{second}/stats")[0] == 404
+        
+        # Oversized bodies: the app refuses them as JSON, the server before reading them
+        status, _, body = request(conn, "POST", "/sessions", {"user": "x" * 600})
+        assert status == 413 and "error" in json.loads(body)
+        assert request(conn, "POST", "/sessions", {"user": "x" * 2000})[0] == 413
+        conn.close()
+        for length in ("abc", "-5"):
+            conn = HTTPConnection("127.0.0.1", server.port, timeout=10)
+            conn.request("POST", "/sessions", body="{}", headers={"Content-Length": length})
+            assert conn.getresponse().status == 400
+            conn.close()
+        
+        # Unexpected errors are answered with a JSON 500 and the server keeps serving
+        original_export = llm_helpers.export_metrics
+        llm_helpers.export_metrics = lambda *args: 1 / 0
+        try:
+            conn = HTTPConnection("127.0.0.1", server.port, timeout=10)
+            status, content_type, body = request(conn, "GET", "/metrics")
+        finally:
+            llm_helpers.export_metrics = original_export
+        assert status == 500 and content_type == "application/json"
+        assert json.loads(body) == {"error": "Internal server error"}
+        assert request(conn, "GET", "/health")[0] == 200
+        conn.close()
+
+def test_batch_mode():
+    """Test batch processing: input formats, concurrency, incremental output and resume"""
+    print("\n" + "=" * 50)
+    print("TESTING BATCH MODE")
+    print("=" * 50)
+    
+    from utils.batch_runner import run_batch
+    import openai  # noqa: F401 -- warm the SDK's lazy import so it isn't timed
+    import tempfile
+    
+    def reply(messages):
+        return f"{len(messages)} messages, last: {messages[-1]['content']}"
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        prompts_path = os.path.join(tmp, "prompts.jsonl")
+        out_path = os.path.join(tmp, "results.jsonl")
+        with open(prompts_path, "w", encoding="utf-8") as f:
+            f.write(json.dumps("Plain string prompt") + "\n")
+            for i in range(20):
+                f.write(json.dumps({"id": f"q{i}", "prompt": f"Question {i}"}) + "\n")
+            f.write(json.dumps({"id": "conv", "persona": "creative", "messages": [
+                {"role": "user", "content": "Hi"},
+                {"role": "assistant", "content": "Hello!"},
+                {"role": "user", "content": "Continue"}]}) + "\n")
+            f.write("not json\n")
+        
+        # Simulate a killed run: two results already written, then a torn line
+        with open(out_path, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"id": "q0", "reply": "earlier"}) + "\n")
+            f.write(json.dumps({"id": "q1", "reply": "earlier"}) + "\n")
+            f.write('{"id": "q2", "rep')
+        
+        with use_mock_server(reply=reply, latency=0.05) as server:
+            start = time.perf_counter()
+            stats = run_batch(prompts_path, out_path, persona="technical", concurrency=10, progress_every=0)
+            elapsed = time.perf_counter() - start
+            requests = server.request_count
+        
+        print(f"   {stats} in {elapsed:.2f}s")
+        assert stats["skipped"] == 2 and stats["completed"] == 20 and stats["failed"] == 1
+        assert requests == 20 and elapsed < 0.05 * 20 / 2
+        
+        with open(out_path, encoding="utf-8") as f:
+            records = [json.loads(line) for line in f.read().splitlines()[3:]]
+        by_id = {record["id"]: record for record in records}
+        assert by_id[1]["reply"] == "2 messages, last: Plain string prompt"
+        assert by_id[1]["persona"] == "technical"
+        assert by_id["conv"]["persona"] == "creative"
+        assert by_id["conv"]["reply"] == "4 messages, last: Continue"
+        assert by_id["q5"]["usage"]["completion_tokens"] > 0
+        assert by_id[23]["error"].startswith("invalid input")
+        
+        # A second run has nothing left to do; the invalid line is not reported again
+        with open(out_path, encoding="utf-8") as f:
+            lines = len(f.readlines())
+        with use_mock_server() as server:
+            stats = run_batch(prompts_path, out_path, concurrency=4, progress_every=0)
+            assert server.request_count == 0
+        assert stats["skipped"] == 23 and stats["completed"] == 0 and stats["failed"] == 0
+        with open(out_path, encoding="utf-8") as f:
+            assert len(f.readlines()) == lines
+        
+        # Failed items report the attempts spent on them
+        failing_path = os.path.join(tmp, "failing.jsonl")
+        with open(failing_path, "w", encoding="utf-8") as f:
+            f.write(json.dumps("Rejected prompt") + "\n")
+        failing_out = os.path.join(tmp, "failing_results.jsonl")
+        with use_mock_server(faults=[{"status": 400}]):
+            stats = run_batch(failing_path, failing_out, progress_every=0)
+        with open(failing_out, encoding="utf-8") as f:
+            record = json.loads(f.readline())
+        assert stats["failed"] == 1 and record["error"] and record["attempts"] == 1
+
+def test_stable_history_packing():
+    """Test stable packing keeps the prompt prefix fixed between window jumps"""
+    print("\n" + "=" * 50)
+    print("TESTING STABLE HISTORY PACKING")
+    print("=" * 50)
+    
+    from utils.token_counter import message_tokens
+    
+    reply = "An answer of a moderate length " * 5
+    with use_mock_server(reply=reply, prompt_cache=True) as server:
+        session = llm_helpers.ChatSession("technical", max_prompt_tokens=600, packing="stable")
+        for i in range(30):
+            session.chat(f"Question {i}")
+        bodies = server.requests
+        stats = session.get_conversation_stats()
+    
+    starts = [json.dumps(body["messages"][1]) for body in bodies]
+    jumps = sum(1 for a, b in zip(starts, starts[1:]) if a != b)
+    hit_rate = stats["cached_tokens"] / stats["prompt_tokens"]
+    print(f"   {len(bodies)} requests, {jumps} window jumps, {hit_rate:.0%} of prompt tokens cached")
+    assert 0 < jumps < 10
+    assert all(sum(message_tokens(m) for m in body["messages"]) <= 600 for body in bodies)
+    # Between jumps each request extends the previous one byte for byte
+    for previous, current in zip(bodies, bodies[1:]):
+        if previous["messages"][1] == current["messages"][1]:
+            assert current["messages"][:len(previous["messages"])] == previous["messages"]
+    assert session.get_last_usage()["cached_tokens"] > 0 and hit_rate > 0.5
+    
+    # Sliding packing (the default) moves the window every turn once it is full
+    with use_mock_server(reply=reply, prompt_cache=True):
+        sliding = llm_helpers.ChatSession("technical", max_prompt_tokens=600, packing="sliding")
+        for i in range(30):
+            sliding.chat(f"Question {i}")
+    assert sliding.get_conversation_stats()["cached_tokens"] < stats["cached_tokens"]
+    
+    # Models that take explicit breakpoints get cache_control hints
+    original_model = llm_helpers.DEFAULT_OPENAI_MODEL
+    llm_helpers.DEFAULT_OPENAI_MODEL = "anthropic/claude-sonnet-4"
+    try:
+        messages = session._request_kwargs()["messages"]
+    finally:
+        llm_helpers.DEFAULT_OPENAI_MODEL = original_model
+    assert messages[0]["content"][0]["cache_control"] == {"type": "ephemeral"}
+    assert messages[-1]["content"][0]["cache_control"] == {"type": "ephemeral"}
+    assert isinstance(messages[1]["content"], str)
+    assert isinstance(session._request_kwargs()["messages"][0]["content"], str)
+
+def test_persona_registry():
+    """Test personas load lazily from a directory and hot-reload on change"""
+    print("\n" + "=" * 50)
+    print("TESTING PERSONA REGISTRY")
+    print("=" * 50)
+    
+    from utils.persona_registry import PersonaRegistry
+    import tempfile
+    
+    def write(path, data, bump=0):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        # Make the change visible even on filesystems with coarse mtimes
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + bump))
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        for i in range(300):
+            write(os.path.join(tmp, f"persona_{i:03d}.json"), {"prompt": f"You are persona {i}."})
+        with open(os.path.join(tmp, "pirate.yaml"), "w", encoding="utf-8") as f:
+            f.write("name: Pirate\nprompt: >-\n  You talk like a pirate.\n")
+        
+        start = time.perf_counter()
+        registry = PersonaRegistry(tmp, check_interval=0)
+        index_ms = (time.perf_counter() - start) * 1000
+        # Indexing parses nothing; files are read on first use
+        assert not registry._loaded
+        assert registry["pirate"] == {"name": "Pirate", "prompt": "You talk like a pirate."}
+        assert registry["persona_007"]["name"] == "Persona 007"
+        assert len(registry._loaded) == 2
+        start = time.perf_counter()
+        names = list(registry)
+        list_ms = (time.perf_counter() - start) * 1000
+        print(f"   Indexed 301 persona files in {index_ms:.1f} ms, listed (parsed) in {list_ms:.1f} ms")
+        assert len(names) == 301 and "pirate" in registry
+        
+        # A new file that never parsed is left out everywhere instead of breaking readers
+        with open(os.path.join(tmp, "broken.yaml"), "w", encoding="utf-8") as f:
+            f.write("prompt: [unclosed\n")
+        write(os.path.join(tmp, "no_prompt.json"), {"name": "No prompt"})
+        assert "broken" not in registry and registry.get("no_prompt") is None
+        assert "broken" not in list(registry) and len(registry) == 301
+        assert len(dict(registry.items())) == 301
+        try:
+            registry["broken"]
+            assert False, "a broken persona should be absent"
+        except KeyError:
+            pass
+        # Fixing the file brings it in
+        write(os.path.join(tmp, "broken.yaml"), {"prompt": "You are fixed."}, bump=10**9)
+        assert registry["broken"]["name"] == "Broken"
+        os.remove(os.path.join(tmp, "broken.yaml"))
+        os.remove(os.path.join(tmp, "no_prompt.json"))
+        
+        original = llm_helpers.SYSTEM_PROMPTS
+        llm_helpers.SYSTEM_PROMPTS = registry
+        try:
+            assert "pirate" in llm_helpers.get_available_personas()
+            session = llm_helpers.ChatSession("pirate")
+            with use_mock_server() as server:
+                session.chat("Ahoy")
+                # Edit the file under a live session: the next request uses the new prompt
+                write(os.path.join(tmp, "pirate.yaml"), {"name": "Pirate", "prompt": "You talk like a grumpy pirate."}, bump=10**9)
+                session.chat("Again")
+                # A broken edit keeps the last good version
+                with open(os.path.join(tmp, "pirate.yaml"), "w", encoding="utf-8") as f:
+                    f.write("prompt: [unclosed\n")
+                os.utime(os.path.join(tmp, "pirate.yaml"), ns=(0, 2 * 10**18))
+                session.chat("Once more")
+            prompts = [body["messages"][0]["content"] for body in server.requests]
+            assert prompts == ["You talk like a pirate.", "You talk like a grumpy pirate.", "You talk like a grumpy pirate."]
+            assert len(session.message_history) == 7
+            
+            # New files appear and removed ones disappear without a restart
+            write(os.path.join(tmp, "chef.json"), {"name": "Chef", "prompt": "You are a chef."})
+            assert llm_helpers.set_system_prompt("chef").startswith("[OK] Switched to Chef")
+            os.remove(os.path.join(tmp, "persona_000.json"))
+            assert "persona_000" not in registry and len(registry) == 301
+            assert llm_helpers.set_system_prompt("persona_000").startswith("[ERROR]")
+            with open(os.path.join(tmp, "persona_001.json"), "w", encoding="utf-8") as f:
+                f.write("{not json")
+            # A parsed persona broken by an edit keeps its last good version
+            assert llm_helpers.get_persona_name("persona_001") == "Persona 001"
+            
+            # Without professional.yaml, sessions fall back to the first available persona
+            assert "professional" not in registry
+            assert llm_helpers.default_persona() == "chef"
+            assert llm_helpers.ChatSession().get_current_persona() == "chef"
+            assert llm_helpers.ChatSession("missing").get_current_persona() == "chef"
+            
+            # The CLI parses persona files only to check --persona, and then only that one
+            import main
+            llm_helpers.SYSTEM_PROMPTS = PersonaRegistry(tmp, check_interval=0)
+            assert main.parse_args(["--batch", "prompts.jsonl"]).batch == "prompts.jsonl"
+            assert not llm_helpers.SYSTEM_PROMPTS._loaded
+            assert main.parse_args(["--persona", "chef"]).persona == "chef"
+            assert list(llm_helpers.SYSTEM_PROMPTS._loaded) == ["chef"]
+            assert main.parse_args(["--export", "out.jsonl", "--persona", "retired"]).persona == "retired"
+            try:
+                main.parse_args(["--persona", "missing"])
+                assert False, "an unknown persona should be rejected"
+            except SystemExit:
+                pass
+        finally:
+            llm_helpers.SYSTEM_PROMPTS = original
+            llm_helpers.set_system_prompt("professional")
+    
+    # The shipped personas come from the personas/ directory
+    assert set(llm_helpers.get_available_personas()) == {"professional", "creative", "technical"}
+
+def test_lazy_imports():
+    """Test offline use of llm_helpers never imports the openai SDK"""
+    print("\n" + "=" * 50)
+    print("TESTING LAZY IMPORTS")
+    print("=" * 50)
+    
+    import subprocess
+    import sys
+    
+    # A fresh interpreter: this process has long since imported openai
+    script = """
+import sys, tempfile, os
+from utils import llm_helpers
+import main, api_server
+from utils.resilience import classify_error
+session = llm_helpers.ChatSession("technical")
+session.message_history.append({"role": "user", "content": "Hi"})
+session.get_context_window()
+session.get_conversation_stats()
+llm_helpers.get_available_personas()
+llm_helpers.set_system_prompt("creative")
+classify_error(ValueError("boom"))
+with tempfile.TemporaryDirectory() as tmp:
+    path = os.path.join(tmp, "c.jsonl")
+    session.save_conversation(path)
+    session.load_conversation(path)
+    session.close()
+print(sorted(name for name in sys.modules if name == "openai" or name.startswith("openai.")))
+"""
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    elapsed = time.perf_counter() - start
+    print(f"   Offline workflow in a fresh interpreter: {elapsed:.2f}s")
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == "[]"
+
+def test_streamlit_paging():
+    """Test the Streamlit view renders only the newest messages and builds exports only on download"""
+    print("\n" + "=" * 50)
+    print("TESTING STREAMLIT PAGING")
+    print("=" * 50)
+    
+    try:
+        from streamlit.testing.v1 import AppTest
+    except ImportError:
+        print("   Streamlit not installed, skipped")
+        return
+    import streamlit_app
+    
+    session = llm_helpers.ChatSession("professional")
+    messages = [{"role": "user" if i % 2 == 0 else "assistant", "content": f"Message {i}"} for i in range(120)]
+    app = AppTest.from_file("streamlit_app.py", default_timeout=30)
+    app.session_state["chat_session"] = session
+    app.session_state["messages"] = messages
+    app.run()
+    assert not app.exception
+    assert len(app.chat_message) == streamlit_app.MESSAGES_PER_PAGE
+    assert app.chat_message[-1].markdown[0].value == "Message 119"
+    assert len(app.get("download_button")) == 1
+    # The download builds its file when clicked; nothing of it is kept in session state
+    assert "export_payload" not in app.session_state
+    print(f"   120 messages, {len(app.chat_message)} rendered")
+    
+    app.button[0].click().run()
+    assert len(app.chat_message) == 2 * streamlit_app.MESSAGES_PER_PAGE
+    
+    app.selectbox(key="export_format").select("csv").run()
+    assert not app.exception and len(app.get("download_button")) == 1
+    exported = streamlit_app.export_chat_history(messages, "professional", "csv").decode("utf-8").splitlines()
+    assert exported[0] == "conversation_id,persona,role,content,created"
+    assert len(exported) == len(messages) + 1
+    print("   Download button exports on click, format selectable")
+
+def test_request_coalescing():
+    """Test concurrent identical requests share one upstream call, stream, error and cancellation"""
+    print("\n" + "=" * 50)
+    print("TESTING REQUEST COALESCING")
+    print("=" * 50)
+    
+    from concurrent.futures import ThreadPoolExecutor
+    from utils.resilience import ClientRequestError
+    
+    llm_helpers.enable_request_coalescing()
+    
+    def ask_all(method, count, message="Same opening question"):
+        sessions = [llm_helpers.ChatSession("professional") for _ in range(count)]
+        with ThreadPoolExecutor(max_workers=count) as pool:
+            if method == "stream":
+                return list(pool.map(lambda s: "".join(s.chat_stream(message)), sessions))
+            return list(pool.map(lambda s: s.chat(message), sessions))
+    
+    async def aask_all(count, stream, message="Same opening question"):
+        sessions = [llm_helpers.ChatSession("professional") for _ in range(count)]
+        if stream:
+            async def read(session):
+                return "".join([delta async for delta in session.achat_stream(message)])
+            return await asyncio.gather(*(read(session) for session in sessions))
+        return await asyncio.gather(*(session.achat(message) for session in sessions))
+    
+    # Sync and async, plain and streamed: many callers, one upstream request each
+    with use_mock_server(reply="Shared reply for everyone", latency=0.2, token_delay=0.01) as server:
+        before = llm_helpers.get_metrics_summary()["coalesced"]
+        assert ask_all("chat", 10) == ["Shared reply for everyone"] * 10
+        assert ask_all("stream", 10) == ["Shared reply for everyone"] * 10
+        assert asyncio.run(aask_all(20, stream=False)) == ["Shared reply for everyone"] * 20
+        assert asyncio.run(aask_all(20, stream=True)) == ["Shared reply for everyone"] * 20
+        print(f"   60 identical calls -> {server.request_count} upstream requests")
+        assert server.request_count == 4
+        assert llm_helpers.get_metrics_summary()["coalesced"] - before == 56
+        
+        # Different prompts are never merged
+        async def distinct():
+            return await asyncio.gather(*(llm_helpers.ChatSession("professional").achat(f"Question {i}") for i in range(5)))
+        asyncio.run(distinct())
+        assert server.request_count == 9
+    
+    # One upstream failure is raised to every waiter
+    with use_mock_server(latency=0.2, faults=[{"status": 400}]) as server:
+        async def failing():
+            return await asyncio.gather(*(llm_helpers.ChatSession("professional").achat("Bad request")
+                                          for _ in range(5)), return_exceptions=True)
+        errors = asyncio.run(failing())
+        assert server.request_count == 1
+        assert all(isinstance(error, ClientRequestError) for error in errors)
+        print(f"   Upstream 400 raised to all {len(errors)} waiters")
+    
+    # Cancelling one subscriber leaves the shared stream running for the others;
+    # once every subscriber is gone the next identical request starts afresh
+    with use_mock_server(reply="one two three four five six", token_delay=0.05) as server:
+        async def cancel_one():
+            sessions = [llm_helpers.ChatSession("professional") for _ in range(3)]
+            first_delta = asyncio.Event()
+            
+            async def read(session, index):
+                parts = []
+                async for delta in session.achat_stream("Slow question"):
+                    parts.append(delta)
+                    first_delta.set()
+                return "".join(parts)
+            
+            tasks = [asyncio.create_task(read(session, i)) for i, session in enumerate(sessions)]
+            await first_delta.wait()
+            tasks[0].cancel()
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+            assert isinstance(results[0], asyncio.CancelledError)
+            assert results[1:] == ["one two three four five six"] * 2
+            
+            # Abandon a stream entirely, then ask again
+            stream = llm_helpers.ChatSession("professional").achat_stream("Abandoned question")
+            await stream.__anext__()
+            await stream.aclose()
+            # A new identical stream must not join the one being torn down
+            stream = llm_helpers.ChatSession("professional").achat_stream("Abandoned question")
+            return "".join([delta async for delta in stream])
+        
+        assert asyncio.run(cancel_one()) == "one two three four five six"
+        assert server.request_count == 3
+        print("   Cancelled subscribers do not affect the others")
+    
+    # Cancelling the caller that started a call does not cancel it for the waiters
+    with use_mock_server(reply="Still delivered", latency=0.3) as server:
+        async def cancel_leader():
+            leader = asyncio.create_task(llm_helpers.ChatSession("professional").achat("Same"))
+            await asyncio.sleep(0.05)
+            follower = asyncio.create_task(llm_helpers.ChatSession("professional").achat("Same"))
+            await asyncio.sleep(0.05)
+            leader.cancel()
+            return await follower
+        
+        assert asyncio.run(cancel_leader()) == "Still delivered"
+        assert server.request_count == 1
+    
+    # Sync: once every reader has left, the upstream stream is closed, not read to the end
+    with use_mock_server(reply="one two three four", token_delay=1.0) as server:
+        import threading
+        stream = llm_helpers.ChatSession("professional").chat_stream("Walked away")
+        next(stream)
+        stream.close()
+        pumps = [thread for thread in threading.enumerate() if thread.name == "single-flight"]
+        for thread in pumps:
+            thread.join(timeout=0.5)
+        assert pumps and not any(thread.is_alive() for thread in pumps)
+        print("   Abandoned sync stream closed upstream")
+    
+    # ...and not retried either
+    from utils.resilience import ProviderError, RetryPolicy, call_with_retries
+    from utils.single_flight import SingleFlight
+    attempts = []
+    
+    def produce(meta):
+        def attempt(timeout):
+            meta.check()
+            attempts.append(timeout)
+            raise ProviderError("still down")
+        stream, _ = call_with_retries(attempt, RetryPolicy(max_attempts=50, base_delay=0.05, max_delay=0.05))
+        yield from stream
+    
+    subscription = SingleFlight().stream("retried", produce)
+    time.sleep(0.1)
+    subscription.close()
+    made = len(attempts)
+    time.sleep(0.3)
+    assert len(attempts) <= made + 1
+    
+    # Coalescing off (the default): every caller goes upstream
+    llm_helpers.disable_request_coalescing()
+    with use_mock_server(latency=0.1) as server:
+        ask_all("chat", 5)
+        assert server.request_count == 5
+
+def test_rate_limiter():
+    """Test the shared token-bucket limiter: pacing, token settlement, fair share and 429 pauses"""
+    print("\n" + "=" * 50)
+    print("TESTING RATE LIMITER")
+    print("=" * 50)
+    
+    from concurrent.futures import ThreadPoolExecutor
+    from utils.rate_limiter import RateLimiter
+    
+    # 100 requests/s with room for one at a time; threads and async tasks share the buckets
+    limiter = RateLimiter(requests_per_minute=6000, burst_seconds=0.01)
+    
+    async def async_side():
+        await asyncio.gather(*(limiter.aacquire() for _ in range(10)))
+    
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=10) as pool:
+        futures = [pool.submit(limiter.acquire) for _ in range(10)]
+        asyncio.run(async_side())
+        for future in futures:
+            future.result()
+    elapsed = time.perf_counter() - start
+    print(f"   20 requests at 100/s from threads and tasks: {elapsed:.2f}s")
+    assert 0.17 <= elapsed < 1.0
+    assert limiter.stats()["granted"] == 20
+    
+    # Tokens: the estimate is charged up front and corrected with the real usage
+    limiter = RateLimiter(tokens_per_minute=60_000, burst_seconds=1)
+    reservation = limiter.acquire(200)
+    assert round(limiter.tokens.level) == 800
+    reservation.settle(700)
+    assert round(limiter.tokens.level) <= 300
+    start = time.perf_counter()
+    limiter.acquire(1000)
+    assert time.perf_counter() - start >= 0.6
+    
+    # Fair share: a user with a backlog does not delay a newcomer by the whole backlog
+    limiter = RateLimiter(requests_per_minute=6000, burst_seconds=0.01)
+    order = []
+    
+    async def fair():
+        async def ask(user):
+            await limiter.aacquire(user=user)
+            order.append(user)
+        busy = [asyncio.create_task(ask("busy")) for _ in range(10)]
+        await asyncio.sleep(0.02)
+        await asyncio.gather(ask("light"), ask("light"), *busy)
+    
+    asyncio.run(fair())
+    print(f"   Grant order: {''.join('L' if user == 'light' else 'b' for user in order)}")
+    assert order.index("light") <= 4 and len(order) - 1 - order[::-1].index("light") <= 6
+    
+    # Cancelled waiters give their place back
+    limiter = RateLimiter(requests_per_minute=60, burst_seconds=1)
+    limiter.acquire()
+    
+    async def cancel_waiter():
+        task = asyncio.create_task(limiter.aacquire())
+        await asyncio.sleep(0.05)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+    
+    asyncio.run(cancel_waiter())
+    assert limiter.stats()["queued"] == 0
+    
+    # End to end: a burst stays under a provider quota instead of failing with 429s
+    llm_helpers.enable_rate_limit(requests_per_minute=20 * 60 * 0.9, burst_seconds=0.25)
+    try:
+        with use_mock_server(quota=(20, 1.0)) as server:
+            async def burst():
+                sessions = [llm_helpers.ChatSession("technical", user=f"user{i % 3}") for i in range(30)]
+                return await asyncio.gather(*(s.achat(f"Question {i}") for i, s in enumerate(sessions)))
+            replies = asyncio.run(burst())
+            assert len(replies) == 30
+            stats = llm_helpers.get_rate_limit_stats()
+            print(f"   30 chats under a 20/s quota: {server.rejected} upstream 429s, avg queue {stats['avg_wait']:.2f}s")
+            assert server.rejected <= 2
+        
+        # A 429 that gets through pauses everybody for its Retry-After
+        with use_mock_server(faults=[{"status": 429, "retry_after": 0.3}]) as server:
+            pauses = llm_helpers.rate_limiter.pauses
+            start = time.perf_counter()
+            llm_helpers.ChatSession("technical").chat("Hello")
+            assert llm_helpers.rate_limiter.pauses == pauses + 1
+            assert time.perf_counter() - start >= 0.3
+    finally:
+        llm_helpers.disable_rate_limit()
+
+def test_semantic_cache():
+    """Test paraphrased first-turn questions are answered from the semantic cache"""
+    print("\n" + "=" * 50)
+    print("TESTING SEMANTIC CACHE")
+    print("=" * 50)
+    
+    import numpy as np
+    from utils.semantic_cache import SemanticCache, content_words, question_key
+    
+    assert question_key("How do I start a business?") == question_key("how to start a business")
+    assert question_key("Is Python faster than Java?") != question_key("Is Java faster than Python?")
+    
+    llm_helpers.enable_semantic_cache()
+    try:
+        with use_mock_server(reply=lambda messages: f"Answer to: {messages[-1]['content']}") as server:
+            first = llm_helpers.ChatSession("professional")
+            original = first.chat("How do I start a business?")
+            
+            paraphrase = llm_helpers.ChatSession("professional")
+            assert paraphrase.chat("how to start a business") == original
+            assert paraphrase.cache_hits == 1 and server.request_count == 1
+            assert paraphrase.get_last_response_timing()["total_time"] == 0.0
+            streamed = "".join(llm_helpers.ChatSession("professional").chat_stream("how do I start a business"))
+            assert streamed == original and server.request_count == 1
+            
+            # Other personas, unrelated questions and later turns go upstream
+            assert llm_helpers.ChatSession("creative").chat("how to start a business") != original
+            assert llm_helpers.ChatSession("professional").chat("What is the capital of France?") != original
+            assert first.chat("how to start a business") == "Answer to: how to start a business"
+            assert server.request_count == 4
+            
+            stats = llm_helpers.semantic_cache.stats()
+            print(f"   {server.request_count} upstream calls for 6 questions, "
+                  f"{stats['semantic_avg_lookup_ms']:.2f} ms per lookup")
+            assert stats["semantic_hits"] == 2 and stats["semantic_entries"] == 3
+    finally:
+        llm_helpers.disable_semantic_cache()
+    
+    # Questions that look alike but ask something else never get each other's answer
+    cache = SemanticCache()
+    near_misses = [
+        ("Is Python faster than Java?", "Is Java faster than Python?"),
+        ("write a story about a dog", "write a poem about a dog"),
+        ("why does the build work", "why does the build fail"),
+        ("Should I buy a house?", "Should I not buy a house?"),
+        ("How do I start a business?", "How do I start a podcast?"),
+        ("convert celsius to fahrenheit", "convert fahrenheit to celsius"),
+    ]
+    for cached, asked in near_misses:
+        cache.store("professional", cached, cached)
+        assert cache.lookup("professional", asked) is None, asked
+    assert cache.lookup("professional", "is python faster than java")[0] == "Is Python faster than Java?"
+    # Synonyms need a real embedding model: a miss, not a wrong answer
+    assert cache.lookup("professional", "How do I start a company?") is None
+    
+    # With an embedding model, paraphrases without shared words hit and look-alikes stay under the threshold.
+    # A stub model: one dimension per concept, so only synonyms land on the same vector
+    concepts = {}
+    for index, words in enumerate((("start", "launch", "open"), ("business", "company", "firm"), ("podcast",))):
+        for word in words:
+            concepts[content_words(word)[0]] = index
+    
+    def embed(text):
+        vector = np.zeros(4, dtype=np.float32)
+        for word in content_words(text):
+            vector[concepts.get(word, 3)] += 1
+        return vector / np.linalg.norm(vector)
+    
+    cache = SemanticCache(embed_fn=embed)
+    cache.store("professional", "How do I start a business?", "business answer")
+    answer, similarity = cache.lookup("professional", "How can I launch a company?")
+    assert answer == "business answer" and similarity > 0.99
+    assert cache.lookup("professional", "How do I start a podcast?") is None
+    assert cache.lookup("professional", "how to start a business") == ("business answer", 1.0)
+    
+    # A full namespace overwrites its oldest entry
+    cache = SemanticCache(max_entries=2)
+    for question in ("Explain how machine learning works", "How do I bake bread?", "How do I fix a flat tire?"):
+        cache.store("technical", question, question)
+    assert cache.lookup("technical", "Explain how machine learning works") is None
+    assert cache.lookup("technical", "how to fix a flat tire")[0] == "How do I fix a flat tire?"
+
+def test_persona_comparison():
+    """Test /compare asks every persona concurrently and keeps each persona's history"""
+    print("\n" + "=" * 50)
+    print("TESTING PERSONA COMPARISON")
+    print("=" * 50)
+    
+    from utils.persona_compare import PersonaComparison
+    
+    personas = llm_helpers.get_available_personas()
+    reply = lambda messages: f"{len(messages)} messages for {messages[0]['content'][:30]}"
+    with use_mock_server(reply=reply, latency=0.2, token_delay=0.01) as server:
+        comparison = PersonaComparison()
+        results = comparison.ask("What is a budget?")
+        assert list(results) == personas
+        for persona in personas:
+            prompt = llm_helpers.SYSTEM_PROMPTS[persona]["prompt"][:30]
+            assert results[persona]["response"] == f"2 messages for {prompt}"
+        
+        # Follow-ups continue each persona's own conversation
+        start = time.perf_counter()
+        results = comparison.ask("And a forecast?")
+        elapsed = time.perf_counter() - start
+        print(f"   {len(personas)} personas answered in {elapsed:.2f}s")
+        # Concurrent: about one persona's latency, not the sum
+        assert elapsed < 0.2 * len(personas) * 0.75
+        for persona in personas:
+            assert results[persona]["response"].startswith("4 messages")
+            assert len(comparison.sessions[persona].message_history) == 5
+        assert server.request_count == 2 * len(personas)
+        
+        # Stopping early leaves no dangling threads waiting to be read
+        events = comparison.stream("Third question?")
+        assert next(events)[1] == "delta"
+        events.close()
+        
+        comparison.clear()
+        assert all(len(session.message_history) == 1 for session in comparison.sessions.values())
+    
+    try:
+        from streamlit.testing.v1 import AppTest
+    except ImportError:
+        print("   Streamlit not installed, skipped the web view")
+        return
+    with use_mock_server(reply="Side by side answer"):
+        app = AppTest.from_file("streamlit_app.py", default_timeout=30)
+        app.run()
+        app.toggle[0].set_value(True).run()
+        app.chat_input[0].set_value("Compare this").run()
+        assert not app.exception
+        rounds = app.session_state["compare_rounds"]
+        assert [round_["answers"] for round_ in rounds] == [dict.fromkeys(personas, "Side by side answer")]
+        assert len(app.columns) >= len(personas)
+        # The single-persona chat was not touched
+        assert app.session_state["messages"] == []
+    print("   Streamlit compare view streamed one column per persona")
+
+def test_mock_backend():
+    """Test the pluggable backend switch and the mock server's error injection"""
+    print("\n" + "=" * 50)
+    print("TESTING MOCK BACKEND")
+    print("=" * 50)
+    
+    from utils.resilience import LLMError
+    from utils.mock_server import MockLLMServer
+    
+    server = llm_helpers.use_backend("mock", reply="Offline reply", tokens_per_second=200)
+    try:
+        assert llm_helpers.get_backend_name() == "mock"
+        assert server.token_delay == 1 / 200
+        session = llm_helpers.ChatSession()
+        assert session.chat("Hello?") == "Offline reply"
+        assert "".join(session.chat_stream("Again?")) == "Offline reply"
+        assert server.request_count == 2
+        
+        # Same seed, same requests: the same ones fail
+        outcomes = []
+        for _ in range(2):
+            injected = MockLLMServer(error_rate=0.3, seed=7)
+            outcomes.append([injected._record_request({}) is not None for _ in range(50)])
+        assert outcomes[0] == outcomes[1] and 5 < sum(outcomes[0]) < 25
+        
+        # A stream that drops midway surfaces as an error after the first tokens
+        server.faults = [{"disconnect_after": 1}]
+        received = []
+        try:
+            for delta in session.chat_stream("Cut off?"):
+                received.append(delta)
+            assert False, "disconnect should raise"
+        except LLMError:
+            pass
+        assert received == ["Offline "]
+        print(f"   {server.request_count} requests served offline, injected faults behaved")
+    finally:
+        llm_helpers.use_backend("api")
+    assert llm_helpers.get_backend_name() == "api"
+    
+    try:
+        llm_helpers.use_backend("nowhere")
+        assert False, "unknown backend should raise"
+    except ValueError:
+        pass
+
+def test_message_history():
+    """Test the compact history keeps counts and token totals in step with every change"""
+    print("\n" + "=" * 50)
+    print("TESTING MESSAGE HISTORY")
+    print("=" * 50)
+    
+    import sys
+    from utils.message_history import HistoryView, Message, MessageHistory
+    from utils.token_counter import message_tokens
+    
+    message = Message("user", "Hello there")
+    assert message == {"role": "user", "content": "Hello there"}
+    assert dict(message) == message.to_dict() and message.get("name") is None
+    assert not hasattr(message, "__dict__") and sys.getsizeof(message) < sys.getsizeof(message.to_dict())
+    assert Message("".join(["us", "er"]), "x").role is message.role
+    try:
+        message["content"] = "changed"
+        assert False, "messages are read-only"
+    except TypeError:
+        pass
+    imported = Message.from_dict({"role": "assistant", "content": "Hi", "name": "bot"})
+    assert imported["name"] == "bot" and imported.to_dict() == {"role": "assistant", "content": "Hi", "name": "bot"}
+    
+    def check(history):
+        for role in ("system", "user", "assistant"):
+            assert history.role_count(role) == sum(1 for m in history if m["role"] == role)
+        assert history.tokens == sum(message_tokens(m) for m in history)
+    
+    history = MessageHistory([{"role": "system", "content": "Be brief"}])
+    history.extend({"role": "user" if i % 2 == 0 else "assistant", "content": f"Message {i}"} for i in range(10))
+    check(history)
+    history.append({"role": "user", "content": "A much longer message " * 10})
+    history[0] = {"role": "system", "content": "Be very brief"}
+    del history[3]
+    history.insert(1, {"role": "assistant", "content": "Inserted"})
+    check(history)
+    history[2:6] = [{"role": "user", "content": "Replaced"}]
+    del history[-2:]
+    check(history)
+    history.pop()
+    history.clear()
+    check(history)
+    
+    session = llm_helpers.ChatSession("technical")
+    session.message_history.extend({"role": "user" if i % 2 == 0 else "assistant", "content": f"Turn {i}"} for i in range(1000))
+    view = session.get_conversation_history()
+    assert isinstance(view, HistoryView) and not hasattr(view, "append")
+    stats = session.get_conversation_stats()
+    assert (stats["user_messages"], stats["assistant_messages"], stats["total_messages"]) == (500, 500, 1000)
+    assert stats["history_tokens"] == sum(message_tokens(m) for m in view)
+    # The view is live: no copy to go stale
+    session.message_history.append({"role": "user", "content": "One more"})
+    assert len(view) == 1002 and view[-1]["content"] == "One more"
+    assert session.get_conversation_stats()["user_messages"] == 501
+    
+    # Replacing the history with a plain list keeps the counts working
+    session.message_history = [{"role": "system", "content": "New prompt"}, {"role": "user", "content": "Hi"}]
+    assert isinstance(session.message_history, MessageHistory)
+    assert session.get_conversation_stats()["user_messages"] == 1
+    print(f"   Message: {sys.getsizeof(message)} bytes vs dict {sys.getsizeof(message.to_dict())} bytes")
+
+def test_streaming_exporters():
+    """Test exports stream from the database in flat memory, filtered by persona and time"""
+    print("\n" + "=" * 50)
+    print("TESTING STREAMING EXPORTERS")
+    print("=" * 50)
+    
+    import csv
+    import tempfile
+    import tracemalloc
+    from datetime import datetime
+    import persona_test
+    from utils import exporters
+    from utils.conversation_db import ConversationDatabase
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        db = ConversationDatabase(os.path.join(tmp, "export.db"))
+        try:
+            for i in range(5):
+                db.create_conversation("technical" if i % 2 else "creative", [
+                    {"role": "user", "content": f"Question {i}"}, {"role": "assistant", "content": f"Answer {i}"}])
+            # Pages of 3 rows must add up to every message, grouped by conversation
+            messages = list(db.iter_messages(batch_size=3))
+            assert [m["content"] for m in messages][:4] == ["Question 0", "Answer 0", "Question 1", "Answer 1"]
+            assert len(messages) == 10 and set(messages[0]) == set(exporters.CONVERSATION_FIELDS)
+            assert len(list(db.iter_messages(persona="technical", batch_size=3))) == 4
+            assert len(list(db.iter_messages(persona=["technical", "creative"]))) == 10
+            assert list(db.iter_messages(since=datetime(2100, 1, 1))) == []
+            assert len(list(db.iter_messages(until="2100-01-01"))) == 10
+            
+            entry = lambda persona, question: {"response": f"{persona}: {question}", "persona_info": {"name": persona.title(), "prompt": "p"}}
+            for date in ("2024-01-01T00:00:00", "2024-02-01T00:00:00"):
+                db.save_test_results({"test_date": date, "questions": ["Q1?", "Q2?"], "results": {
+                    persona: {"Q1?": entry(persona, "Q1?"), "Q2?": entry(persona, "Q2?")} for persona in ("technical", "creative")}})
+            records = list(exporters.test_result_records(db, since="2024-01-15"))
+            # Grouped by question, personas in stored order
+            assert [(r["question"], r["persona"]) for r in records] == [
+                ("Q1?", "technical"), ("Q1?", "creative"), ("Q2?", "technical"), ("Q2?", "creative")]
+            assert len(list(exporters.test_result_records(db, persona="creative"))) == 4
+            # A results file in memory filters the same way
+            results = {"test_date": "2024-02-01T00:00:00", "questions": ["Q1?", "Q2?"], "results": {
+                persona: {"Q1?": entry(persona, "Q1?"), "Q2?": entry(persona, "Q2?")} for persona in ("technical", "creative")}}
+            assert [r["persona"] for r in exporters.results_records(results, persona="creative")] == ["creative", "creative"]
+            assert len(list(exporters.results_records(results, since="2024-01-15"))) == 4
+            assert list(exporters.results_records(results, until=datetime(2024, 1, 15))) == []
+            
+            counts = {}
+            for format in ("jsonl", "csv", "md"):
+                path = os.path.join(tmp, f"conversations.{format}")
+                counts[format] = exporters.export_records(exporters.conversation_records(db, persona="creative"), path)
+            assert counts == {"jsonl": 6, "csv": 6, "md": 6}
+            with open(os.path.join(tmp, "conversations.jsonl"), encoding="utf-8") as f:
+                assert [json.loads(line)["content"] for line in f][:2] == ["Question 0", "Answer 0"]
+            with open(os.path.join(tmp, "conversations.csv"), encoding="utf-8", newline="") as f:
+                assert len(list(csv.DictReader(f))) == 6
+            with open(os.path.join(tmp, "conversations.md"), encoding="utf-8") as f:
+                assert f.read().count("## Conversation") == 3
+            try:
+                exporters.export_records([], os.path.join(tmp, "conversations.txt"))
+                assert False, "unknown format should raise"
+            except ValueError:
+                assert not os.path.exists(os.path.join(tmp, "conversations.txt"))
+            if "parquet" not in exporters.export_formats():
+                try:
+                    exporters.export_records(iter(messages), os.path.join(tmp, "conversations.parquet"))
+                    assert False, "Parquet without pyarrow should raise"
+                except ValueError as e:
+                    print(f"   Parquet: {e}")
+            else:
+                import pyarrow.parquet as pq
+                assert exporters.export_records(iter(messages), os.path.join(tmp, "conversations.parquet")) == 10
+                assert pq.read_table(os.path.join(tmp, "conversations.parquet")).num_rows == 10
+            
+            # The report streams the latest run from the database question by question
+            previous_db, llm_helpers._conversation_db = llm_helpers._conversation_db, db
+            report = None
+            try:
+                report = persona_test.generate_comparison_report(persona="technical")
+                with open(report, encoding="utf-8") as f:
+                    text = f.read()
+            finally:
+                llm_helpers._conversation_db = previous_db
+                if report and os.path.exists(report):
+                    os.remove(report)
+            assert "**Test Date:** 2024-02-01T00:00:00" in text and "### Technical" in text and "**Creative:**" not in text
+            assert text.index("### Question 1: Q1?") < text.index("**Technical:**\ntechnical: Q1?") < text.index("### Question 2: Q2?")
+        finally:
+            db.close()
+        
+        # Memory stays flat however many records are written
+        def many(count):
+            return ({"conversation_id": i // 10, "persona": "technical", "role": "user", "content": f"Message {i} " * 20,
+                     "created": "2024-01-01T00:00:00"} for i in range(count))
+        peaks = []
+        for count in (1_000, 50_000):
+            tracemalloc.start()
+            exporters.export_records(many(count), os.path.join(tmp, "many.jsonl"))
+            peaks.append(tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+        print(f"   Peak export memory: {peaks[0] // 1024} KB for 1k records, {peaks[1] // 1024} KB for 50k")
+        assert peaks[1] < 2 * peaks[0] + 64 * 1024
+
 if __name__ == "__main__":
     print("CUSTOM CHATBOT FUNCTIONALITY TEST")
     print("This test verifies the implementation without making API calls")
@@ -100,6 +1716,31 @@ if __name__ == "__main__":
         test_basic_functionality()
         test_persona_differences()
         test_error_handling()
+        test_streaming_chat()
+        test_session_isolation()
+        test_async_chat()
+        test_parallel_persona_runner()
+        test_response_cache()
+        test_token_budget_window()
+        test_rolling_summary()
+        test_conversation_journal()
+        test_conversation_database()
+        test_retry_and_circuit_breaker()
+        test_provider_routing()
+        test_call_metrics()
+        test_api_server()
+        test_batch_mode()
+        test_stable_history_packing()
+        test_persona_registry()
+        test_lazy_imports()
+        test_streamlit_paging()
+        test_request_coalescing()
+        test_rate_limiter()
+        test_semantic_cache()
+        test_persona_comparison()
+        test_mock_backend()
+        test_message_history()
+        test_streaming_exporters()
         
         print("\n" + "=" * 50)
         print("ALL TESTS COMPLETED SUCCESSFULLY!")
@@ -0,0 +1,184 @@
+"""
+Minimal asyncio HTTP/1.1 server for ASGI applications
+Used when uvicorn is not installed: keep-alive connections and chunked
+streaming responses, nothing more.
+"""
+
+from http import HTTPStatus
+from urllib.parse import unquote
+import asyncio
+import threading
+
+from config import MAX_REQUEST_BODY_BYTES
+
+
+def _status_line(status):
+    try:
+        phrase = HTTPStatus(status).phrase
+    except ValueError:
+        phrase = ""
+    return f"HTTP/1.1 {status} {phrase}\r\n".encode("latin-1")
+
+
+async def _reject(writer, status):
+    """Answer without reading the request body; the connection can't be reused after that"""
+    writer.write(_status_line(status) + b"content-length: 0\r\nconnection: close\r\n\r\n")
+    await writer.drain()
+    return False
+
+
+class ASGIServer:
+    """Serves an ASGI app on host:port (port 0 picks a free port)
+
+    serve_forever() blocks the calling thread; start()/stop() run the server
+    on a background thread's event loop, like MockLLMServer. Request bodies
+    larger than max_body_size bytes are refused with a 413.
+    """
+
+    def __init__(self, app, host="127.0.0.1", port=8000, max_body_size=MAX_REQUEST_BODY_BYTES):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.max_body_size = max_body_size
+        self._loop = None
+        self._task = None
+        self._thread = None
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}"
+
+    async def _run(self, ready=None):
+        server = await asyncio.start_server(self._handle_connection, self.host, self.port, backlog=1024)
+        self.port = server.sockets[0].getsockname()[1]
+        self._loop = asyncio.get_running_loop()
+        self._task = asyncio.current_task()
+        if ready is not None:
+            ready.set()
+        try:
+            await server.serve_forever()
+        except asyncio.CancelledError:
+            pass
+        finally:
+            server.close()
+
+    def serve_forever(self):
+        asyncio.run(self._run())
+
+    def start(self):
+        """Serve on a daemon thread; returns once the socket is listening"""
+        ready = threading.Event()
+        self._thread = threading.Thread(target=lambda: asyncio.run(self._run(ready)), daemon=True)
+        self._thread.start()
+        ready.wait()
+        return self
+
+    def stop(self):
+        if self._loop is not None and self._task is not None:
+            self._loop.call_soon_threadsafe(self._task.cancel)
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while await self._handle_request(reader, writer):
+                pass
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _handle_request(self, reader, writer):
+        """Serve one request; returns whether the connection stays open"""
+        request_line = await reader.readline()
+        try:
+            method, target, version = request_line.decode("latin-1").split()
+        except ValueError:
+            return False
+        headers = []
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers.append((name.strip().lower().encode("latin-1"), value.strip().encode("latin-1")))
+        header_map = dict(headers)
+        length = header_map.get(b"content-length", b"0")
+        if not length.isdigit():
+            return await _reject(writer, 400)
+        length = int(length)
+        if length > self.max_body_size:
+            return await _reject(writer, 413)
+        body = await reader.readexactly(length) if length else b""
+        keep_alive = version == "HTTP/1.1" and header_map.get(b"connection", b"").lower() != b"close"
+
+        path, _, query = target.partition("?")
+        peer = writer.get_extra_info("peername")
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0", "spec_version": "2.3"},
+            "http_version": version.partition("/")[2],
+            "method": method.upper(),
+            "scheme": "http",
+            "path": unquote(path),
+            "raw_path": path.encode("latin-1"),
+            "query_string": query.encode("latin-1"),
+            "root_path": "",
+            "headers": headers,
+            "server": (self.host, self.port),
+            "client": tuple(peer[:2]) if peer else None,
+        }
+        request_sent = False
+        finished = asyncio.Event()
+        state = {"started": False, "chunked": False, "done": False}
+
+        async def receive():
+            nonlocal request_sent
+            if not request_sent:
+                request_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            # Only reported once the response is over
+            await finished.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                response_headers = list(message.get("headers", []))
+                if b"content-length" not in {name.lower() for name, _ in response_headers}:
+                    state["chunked"] = True
+                    response_headers.append((b"transfer-encoding", b"chunked"))
+                if not keep_alive:
+                    response_headers.append((b"connection", b"close"))
+                head = _status_line(message["status"])
+                head += b"".join(name + b": " + value + b"\r\n" for name, value in response_headers)
+                writer.write(head + b"\r\n")
+                state["started"] = True
+            elif message["type"] == "http.response.body":
+                data = message.get("body", b"")
+                more = message.get("more_body", False)
+                if state["chunked"]:
+                    if data:
+                        writer.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+                    if not more:
+                        writer.write(b"0\r\n\r\n")
+                else:
+                    writer.write(data)
+                await writer.drain()
+                state["done"] = not more
+
+        try:
+            await self.app(scope, receive, send)
+        except Exception:
+            if not state["started"]:
+                writer.write(_status_line(500) + b"content-length: 0\r\nconnection: close\r\n\r\n")
+                await writer.drain()
+            return False
+        finally:
+            finished.set()
+        return keep_alive and state["done"]
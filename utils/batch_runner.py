@@ -0,0 +1,176 @@
+"""
+Non-interactive batch chat over a JSON Lines file of prompts
+Streams the input, runs items concurrently with request pacing, appends each
+result as soon as it completes and skips already-answered items on resume.
+"""
+
+import asyncio
+import json
+import os
+import time
+
+from utils import llm_helpers
+from utils.resilience import LLMError, RateLimitedError, RequestPacer
+
+
+def _parse_item(line, line_number, persona):
+    """Turn one input line into a work item
+
+    A line is a JSON string (the prompt) or an object with "prompt", or with
+    "messages" (a conversation whose last message is the user turn to answer).
+    Objects may set "id" (defaults to the line number) and "persona".
+    """
+    record = json.loads(line)
+    if isinstance(record, str):
+        record = {"prompt": record}
+    if not isinstance(record, dict):
+        raise ValueError("expected a JSON string or object")
+    item = {"id": record.get("id", line_number), "line": line_number, "persona": record.get("persona", persona)}
+    if item["persona"] not in llm_helpers.SYSTEM_PROMPTS:
+        raise ValueError(f"unknown persona '{item['persona']}'")
+    if "messages" in record:
+        messages = record["messages"]
+        if not messages or messages[-1].get("role") != "user":
+            raise ValueError("'messages' must end with a user message")
+        item["context"] = [{"role": m["role"], "content": m["content"]} for m in messages[:-1] if m["role"] != "system"]
+        item["prompt"] = messages[-1]["content"]
+    elif isinstance(record.get("prompt"), str):
+        item["context"] = []
+        item["prompt"] = record["prompt"]
+    else:
+        raise ValueError("missing 'prompt' or 'messages'")
+    return item
+
+
+def iter_batch_items(path, persona=llm_helpers.DEFAULT_PERSONA):
+    """Yield work items one line at a time; unparseable lines yield an item with an "error" """
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                yield _parse_item(line, line_number, persona)
+            except (ValueError, KeyError, TypeError, AttributeError) as e:
+                yield {"id": line_number, "line": line_number, "error": f"invalid input: {e}"}
+
+
+def _read_results(out_path):
+    """Ids with a successful result in out_path, and the last error recorded for every other id"""
+    done, errors = set(), {}
+    if not os.path.exists(out_path):
+        return done, errors
+    with open(out_path, "rb") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # Torn last line from a killed run
+                continue
+            if record.get("error") is None:
+                done.add(record["id"])
+            else:
+                errors[record["id"]] = record["error"]
+    return done, errors
+
+
+def completed_ids(out_path):
+    """Ids that already have a successful result in out_path"""
+    return _read_results(out_path)[0]
+
+
+def _open_output(out_path):
+    torn = False
+    if os.path.exists(out_path) and os.path.getsize(out_path):
+        with open(out_path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            torn = f.read(1) != b"\n"
+    out = open(out_path, "a", encoding="utf-8")
+    if torn:
+        out.write("\n")
+    return out
+
+
+async def _answer(item, pacer):
+    """Run one item in a fresh session; returns the result record"""
+    session = llm_helpers.ChatSession(item["persona"])
+    session.message_history.extend(item["context"])
+    result = {"id": item["id"], "line": item["line"], "persona": item["persona"]}
+    await pacer.wait()
+    start = time.perf_counter()
+    try:
+        result["reply"] = await session.achat(item["prompt"])
+        result["usage"] = session.get_last_usage()
+    except LLMError as e:
+        if isinstance(e, RateLimitedError):
+            # Hold back every worker, not just this one
+            pacer.pause(e.retry_after or 5.0)
+        result["error"] = str(e)
+        # The session only counts attempts of calls that succeeded
+        result["attempts"] = getattr(e, "attempts", session.last_attempts)
+    else:
+        result["attempts"] = session.last_attempts
+    result["latency"] = time.perf_counter() - start
+    return result
+
+
+async def _run_batch(input_path, out_path, persona, concurrency, requests_per_second, progress_every):
+    done, errors = _read_results(out_path)
+    pacer = RequestPacer(requests_per_second)
+    slots = asyncio.Semaphore(concurrency)
+    running = set()
+    stats = {"completed": 0, "failed": 0, "skipped": 0}
+    start = time.perf_counter()
+
+    def write(result):
+        out.write(json.dumps(result, ensure_ascii=False) + "\n")
+        out.flush()
+        stats["failed" if "error" in result else "completed"] += 1
+        finished = stats["completed"] + stats["failed"]
+        if progress_every and finished % progress_every == 0:
+            rate = finished / (time.perf_counter() - start)
+            print(f"   {finished} done ({stats['failed']} failed, {stats['skipped']} skipped), {rate:.1f}/s")
+
+    async def work(item):
+        try:
+            write(await _answer(item, pacer))
+        finally:
+            slots.release()
+
+    with _open_output(out_path) as out:
+        for item in iter_batch_items(input_path, persona):
+            if item["id"] in done:
+                stats["skipped"] += 1
+                continue
+            if "error" in item:
+                # An unchanged invalid line is reported once, not again on every resume
+                if errors.get(item["id"]) == item["error"]:
+                    stats["skipped"] += 1
+                else:
+                    write(item)
+                continue
+            # Waiting for a free slot before reading on keeps memory flat for any input size
+            await slots.acquire()
+            task = asyncio.create_task(work(item))
+            running.add(task)
+            task.add_done_callback(running.discard)
+        if running:
+            await asyncio.gather(*running)
+
+    stats["elapsed"] = time.perf_counter() - start
+    return stats
+
+
+def run_batch(input_path, out_path, persona=None, concurrency=8, requests_per_second=None, progress_every=100):
+    """Answer every prompt in input_path, appending one JSON result per line to out_path
+
+    Results are written in completion order and carry the item's id. Re-running
+    with the same out_path skips items that already succeeded, so a killed run
+    resumes where it stopped; failed items are retried and their new result is
+    appended (the last record for an id wins). Invalid input lines are
+    recorded once and skipped on resume while they stay the same.
+    """
+    persona = persona or llm_helpers.default_persona()
+    if persona not in llm_helpers.SYSTEM_PROMPTS:
+        available = ", ".join(llm_helpers.get_available_personas())
+        raise ValueError(f"Invalid persona '{persona}'. Available: {available}")
+    return asyncio.run(_run_batch(input_path, out_path, persona, concurrency, requests_per_second, progress_every))
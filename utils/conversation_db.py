@@ -0,0 +1,309 @@
+"""
+SQLite database for conversations, messages and persona test results
+WAL mode, indexed listing by persona/time and FTS5 full-text message search
+"""
+
+from datetime import datetime
+import json
+import sqlite3
+import threading
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversations (
+    id INTEGER PRIMARY KEY,
+    persona TEXT NOT NULL,
+    title TEXT,
+    created TEXT NOT NULL,
+    updated TEXT NOT NULL,
+    message_count INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_conversations_persona_updated ON conversations (persona, updated);
+CREATE INDEX IF NOT EXISTS idx_conversations_updated ON conversations (updated);
+
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    conversation_id INTEGER NOT NULL REFERENCES conversations (id) ON DELETE CASCADE,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    created TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_messages_conversation ON messages (conversation_id, id);
+
+CREATE TABLE IF NOT EXISTS test_runs (
+    id INTEGER PRIMARY KEY,
+    test_date TEXT NOT NULL,
+    questions TEXT NOT NULL,
+    total_time REAL
+);
+CREATE INDEX IF NOT EXISTS idx_test_runs_date ON test_runs (test_date);
+
+CREATE TABLE IF NOT EXISTS test_results (
+    id INTEGER PRIMARY KEY,
+    run_id INTEGER NOT NULL REFERENCES test_runs (id) ON DELETE CASCADE,
+    persona TEXT NOT NULL,
+    question TEXT NOT NULL,
+    result TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_test_results_run ON test_results (run_id, persona);
+"""
+
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5 (content, content='messages', content_rowid='id');
+CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+END;
+"""
+
+
+def _in_filter(column, values):
+    """SQL condition and parameters for column = value or column IN (values)"""
+    values = [values] if isinstance(values, str) else list(values)
+    return f"{column} IN ({', '.join('?' * len(values))})", values
+
+
+def _time_filters(column, since, until):
+    conditions, params = [], []
+    if since is not None:
+        conditions.append(f"{column} >= ?")
+        params.append(since.isoformat() if isinstance(since, datetime) else since)
+    if until is not None:
+        conditions.append(f"{column} < ?")
+        params.append(until.isoformat() if isinstance(until, datetime) else until)
+    return conditions, params
+
+
+def _fts_query(text):
+    """Quote each word so user input is never parsed as FTS5 syntax"""
+    terms = ['"' + term.replace('"', '""') + '"' for term in text.split()]
+    return " ".join(terms)
+
+
+class ConversationDatabase:
+    """Thread-safe access to the chatbot database (one connection, serialized writes)"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, cached_statements=256)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.executescript(SCHEMA)
+        try:
+            self._conn.executescript(FTS_SCHEMA)
+            self.has_fts = True
+        except sqlite3.OperationalError:
+            # SQLite built without FTS5; search falls back to LIKE
+            self.has_fts = False
+        self._conn.commit()
+
+    def create_conversation(self, persona, messages=(), title=None):
+        """Create a conversation, optionally with initial messages; returns its id"""
+        now = datetime.now().isoformat()
+        rows = [(m["role"], m["content"]) for m in messages if m["role"] != "system"]
+        if title is None:
+            title = next((content[:80] for role, content in rows if role == "user"), None)
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "INSERT INTO conversations (persona, title, created, updated, message_count) VALUES (?, ?, ?, ?, ?)",
+                (persona, title, now, now, len(rows)),
+            )
+            conversation_id = cursor.lastrowid
+            self._conn.executemany(
+                "INSERT INTO messages (conversation_id, role, content, created) VALUES (?, ?, ?, ?)",
+                [(conversation_id, role, content, now) for role, content in rows],
+            )
+        return conversation_id
+
+    def add_message(self, conversation_id, role, content):
+        """Append one message to a conversation"""
+        now = datetime.now().isoformat()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO messages (conversation_id, role, content, created) VALUES (?, ?, ?, ?)",
+                (conversation_id, role, content, now),
+            )
+            self._conn.execute(
+                "UPDATE conversations SET updated = ?, message_count = message_count + 1, "
+                "title = COALESCE(title, CASE WHEN ? = 'user' THEN substr(?, 1, 80) END) WHERE id = ?",
+                (now, role, content, conversation_id),
+            )
+
+    def get_conversation(self, conversation_id):
+        """Get a conversation's metadata and messages, or None if it does not exist"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, persona, title, created, updated, message_count FROM conversations WHERE id = ?",
+                (conversation_id,),
+            ).fetchone()
+            if row is None:
+                return None
+            messages = self._conn.execute(
+                "SELECT role, content FROM messages WHERE conversation_id = ? ORDER BY id",
+                (conversation_id,),
+            ).fetchall()
+        conversation = dict(row)
+        conversation["messages"] = [dict(m) for m in messages]
+        return conversation
+
+    def list_conversations(self, persona=None, limit=20):
+        """Most recently updated conversations, optionally for one persona"""
+        with self._lock:
+            if persona:
+                rows = self._conn.execute(
+                    "SELECT id, persona, title, created, updated, message_count FROM conversations "
+                    "WHERE persona = ? ORDER BY updated DESC LIMIT ?",
+                    (persona, limit),
+                ).fetchall()
+            else:
+                rows = self._conn.execute(
+                    "SELECT id, persona, title, created, updated, message_count FROM conversations "
+                    "ORDER BY updated DESC LIMIT ?",
+                    (limit,),
+                ).fetchall()
+        return [dict(row) for row in rows]
+
+    def search_messages(self, text, persona=None, limit=20):
+        """Full-text search over message content, best matches first"""
+        if not text.strip():
+            return []
+        persona_filter = "AND c.persona = ?" if persona else ""
+        if self.has_fts:
+            sql = (
+                "SELECT m.conversation_id, c.persona, m.role, m.created, "
+                "snippet(messages_fts, 0, '[', ']', '...', 12) AS snippet "
+                "FROM messages_fts JOIN messages m ON m.id = messages_fts.rowid "
+                "JOIN conversations c ON c.id = m.conversation_id "
+                f"WHERE messages_fts MATCH ? {persona_filter} ORDER BY rank LIMIT ?"
+            )
+            params = [_fts_query(text)]
+        else:
+            sql = (
+                "SELECT m.conversation_id, c.persona, m.role, m.created, substr(m.content, 1, 120) AS snippet "
+                "FROM messages m JOIN conversations c ON c.id = m.conversation_id "
+                f"WHERE m.content LIKE ? {persona_filter} ORDER BY m.id DESC LIMIT ?"
+            )
+            params = [f"%{text}%"]
+        if persona:
+            params.append(persona)
+        params.append(limit)
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [dict(row) for row in rows]
+
+    def save_test_results(self, results):
+        """Store a persona test run (same structure as persona_test_results_*.json)"""
+        rows = [
+            (persona, question, json.dumps(entry, ensure_ascii=False))
+            for persona, answers in results["results"].items()
+            for question, entry in answers.items()
+        ]
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "INSERT INTO test_runs (test_date, questions, total_time) VALUES (?, ?, ?)",
+                (results["test_date"], json.dumps(results["questions"], ensure_ascii=False), results.get("total_time")),
+            )
+            run_id = cursor.lastrowid
+            self._conn.executemany(
+                "INSERT INTO test_results (run_id, persona, question, result) VALUES (?, ?, ?, ?)",
+                [(run_id,) + row for row in rows],
+            )
+        return run_id
+
+    def latest_test_run(self):
+        """Most recent persona test run (id, test_date, questions, total_time), or None"""
+        with self._lock:
+            run = self._conn.execute(
+                "SELECT id, test_date, questions, total_time FROM test_runs ORDER BY test_date DESC, id DESC LIMIT 1"
+            ).fetchone()
+        return None if run is None else dict(run, questions=json.loads(run["questions"]))
+
+    def latest_test_results(self):
+        """Most recent persona test run rebuilt into the JSON results structure, or None"""
+        with self._lock:
+            run = self._conn.execute(
+                "SELECT id, test_date, questions, total_time FROM test_runs ORDER BY test_date DESC, id DESC LIMIT 1"
+            ).fetchone()
+            if run is None:
+                return None
+            rows = self._conn.execute(
+                "SELECT persona, question, result FROM test_results WHERE run_id = ? ORDER BY id",
+                (run["id"],),
+            ).fetchall()
+        results = {"test_date": run["test_date"], "questions": json.loads(run["questions"]), "results": {}}
+        if run["total_time"] is not None:
+            results["total_time"] = run["total_time"]
+        for row in rows:
+            results["results"].setdefault(row["persona"], {})[row["question"]] = json.loads(row["result"])
+        return results
+
+    def _paged(self, sql, conditions, params, key, batch_size):
+        """Yield rows of sql in pages of batch_size, resuming after the last key of each page
+
+        The lock is held for one page at a time, so a long export never
+        blocks writers, and only one page of rows is in memory.
+        """
+        last = None
+        while True:
+            where = list(conditions)
+            page_params = list(params)
+            if last is not None:
+                where.append(f"({', '.join(key)}) > ({', '.join('?' * len(key))})")
+                page_params.extend(last)
+            query = sql + (" WHERE " + " AND ".join(where) if where else "") + f" ORDER BY {', '.join(key)} LIMIT ?"
+            with self._lock:
+                rows = self._conn.execute(query, page_params + [batch_size]).fetchall()
+            yield from rows
+            if len(rows) < batch_size:
+                return
+            last = tuple(rows[-1][column.rsplit(".", 1)[-1]] for column in key)
+
+    def iter_messages(self, persona=None, since=None, until=None, batch_size=500):
+        """Stream every stored message as a dict, grouped by conversation
+
+        persona is a persona key or a collection of keys; since/until (datetime
+        or ISO string) bound the message's created time, until exclusive.
+        """
+        conditions, params = _time_filters("m.created", since, until)
+        if persona:
+            condition, values = _in_filter("c.persona", persona)
+            conditions.append(condition)
+            params.extend(values)
+        sql = ("SELECT m.conversation_id, c.persona, m.role, m.content, m.created, m.id "
+               "FROM messages m JOIN conversations c ON c.id = m.conversation_id")
+        for row in self._paged(sql, conditions, params, ("m.conversation_id", "m.id"), batch_size):
+            message = dict(row)
+            del message["id"]
+            yield message
+
+    def list_test_runs(self, since=None, until=None):
+        """Persona test runs (id, test_date, questions, total_time), oldest first"""
+        conditions, params = _time_filters("test_date", since, until)
+        where = " WHERE " + " AND ".join(conditions) if conditions else ""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT id, test_date, questions, total_time FROM test_runs{where} ORDER BY test_date, id", params
+            ).fetchall()
+        return [dict(row, questions=json.loads(row["questions"])) for row in rows]
+
+    def iter_test_results(self, run_id, persona=None, question=None, batch_size=500):
+        """Stream one run's results as (persona, question, result entry) tuples in stored order"""
+        conditions, params = ["run_id = ?"], [run_id]
+        if persona:
+            condition, values = _in_filter("persona", persona)
+            conditions.append(condition)
+            params.extend(values)
+        if question is not None:
+            conditions.append("question = ?")
+            params.append(question)
+        sql = "SELECT id, persona, question, result FROM test_results"
+        for row in self._paged(sql, conditions, params, ("id",), batch_size):
+            yield row["persona"], row["question"], json.loads(row["result"])
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,167 @@
+"""
+Append-only JSON Lines conversation journal
+One record per line: a header, then messages, with reset records whenever
+the conversation is cleared or the persona changes.
+"""
+
+from datetime import datetime
+import json
+import os
+import time
+
+from utils.token_counter import message_tokens
+
+FSYNC_POLICIES = ("always", "interval", "never")
+
+
+def _record_line(record):
+    return (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+class ConversationJournal:
+    """Appends conversation records to a .jsonl file in O(1) per message
+
+    fsync controls durability: "always" syncs every record, "interval" at most
+    once every fsync_interval seconds, "never" leaves it to the OS. Records
+    are flushed to the OS on every append regardless.
+    """
+
+    def __init__(self, path, persona, fsync="interval", fsync_interval=1.0):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Invalid fsync policy '{fsync}'. Available: {', '.join(FSYNC_POLICIES)}")
+        self.path = path
+        self.persona = persona
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self._last_sync = time.monotonic()
+        self.is_new = not os.path.exists(path) or os.path.getsize(path) == 0
+        if not self.is_new:
+            with open(path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                torn = f.read(1) != b"\n"
+        self._file = open(path, "ab")
+        if self.is_new:
+            self._write({"type": "header", "version": 1, "created": datetime.now().isoformat(), "persona": persona})
+        elif torn:
+            # Terminate a partial line left by a crash so new records stay parseable
+            self._file.write(b"\n")
+
+    def _write(self, record):
+        self._file.write(_record_line(record))
+        self._file.flush()
+        now = time.monotonic()
+        if self.fsync == "always" or (self.fsync == "interval" and now - self._last_sync >= self.fsync_interval):
+            os.fsync(self._file.fileno())
+            self._last_sync = now
+
+    def append(self, message):
+        """Append one chat message"""
+        self._write({
+            "role": message["role"],
+            "content": message["content"],
+            "persona": self.persona,
+            "timestamp": datetime.now().isoformat(),
+        })
+
+    def reset(self, persona):
+        """Record that the conversation was cleared (and possibly switched persona)"""
+        self.persona = persona
+        self._write({"type": "reset", "persona": persona, "timestamp": datetime.now().isoformat()})
+
+    def close(self):
+        if not self._file.closed:
+            self._file.flush()
+            if self.fsync != "never":
+                os.fsync(self._file.fileno())
+            self._file.close()
+
+
+def _parse(line):
+    try:
+        return json.loads(line)
+    except ValueError:
+        # A torn final line from a crash mid-write is skipped
+        return None
+
+
+def read_journal(path):
+    """Read a whole journal; returns (persona, messages since the last reset)"""
+    persona = None
+    messages = []
+    with open(path, "rb") as f:
+        for line in f:
+            record = _parse(line)
+            if record is None:
+                continue
+            if record.get("type") in ("header", "reset"):
+                persona = record.get("persona", persona)
+                messages = []
+            elif "role" in record:
+                messages.append({"role": record["role"], "content": record["content"]})
+    return persona, messages
+
+
+def _iter_lines_reversed(f, block_size=64 * 1024):
+    """Yield the lines of a binary file from last to first"""
+    f.seek(0, os.SEEK_END)
+    position = f.tell()
+    remainder = b""
+    while position > 0:
+        read_size = min(block_size, position)
+        position -= read_size
+        f.seek(position)
+        lines = (f.read(read_size) + remainder).split(b"\n")
+        remainder = lines[0]
+        for line in reversed(lines[1:]):
+            if line:
+                yield line
+    if remainder:
+        yield remainder
+
+
+def read_journal_tail(path, max_tokens=None, max_messages=None):
+    """Read only the newest messages of the current conversation from the end of the file
+
+    Stops once max_tokens worth of messages (or max_messages) have been read,
+    so resuming a huge conversation costs about one context window of I/O.
+    Returns (persona, messages) in chronological order.
+    """
+    messages = []
+    tokens = 0
+    persona = None
+    with open(path, "rb") as f:
+        for line in _iter_lines_reversed(f):
+            record = _parse(line)
+            if record is None:
+                continue
+            if record.get("type") in ("header", "reset"):
+                persona = record.get("persona")
+                break
+            if "role" not in record:
+                continue
+            if max_messages is not None and len(messages) >= max_messages:
+                break
+            if max_tokens is not None and tokens >= max_tokens:
+                break
+            message = {"role": record["role"], "content": record["content"]}
+            # Every message carries its persona, so stopping early still knows it
+            persona = persona or record.get("persona")
+            tokens += message_tokens(message)
+            messages.append(message)
+
+    messages.reverse()
+    return persona, messages
+
+
+def compact_journal(path):
+    """Rewrite a journal keeping only the current conversation (atomic replace)"""
+    persona, messages = read_journal(path)
+    temp_path = f"{path}.compact"
+    with open(temp_path, "wb") as f:
+        f.write(_record_line({"type": "header", "version": 1, "created": datetime.now().isoformat(), "persona": persona}))
+        for message in messages:
+            f.write(_record_line(dict(message, persona=persona)))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+    return len(messages)
@@ -0,0 +1,212 @@
+"""
+Streaming exporters for conversations and persona test results
+Records come from generators and are written one at a time as JSON Lines,
+Markdown, CSV or Parquet (when pyarrow is installed), so memory stays flat
+however large the export is.
+"""
+
+from datetime import datetime
+import csv
+import io
+import json
+import os
+
+CONVERSATION_FIELDS = ("conversation_id", "persona", "role", "content", "created")
+TEST_RESULT_FIELDS = ("run_id", "test_date", "persona", "question", "response", "error", "latency", "attempts",
+                      "prompt_tokens", "completion_tokens")
+
+# Parquet column types of the numeric fields; every other field is stored as text
+PARQUET_TYPES = {"conversation_id": "int64", "run_id": "int64", "latency": "float64", "attempts": "int64",
+                 "prompt_tokens": "int64", "completion_tokens": "int64"}
+# Rows per Parquet row group: the only records held in memory at once
+PARQUET_BATCH_SIZE = 1000
+
+
+def _timestamp(value):
+    """ISO string for a datetime (or an ISO string as given), for range checks on stored timestamps"""
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def _personas(persona):
+    """None (all personas) or the set of persona keys to keep"""
+    return {persona} if isinstance(persona, str) else set(persona) if persona else None
+
+
+def filter_records(records, persona=None, since=None, until=None, time_field="created"):
+    """Keep records of persona (a key or a collection of keys) with since <= record[time_field] < until"""
+    personas = _personas(persona)
+    since, until = _timestamp(since), _timestamp(until)
+    for record in records:
+        if personas is not None and record.get("persona") not in personas:
+            continue
+        stamp = record.get(time_field)
+        if since is not None and (stamp is None or stamp < since):
+            continue
+        if until is not None and (stamp is None or stamp >= until):
+            continue
+        yield record
+
+
+def session_records(messages, persona):
+    """Records for a chat held in memory, e.g. the Streamlit message list"""
+    for message in messages:
+        yield {
+            "conversation_id": None,
+            "persona": message.get("persona", persona),
+            "role": message["role"],
+            "content": message["content"],
+            "created": message.get("timestamp"),
+        }
+
+
+def conversation_records(db, persona=None, since=None, until=None):
+    """Stored messages of a ConversationDatabase, read page by page"""
+    return db.iter_messages(persona=persona, since=since, until=until)
+
+
+def test_result_records(db, persona=None, since=None, until=None, runs=None):
+    """Stored persona test results, grouped by run and then by question
+
+    since/until bound the run's test_date; runs (from db.list_test_runs())
+    restricts the export to those runs.
+    """
+    for run in db.list_test_runs(since, until) if runs is None else runs:
+        for question in run["questions"]:
+            for key, _, entry in db.iter_test_results(run["id"], persona=persona, question=question):
+                yield _result_record(run["id"], run["test_date"], key, question, entry)
+
+
+def results_records(results, persona=None, since=None, until=None):
+    """Records for a persona test results dict (a persona_test_results_*.json file), grouped by question
+
+    Filters like test_result_records(): persona, and since/until on the test_date.
+    """
+    records = (_result_record(results.get("run_id"), results["test_date"], key, question, answers[question])
+               for question in results["questions"]
+               for key, answers in results["results"].items() if question in answers)
+    return filter_records(records, persona, since, until, time_field="test_date")
+
+
+def _result_record(run_id, test_date, persona, question, entry):
+    record = {"run_id": run_id, "test_date": test_date, "persona": persona, "question": question}
+    record.update(entry)
+    return record
+
+
+def jsonl_chunks(records):
+    for record in records:
+        yield json.dumps(record, ensure_ascii=False) + "\n"
+
+
+def csv_chunks(records, fields=CONVERSATION_FIELDS):
+    """One CSV line per record; keys outside fields are dropped"""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fields, extrasaction="ignore")
+    writer.writeheader()
+    for record in records:
+        writer.writerow(record)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def markdown_chunks(records):
+    """Conversations as "## Conversation" sections, test results as "### Question" sections
+
+    Records must arrive grouped (by conversation or by question) for the
+    headings to come out once per group.
+    """
+    group = object()
+    number = 0
+    for record in records:
+        if "question" in record:
+            if record["question"] != group:
+                group = record["question"]
+                number += 1
+                yield ("---\n\n" if number > 1 else "") + f"### Question {number}: {group}\n\n"
+            yield f"**{(record.get('persona_info') or {}).get('name', record['persona'])}:**\n"
+            if "error" in record:
+                yield f"*Error: {record['error']}*\n\n"
+            else:
+                yield f"{record.get('response', 'ERROR')}\n\n"
+        else:
+            if record.get("conversation_id") != group:
+                group = record.get("conversation_id")
+                title = f"Conversation {group}" if group is not None else "Conversation"
+                yield f"## {title} ({record.get('persona')})\n\n"
+            created = f" ({record['created']})" if record.get("created") else ""
+            yield f"**{record['role'].title()}**{created}: {record['content']}\n\n"
+
+
+def write_parquet(records, path, fields=CONVERSATION_FIELDS, batch_size=PARQUET_BATCH_SIZE):
+    """Write records to a Parquet file in row groups of batch_size; returns the record count"""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ValueError("Parquet export requires pyarrow (pip install pyarrow)")
+    schema = pa.schema([(field, pa.type_for_alias(PARQUET_TYPES.get(field, "string"))) for field in fields])
+    count = 0
+    batch = []
+    with pq.ParquetWriter(path, schema) as writer:
+        for record in records:
+            batch.append({field: record.get(field) for field in fields})
+            if len(batch) == batch_size:
+                writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+                count += len(batch)
+                batch = []
+        if batch or not count:
+            writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+            count += len(batch)
+    return count
+
+
+# Format -> (chunk generator, MIME type); Parquet is binary and written by write_parquet()
+FORMATS = {
+    "jsonl": (jsonl_chunks, "application/x-ndjson"),
+    "md": (markdown_chunks, "text/markdown"),
+    "csv": (csv_chunks, "text/csv"),
+}
+
+
+def export_formats():
+    """Formats available here: Parquet only when pyarrow is installed"""
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return list(FORMATS)
+    return [*FORMATS, "parquet"]
+
+
+def format_for_path(path):
+    extension = os.path.splitext(path)[1].lstrip(".").lower()
+    return {"json": "jsonl", "ndjson": "jsonl", "markdown": "md"}.get(extension, extension)
+
+
+def export_chunks(records, format, fields=CONVERSATION_FIELDS):
+    """Text chunks of records in format ("jsonl", "md" or "csv"), produced lazily"""
+    if format not in FORMATS:
+        raise ValueError(f"Invalid export format '{format}'. Available: {', '.join(export_formats())}")
+    chunks = FORMATS[format][0]
+    return chunks(records, fields) if chunks is csv_chunks else chunks(records)
+
+
+def export_records(records, path, format=None, fields=CONVERSATION_FIELDS):
+    """Stream records into path; the format defaults to the file extension. Returns the record count"""
+    format = format or format_for_path(path)
+    if format == "parquet":
+        return write_parquet(records, path, fields)
+    count = 0
+
+    def counted():
+        nonlocal count
+        for record in records:
+            count += 1
+            yield record
+
+    chunks = export_chunks(counted(), format, fields)
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        for chunk in chunks:
+            f.write(chunk)
+    return count
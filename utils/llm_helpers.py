@@ -1,152 +1,1209 @@
-from openai import OpenAI
 from config import (
     OPEN_ROUTER_API_KEY,
     OPEN_ROUTER_BASE_URL,
-    DEFAULT_OPENAI_MODEL)
+    LLM_BACKEND,
+    LLM_BACKEND_OPTIONS,
+    DEFAULT_OPENAI_MODEL,
+    MAX_CONCURRENT_REQUESTS,
+    MAX_PROMPT_TOKENS,
+    RESPONSE_CACHE_DB,
+    SEMANTIC_CACHE,
+    SEMANTIC_CACHE_MODEL,
+    SEMANTIC_CACHE_THRESHOLD,
+    SUMMARIZE_HISTORY,
+    CONVERSATION_DB_PATH,
+    CONVERSATION_DB_CONFIGURED,
+    REQUEST_TIMEOUT,
+    TOTAL_REQUEST_TIMEOUT,
+    MAX_REQUEST_ATTEMPTS,
+    PROVIDER_ROUTING,
+    HEDGE_AFTER_SECONDS,
+    HISTORY_PACKING,
+    PERSONAS_DIR,
+    COALESCE_REQUESTS,
+    RATE_LIMIT_RPM,
+    RATE_LIMIT_TPM,
+    RATE_LIMIT_BURST_SECONDS)
+from utils.conversation_db import ConversationDatabase
+from utils.conversation_store import ConversationJournal, compact_journal, read_journal, read_journal_tail
+from utils.message_history import Message, MessageHistory, as_dicts
+from utils.metrics import MetricsRegistry
+from utils.persona_registry import PersonaRegistry
+from utils.providers import ProviderRouter, default_providers
+from utils.rate_limiter import RateLimiter
+from utils.resilience import (
+    CircuitBreaker,
+    RateLimitedError,
+    RetryPolicy,
+    acall_with_retries,
+    call_with_retries,
+    classify_error)
+from utils.response_cache import ResponseCache, make_cache_key
+from utils.semantic_cache import SemanticCache, local_embedder
+from utils.single_flight import AsyncSingleFlight, SingleFlight, StreamMeta, request_fingerprint
+from utils.summarizer import RollingSummarizer
+from utils.token_counter import message_tokens, select_context_window, select_stable_window
+import asyncio
 import json
 import os
+import time
+import weakref
 from datetime import datetime
 
-client = OpenAI(
-    base_url= OPEN_ROUTER_BASE_URL,
-    api_key=OPEN_ROUTER_API_KEY
+# Built on first use by get_client(): importing the openai SDK costs more than everything else here
+client = None
+
+def get_client():
+    """Get the sync OpenAI client, creating it (and importing the SDK) on first use"""
+    global client
+    if client is None:
+        _ensure_backend()
+        from openai import OpenAI
+        # Retries are handled by retry_policy below, not by the SDK
+        client = OpenAI(base_url=_async_settings["base_url"], api_key=_async_settings["api_key"], max_retries=0)
+    return client
+
+# Shared by all sessions: provider health is a property of the endpoint, not the conversation
+retry_policy = RetryPolicy(
+    max_attempts=MAX_REQUEST_ATTEMPTS,
+    attempt_timeout=REQUEST_TIMEOUT,
+    total_timeout=TOTAL_REQUEST_TIMEOUT,
 )
+circuit_breaker = CircuitBreaker()
 
-# Define the 3 required personas for Part 2 of assignment
-SYSTEM_PROMPTS = {
-    "professional": {
-        "name": "Professional Assistant",
-        "prompt": "You are a professional business assistant. Provide formal, structured, and business-like responses. Use professional language, be concise, and focus on practical solutions. Always maintain a courteous and authoritative tone."
-    },
-    "creative": {
-        "name": "Creative Companion", 
-        "prompt": "You are a creative and imaginative companion. Be artistic, inspiring, and think outside the box. Use vivid language, metaphors, and encourage creative thinking. Help brainstorm ideas and approach problems from unique angles."
-    },
-    "technical": {
-        "name": "Technical Expert",
-        "prompt": "You are a technical expert and educator. Provide detailed, accurate technical explanations with step-by-step instructions. Break down complex concepts, use precise terminology, and include examples when helpful. Focus on thorough and educational responses."
-    }
-}
+# Process-wide call metrics; register exporters with metrics.add_hook()
+metrics = MetricsRegistry()
 
-# Global state
-current_persona = "professional"
-message_history = []
+# Optional multi-provider routing; see enable_provider_routing()
+router = None
 
-# Initialize with default persona
-def _initialize_conversation():
-    global message_history
-    message_history = [{"role": "system", "content": SYSTEM_PROMPTS[current_persona]["prompt"]}]
+def enable_provider_routing(providers=None, hedge_after=HEDGE_AFTER_SECONDS):
+    """Send requests to the healthiest of several providers, with failover and hedging"""
+    global router
+    router = ProviderRouter(providers or default_providers(), hedge_after=hedge_after)
+    return router
 
-_initialize_conversation()
+def disable_provider_routing():
+    """Go back to the single OpenRouter client"""
+    global router
+    router = None
 
-def chat(user_input):
-    """Send user input to LLM and get response"""
-    message_history.append({"role": "user", "content": user_input})
+def get_provider_stats():
+    """Rolling per-provider latency/error stats, or None when routing is off"""
+    return router.stats() if router is not None else None
+
+if PROVIDER_ROUTING and default_providers():
+    enable_provider_routing()
+
+def _create_completion(kwargs, timeout):
+    if router is not None:
+        return router.create(kwargs, timeout)
+    return get_client().chat.completions.create(**kwargs, timeout=timeout)
+
+async def _acreate_completion(async_client, kwargs, timeout):
+    if router is not None:
+        return await router.acreate(kwargs, timeout)
+    return await async_client.chat.completions.create(**kwargs, timeout=timeout)
+
+# Optional client-side quota shared by every session, thread and event loop; see enable_rate_limit()
+rate_limiter = (RateLimiter(RATE_LIMIT_RPM, RATE_LIMIT_TPM, RATE_LIMIT_BURST_SECONDS)
+                if RATE_LIMIT_RPM or RATE_LIMIT_TPM else None)
+
+# Seconds to hold every request back after a 429 that did not say how long to wait
+RATE_LIMIT_PAUSE = 5.0
+
+def enable_rate_limit(requests_per_minute=None, tokens_per_minute=None, burst_seconds=RATE_LIMIT_BURST_SECONDS,
+                      fair_share=True):
+    """Queue requests client-side to stay under a requests/min and tokens/min quota"""
+    global rate_limiter
+    rate_limiter = RateLimiter(requests_per_minute, tokens_per_minute, burst_seconds, fair_share)
+    return rate_limiter
+
+def disable_rate_limit():
+    """Send requests as soon as they are made again"""
+    global rate_limiter
+    rate_limiter = None
+
+def get_rate_limit_stats():
+    """Granted/queued counts and average queueing delay, or None when limiting is off"""
+    return rate_limiter.stats() if rate_limiter is not None else None
+
+def _usage_tokens(response):
+    usage = getattr(response, "usage", None)
+    return usage.prompt_tokens + usage.completion_tokens if usage else None
+
+def _estimate_prompt_tokens(kwargs):
+    return sum(message_tokens(m) for m in kwargs["messages"])
+
+def _release_reservation(limiter, reservation, error):
+    """A failed attempt uses no tokens; a 429 also holds everyone back"""
+    reservation.settle(0)
+    classified = classify_error(error)
+    if isinstance(classified, RateLimitedError):
+        limiter.pause(classified.retry_after or RATE_LIMIT_PAUSE)
+
+def _settle_stream(stream, reservation):
+    used = None
+    try:
+        for chunk in stream:
+            used = _usage_tokens(chunk) or used
+            yield chunk
+    finally:
+        reservation.settle(used)
+
+async def _asettle_stream(stream, reservation):
+    used = None
+    try:
+        async for chunk in stream:
+            used = _usage_tokens(chunk) or used
+            yield chunk
+    finally:
+        reservation.settle(used)
 
+def _limited(kwargs, user, create):
+    """Call create() once the rate limiter admits the request, then charge the reported usage"""
+    limiter = rate_limiter
+    if limiter is None:
+        return create()
+    reservation = limiter.acquire(_estimate_prompt_tokens(kwargs), user)
     try:
-        completion = client.chat.completions.create(
-            model=DEFAULT_OPENAI_MODEL,
-            messages=message_history,
-            max_tokens=500,
-            temperature=0.7,
+        result = create()
+    except Exception as e:
+        _release_reservation(limiter, reservation, e)
+        raise
+    if kwargs.get("stream"):
+        # Streams report usage in their last chunk
+        return _settle_stream(result, reservation)
+    reservation.settle(_usage_tokens(result))
+    return result
+
+async def _alimited(kwargs, user, create):
+    """Async version of _limited(); create() returns an awaitable"""
+    limiter = rate_limiter
+    if limiter is None:
+        return await create()
+    reservation = await limiter.aacquire(_estimate_prompt_tokens(kwargs), user)
+    try:
+        result = await create()
+    except Exception as e:
+        _release_reservation(limiter, reservation, e)
+        raise
+    if kwargs.get("stream"):
+        return _asettle_stream(result, reservation)
+    reservation.settle(_usage_tokens(result))
+    return result
+
+def _raise_api_error(error):
+    """Re-raise any failure from a chat call as a typed LLMError"""
+    classified = classify_error(error)
+    if classified is error:
+        raise classified
+    raise classified from error
+
+# Async client settings; clients and semaphores are created per event loop
+_async_settings = {
+    "base_url": OPEN_ROUTER_BASE_URL,
+    "api_key": OPEN_ROUTER_API_KEY,
+    "max_concurrency": MAX_CONCURRENT_REQUESTS,
+}
+_async_resources = weakref.WeakKeyDictionary()
+
+def _async_http_client(max_connections):
+    """Build a pooled HTTP client sized to the concurrency limit, if httpx is available"""
+    try:
+        import httpx
+        from openai import DefaultAsyncHttpxClient
+    except ImportError:
+        return None
+    limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+    return DefaultAsyncHttpxClient(limits=limits)
+
+def _get_async_resources():
+    """Get the (AsyncOpenAI client, semaphore) pair for the running event loop"""
+    loop = asyncio.get_running_loop()
+    resources = _async_resources.get(loop)
+    if resources is None:
+        _ensure_backend()
+        from openai import AsyncOpenAI
+        max_concurrency = _async_settings["max_concurrency"]
+        async_client = AsyncOpenAI(
+            base_url=_async_settings["base_url"],
+            api_key=_async_settings["api_key"],
+            http_client=_async_http_client(max_concurrency),
+            max_retries=0,
         )
-        response = completion.choices[0].message.content
-        message_history.append({"role": "assistant", "content": response})
-        
-        # Keep conversation history manageable (last 20 messages + system prompt)
-        if len(message_history) > 21:
-            system_msg = message_history[0]
-            message_history = [system_msg] + message_history[-20:]
-        
+        resources = (async_client, asyncio.Semaphore(max_concurrency))
+        _async_resources[loop] = resources
+    return resources
+
+# Opt-in cache of identical requests; see enable_response_cache()
+response_cache = ResponseCache(db_path=RESPONSE_CACHE_DB) if RESPONSE_CACHE_DB else None
+
+def enable_response_cache(max_entries=1000, ttl=24 * 3600, db_path=None, max_disk_entries=None):
+    """Serve repeated identical requests from an LRU/TTL cache (optionally backed by SQLite)"""
+    global response_cache
+    if response_cache is not None:
+        response_cache.close()
+    response_cache = ResponseCache(max_entries=max_entries, ttl=ttl, db_path=db_path, max_disk_entries=max_disk_entries)
+    return response_cache
+
+def disable_response_cache():
+    """Send every request to the API again"""
+    global response_cache
+    if response_cache is not None:
+        response_cache.close()
+    response_cache = None
+
+# Opt-in cache of first-turn answers matched by meaning; see enable_semantic_cache()
+semantic_cache = None
+
+def enable_semantic_cache(threshold=SEMANTIC_CACHE_THRESHOLD, max_entries=10_000, ttl=24 * 3600, model=None, **options):
+    """Answer history-free questions from earlier questions to the same persona
+
+    Without a model, questions match when their content words are the same.
+    model names a local sentence-transformers model; paraphrases at or above
+    threshold cosine similarity then match too. options are passed to
+    SemanticCache (embed_fn, index_factory, verify).
+    """
+    global semantic_cache
+    if model:
+        options.setdefault("embed_fn", local_embedder(model))
+    semantic_cache = SemanticCache(threshold=threshold, max_entries=max_entries, ttl=ttl, **options)
+    return semantic_cache
+
+if SEMANTIC_CACHE or SEMANTIC_CACHE_MODEL:
+    enable_semantic_cache(model=SEMANTIC_CACHE_MODEL)
+
+def disable_semantic_cache():
+    global semantic_cache
+    semantic_cache = None
+
+# Single-flight coalescing of identical in-flight requests; the async side keeps one group per event loop
+request_coalescer = SingleFlight() if COALESCE_REQUESTS else None
+_async_coalescers = weakref.WeakKeyDictionary()
+
+def enable_request_coalescing():
+    """Let concurrent identical requests share one upstream call (and one stream)"""
+    global request_coalescer
+    if request_coalescer is None:
+        request_coalescer = SingleFlight()
+    return request_coalescer
+
+def disable_request_coalescing():
+    """Send every request upstream, even when an identical one is in flight"""
+    global request_coalescer
+    request_coalescer = None
+    _async_coalescers.clear()
+
+def _get_async_coalescer():
+    if request_coalescer is None:
+        return None
+    loop = asyncio.get_running_loop()
+    coalescer = _async_coalescers.get(loop)
+    if coalescer is None:
+        coalescer = _async_coalescers[loop] = AsyncSingleFlight()
+    return coalescer
+
+def _call_once(kwargs, call):
+    """Run call() or join an identical in-flight one; returns (completion, attempts, coalesced)"""
+    if request_coalescer is None:
+        return (*call(), False)
+    (completion, attempts), coalesced = request_coalescer.do(request_fingerprint(kwargs), call)
+    return completion, attempts, coalesced
+
+async def _acall_once(kwargs, call):
+    coalescer = _get_async_coalescer()
+    if coalescer is None:
+        return (*await call(), False)
+    (completion, attempts), coalesced = await coalescer.do(request_fingerprint(kwargs), call)
+    return completion, attempts, coalesced
+
+def _open_stream(kwargs, produce, coalescer):
+    """Start produce(meta) or subscribe to an identical in-flight stream; returns (chunks, meta, coalesced)"""
+    if coalescer is None:
+        meta = StreamMeta()
+        return produce(meta), meta, False
+    subscription = coalescer.stream(request_fingerprint(kwargs), produce)
+    return subscription, subscription.meta, subscription.shared
+
+_conversation_db = None
+
+def get_conversation_db():
+    """Open the conversation database on first use"""
+    global _conversation_db
+    if _conversation_db is None:
+        _conversation_db = ConversationDatabase(CONVERSATION_DB_PATH)
+    return _conversation_db
+
+def get_results_db():
+    """The database for persona test runs: open only if already in use or CONVERSATION_DB is set, else None
+
+    Keeps a bare script or pytest run from creating conversations.db in the working directory.
+    """
+    if _conversation_db is None and not CONVERSATION_DB_CONFIGURED:
+        return None
+    return get_conversation_db()
+
+def _api_backend():
+    return OPEN_ROUTER_BASE_URL, OPEN_ROUTER_API_KEY, None
+
+def _mock_backend(**options):
+    from utils.mock_server import MockLLMServer
+    server = MockLLMServer(**options).start()
+    return server.base_url, "mock", server
+
+# Backend name -> factory(**options) returning (base_url, api_key, handle); register any OpenAI-compatible server here
+BACKENDS = {"api": _api_backend, "mock": _mock_backend}
+_backend = {"name": None, "handle": None}
+
+def use_backend(name, **options):
+    """Send every session's requests to a registered backend
+
+    Returns the backend's handle, e.g. the running MockLLMServer for "mock".
+    The previous backend's server, if it started one, is stopped.
+    """
+    if name not in BACKENDS:
+        raise ValueError(f"Invalid backend '{name}'. Available: {', '.join(BACKENDS)}")
+    base_url, api_key, handle = BACKENDS[name](**options)
+    previous = _backend["handle"]
+    configure_client(base_url=base_url, api_key=api_key)
+    _backend.update(name=name, handle=handle)
+    if previous is not None and hasattr(previous, "stop"):
+        previous.stop()
+    return handle
+
+def get_backend_name():
+    """Name of the active backend ("custom" after configure_client(base_url=...))"""
+    return _backend["name"] or LLM_BACKEND
+
+def _ensure_backend():
+    """Start the LLM_BACKEND from the environment before the first request"""
+    if _backend["name"] is None:
+        use_backend(LLM_BACKEND, **LLM_BACKEND_OPTIONS)
+
+def configure_client(base_url=None, api_key=None, max_concurrency=None):
+    """Point the sync and async clients at another endpoint or change the concurrency limit"""
+    global client
+    if base_url is not None:
+        _async_settings["base_url"] = base_url
+        # An explicit endpoint replaces whatever LLM_BACKEND would have started
+        _backend["name"] = "custom"
+    if api_key is not None:
+        _async_settings["api_key"] = api_key
+    if max_concurrency is not None:
+        _async_settings["max_concurrency"] = max_concurrency
+    client = None
+    _async_resources.clear()
+    circuit_breaker.reset()
+
+# Personas live in PERSONAS_DIR, one YAML/JSON file each; edits apply without a restart
+SYSTEM_PROMPTS = PersonaRegistry(PERSONAS_DIR)
+DEFAULT_PERSONA = "professional"
+
+HISTORY_PACKING_MODES = ("sliding", "stable")
+
+# Models that take explicit cache_control breakpoints through OpenRouter; others cache prefixes automatically
+CACHE_CONTROL_MODEL_PREFIXES = ("anthropic/", "google/gemini")
+
+def _with_cache_control(messages):
+    """Mark the system prompt and the newest message as prompt cache breakpoints"""
+    marked = list(messages)
+    for index in sorted({0, len(marked) - 1}):
+        message = marked[index]
+        marked[index] = {
+            "role": message["role"],
+            "content": [{"type": "text", "text": message["content"], "cache_control": {"type": "ephemeral"}}],
+        }
+    return marked
+
+SUMMARY_PROMPT = "You maintain a running summary of a conversation between a user and an AI assistant. Merge the new messages into the existing summary. Keep names, facts, decisions, preferences and open questions; drop pleasantries. Reply with the updated summary only, in at most 150 words."
+
+def summarize_messages(previous_summary, messages):
+    """Fold messages into previous_summary with one LLM call (used for evicted history)"""
+    transcript = "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+    kwargs = {
+        "model": DEFAULT_OPENAI_MODEL,
+        "messages": [
+            {"role": "system", "content": SUMMARY_PROMPT},
+            {"role": "user", "content": f"Existing summary:\n{previous_summary or '(none)'}\n\nNew messages:\n{transcript}"},
+        ],
+        "max_tokens": 300,
+        "temperature": 0.3,
+    }
+    # Same path as chat replies: retries, circuit breaker, quota and provider routing
+    completion, _ = call_with_retries(
+        lambda timeout: _limited(kwargs, None, lambda: _create_completion(kwargs, timeout)),
+        retry_policy, circuit_breaker)
+    return completion.choices[0].message.content
+
+class ChatSession:
+    """A single conversation: persona, message history and response timing
+
+    Each Streamlit browser session (or API caller) owns its own ChatSession so
+    conversations never share or clobber each other's state.
+    """
+
+    def __init__(self, persona=DEFAULT_PERSONA, max_prompt_tokens=MAX_PROMPT_TOKENS, summarize_fn=None,
+                 packing=HISTORY_PACKING, user=None):
+        if persona not in SYSTEM_PROMPTS:
+            persona = default_persona()
+        if packing not in HISTORY_PACKING_MODES:
+            raise ValueError(f"Invalid packing '{packing}'. Available: {', '.join(HISTORY_PACKING_MODES)}")
+        self.current_persona = persona
+        self.max_prompt_tokens = max_prompt_tokens
+        # Fair-share key for the rate limiter, e.g. a browser session or API user id
+        self.user = user
+        # "stable" keeps the prompt prefix identical between window jumps for provider prompt caching
+        self.packing = packing
+        self._window_start = 0
+        # Evicted history is folded into a rolling summary when a summarizer is configured
+        if summarize_fn is None and SUMMARIZE_HISTORY:
+            summarize_fn = summarize_messages
+        self.summarizer = RollingSummarizer(summarize_fn) if summarize_fn else None
+        self.message_history = MessageHistory()
+        self.journal = None
+        self.db = None
+        self.db_conversation_id = None
+        # The user turn of the call in progress; see _begin_call()
+        self._pending_user = None
+        # Journal resumed from its tail: older messages stay on disk (see _earlier_messages)
+        self._resumed_journal = None
+        self._earlier = None
+        self.last_response_timing = {}
+        self.last_usage = {}
+        self.last_attempts = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.last_call_metrics = {}
+        self.call_count = 0
+        self.total_call_time = 0.0
+        self.total_prompt_tokens = 0
+        self.total_completion_tokens = 0
+        self.total_cached_tokens = 0
+        self.clear_history()
+
+    @property
+    def message_history(self):
+        return self._history
+
+    @message_history.setter
+    def message_history(self, messages):
+        # Plain lists (loaded files, callers replacing the history) are wrapped so stats stay O(1)
+        self._history = messages if isinstance(messages, MessageHistory) else MessageHistory(messages)
+
+    def _system_message(self):
+        return {"role": "system", "content": SYSTEM_PROMPTS[self.current_persona]["prompt"]}
+
+    def _refresh_system_message(self):
+        """Pick up edits to the persona file since the conversation started"""
+        persona = SYSTEM_PROMPTS.get(self.current_persona)
+        if persona is not None and self.message_history[0]["content"] != persona["prompt"]:
+            self.message_history[0] = {"role": "system", "content": persona["prompt"]}
+
+    def _select_window(self):
+        """Return (window, index of the oldest history message kept in it)"""
+        summary = self.summarizer.summary_message() if self.summarizer else None
+        budget = self.max_prompt_tokens - (message_tokens(summary) if summary else 0)
+        if self.packing == "stable":
+            window, evicted = select_stable_window(self.message_history, budget, self._window_start)
+            self._window_start = evicted
+        else:
+            window, evicted = select_context_window(self.message_history, budget)
+        if summary:
+            # Just before the newest message, not after the system prompt: a summary update then
+            # leaves the prefix byte-identical for provider prompt caching
+            window.insert(max(1, len(window) - 1), summary)
+        return window, 1 + evicted
+
+    def get_context_window(self):
+        """Get the messages sent with the next request: system prompt + newest turns within the token budget (+ summary)"""
+        window, _ = self._select_window()
+        return as_dicts(window)
+
+    def _request_kwargs(self, stream=False):
+        self._refresh_system_message()
+        messages = self.get_context_window()
+        if self.packing == "stable" and router is None and DEFAULT_OPENAI_MODEL.startswith(CACHE_CONTROL_MODEL_PREFIXES):
+            messages = _with_cache_control(messages)
+        kwargs = {
+            "model": DEFAULT_OPENAI_MODEL,
+            "messages": messages,
+            "max_tokens": 500,
+            "temperature": 0.7,
+        }
+        if stream:
+            kwargs["stream"] = True
+            # Ask for a final usage chunk so streamed replies report tokens too
+            kwargs["stream_options"] = {"include_usage": True}
+        return kwargs
+
+    def _begin_call(self, user_input):
+        # Journal and database only see the user turn once it has a reply (see _record_reply),
+        # so a failed call can take it back without leaving an unanswered turn behind
+        self._pending_user = Message("user", user_input)
+        self.message_history.append(self._pending_user)
+        self.last_response_timing = {}
+        self.last_usage = {}
+        self.last_attempts = 0
+        return time.perf_counter()
+
+    def _semantic_key(self, kwargs):
+        """(namespace, question) when this is a history-free first turn, else None"""
+        if semantic_cache is None or len(self.message_history) != 2:
+            return None
+        # Everything but the question: answers never cross personas, prompt edits or model settings
+        namespace = make_cache_key(kwargs["model"], kwargs["temperature"], kwargs["max_tokens"], self.message_history[:1])
+        return namespace, self.message_history[1]["content"]
+
+    def _check_cache(self, kwargs):
+        """Look the request up in the exact and semantic caches; returns (keys, cached response)"""
+        key = semantic_key = cached = None
+        if response_cache is not None:
+            key = make_cache_key(kwargs["model"], kwargs["temperature"], kwargs["max_tokens"], kwargs["messages"])
+            cached = response_cache.get(key)
+        if cached is None:
+            semantic_key = self._semantic_key(kwargs)
+            match = semantic_cache.lookup(*semantic_key) if semantic_key else None
+            if match:
+                cached = match[0]
+        if key is None and semantic_key is None:
+            return (None, None), None
+        if cached is None:
+            self.cache_misses += 1
+        else:
+            self.cache_hits += 1
+            self.last_response_timing = {"time_to_first_token": 0.0, "total_time": 0.0}
+        return (key, semantic_key), cached
+
+    def _store_in_cache(self, keys, response):
+        key, semantic_key = keys
+        if key is not None and response_cache is not None:
+            response_cache.set(key, response)
+        if semantic_key is not None and semantic_cache is not None:
+            semantic_cache.store(*semantic_key, response)
+
+    def _record_usage(self, completion):
+        usage = getattr(completion, "usage", None)
+        if usage:
+            details = getattr(usage, "prompt_tokens_details", None)
+            self.last_usage = {
+                "prompt_tokens": usage.prompt_tokens,
+                "completion_tokens": usage.completion_tokens,
+                # Prompt tokens served from the provider's prefix cache
+                "cached_tokens": getattr(details, "cached_tokens", None) or 0,
+            }
+
+    def _record_metrics(self, start, model, cache_hit=False, streamed=False, error=None, coalesced=False):
+        """Build the per-call metrics record and hand it to the metrics registry"""
+        wall_time = time.perf_counter() - start
+        record = {
+            "timestamp": time.time(),
+            "model": model,
+            "persona": self.current_persona,
+            "streamed": streamed,
+            "wall_time": wall_time,
+            "time_to_first_token": self.last_response_timing.get("time_to_first_token"),
+            "prompt_tokens": self.last_usage.get("prompt_tokens"),
+            "completion_tokens": self.last_usage.get("completion_tokens"),
+            "cached_tokens": self.last_usage.get("cached_tokens"),
+            "retries": max(0, self.last_attempts - 1),
+            "cache_hit": cache_hit,
+            # Served by another caller's identical in-flight request
+            "coalesced": coalesced,
+            "error": type(error).__name__ if error is not None else None,
+        }
+        self.last_call_metrics = record
+        self.call_count += 1
+        self.total_call_time += wall_time
+        self.total_prompt_tokens += record["prompt_tokens"] or 0
+        self.total_completion_tokens += record["completion_tokens"] or 0
+        self.total_cached_tokens += record["cached_tokens"] or 0
+        metrics.record(record)
+
+    def _append_message(self, role, content):
+        message = Message(role, content)
+        self.message_history.append(message)
+        self._persist(message)
+
+    def _persist(self, message):
+        if self.journal:
+            self.journal.append(message)
+        if self.db:
+            if self.db_conversation_id is None:
+                self.db_conversation_id = self.db.create_conversation(self.current_persona, [message])
+            else:
+                self.db.add_message(self.db_conversation_id, message.role, message.content)
+
+    def _discard_pending(self):
+        """Take back the user turn of a call that ended without a reply"""
+        pending, self._pending_user = self._pending_user, None
+        if pending is not None and self.message_history and self.message_history[-1] is pending:
+            del self.message_history[-1]
+
+    def _record_reply(self, response):
+        pending, self._pending_user = self._pending_user, None
+        if pending is not None:
+            self._persist(pending)
+        self._append_message("assistant", response)
+        if self.summarizer:
+            # Summarize whatever the next request will no longer carry, off the critical path
+            _, first_kept = self._select_window()
+            self.summarizer.schedule(self.message_history, first_kept)
+
+    def chat(self, user_input):
+        """Send user input to LLM and get response"""
+        start = self._begin_call(user_input)
+        kwargs = self._request_kwargs()
+        cache_key, cached = self._check_cache(kwargs)
+        if cached is not None:
+            self._record_reply(cached)
+            self._record_metrics(start, kwargs["model"], cache_hit=True)
+            return cached
+
+        coalesced = False
+        try:
+            completion, attempts, coalesced = _call_once(kwargs, lambda: call_with_retries(
+                lambda timeout: _limited(kwargs, self.user, lambda: _create_completion(kwargs, timeout)),
+                retry_policy, circuit_breaker))
+            # Only the caller that made the request reports its attempts
+            self.last_attempts = 0 if coalesced else attempts
+            response = completion.choices[0].message.content
+            elapsed = time.perf_counter() - start
+        except Exception as e:
+            self._discard_pending()
+            self._record_metrics(start, kwargs["model"], error=e, coalesced=coalesced)
+            _raise_api_error(e)
+        except BaseException:
+            self._discard_pending()
+            raise
+
+        # Without streaming the first token arrives with the whole reply
+        self.last_response_timing = {"time_to_first_token": elapsed, "total_time": elapsed}
+        self._record_usage(completion)
+        self._store_in_cache(cache_key, response)
+        self._record_reply(response)
+        self._record_metrics(start, kwargs["model"], coalesced=coalesced)
         return response
-    except Exception as e:
-        raise Exception(f"API call failed: {str(e)}")
+
+    def chat_stream(self, user_input):
+        """Send user input to LLM and yield the response text as it arrives
+
+        The assembled reply is appended to the history once the stream ends.
+        If the caller stops reading early, the part it was shown becomes the
+        reply; if the stream fails, the user turn is taken back.
+        """
+        start = self._begin_call(user_input)
+        parts = []
+        kwargs = self._request_kwargs(stream=True)
+        cache_key, cached = self._check_cache(kwargs)
+        if cached is not None:
+            try:
+                yield cached
+            finally:
+                self._record_reply(cached)
+                self._record_metrics(start, kwargs["model"], cache_hit=True, streamed=True)
+            return
+
+        def produce(meta):
+            def attempt(timeout):
+                # Once every coalesced reader has left, neither retry nor keep reading
+                meta.check()
+                return _limited(kwargs, self.user,
+                                lambda: meta.close_when_abandoned(_create_completion(kwargs, timeout)))
+
+            # Only opening the stream is retried; a stream that fails midway cannot be replayed
+            stream, meta["attempts"] = call_with_retries(attempt, retry_policy, circuit_breaker)
+            yield from stream
+
+        chunks, meta, coalesced = _open_stream(kwargs, produce, request_coalescer)
+        try:
+            for chunk in chunks:
+                self._record_usage(chunk)
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    if not parts:
+                        self.last_response_timing["time_to_first_token"] = time.perf_counter() - start
+                    parts.append(delta)
+                    yield delta
+        except Exception as e:
+            self._discard_pending()
+            self.last_attempts = 0 if coalesced else meta.get("attempts", 0)
+            self._record_metrics(start, kwargs["model"], streamed=True, error=e, coalesced=coalesced)
+            _raise_api_error(e)
+        except BaseException:
+            # Closed early, or interrupted: keep what the caller was shown
+            self._end_stream(start, kwargs["model"], parts, meta, coalesced)
+            raise
+        finally:
+            # Also runs when the caller stops reading early, which releases a shared stream
+            chunks.close()
+
+        self._end_stream(start, kwargs["model"], parts, meta, coalesced, cache_key)
+
+    async def achat(self, user_input):
+        """Async version of chat(), bounded by the shared concurrency semaphore"""
+        async_client, semaphore = _get_async_resources()
+        start = self._begin_call(user_input)
+        kwargs = self._request_kwargs()
+        cache_key, cached = self._check_cache(kwargs)
+        if cached is not None:
+            self._record_reply(cached)
+            self._record_metrics(start, kwargs["model"], cache_hit=True)
+            return cached
+
+        async def attempt(timeout):
+            async def create():
+                # Hold a concurrency slot per attempt, not while backing off or queued for quota
+                async with semaphore:
+                    return await _acreate_completion(async_client, kwargs, timeout)
+            return await _alimited(kwargs, self.user, create)
+
+        coalesced = False
+        try:
+            completion, attempts, coalesced = await _acall_once(
+                kwargs, lambda: acall_with_retries(attempt, retry_policy, circuit_breaker))
+            self.last_attempts = 0 if coalesced else attempts
+            response = completion.choices[0].message.content
+            elapsed = time.perf_counter() - start
+        except Exception as e:
+            self._discard_pending()
+            self._record_metrics(start, kwargs["model"], error=e, coalesced=coalesced)
+            _raise_api_error(e)
+        except BaseException:
+            # Cancelled: the caller never saw a reply
+            self._discard_pending()
+            raise
+
+        self.last_response_timing = {"time_to_first_token": elapsed, "total_time": elapsed}
+        self._record_usage(completion)
+        self._store_in_cache(cache_key, response)
+        self._record_reply(response)
+        self._record_metrics(start, kwargs["model"], coalesced=coalesced)
+        return response
+
+    async def achat_stream(self, user_input):
+        """Async version of chat_stream(), yielding response text as it arrives"""
+        async_client, semaphore = _get_async_resources()
+        start = self._begin_call(user_input)
+        parts = []
+        kwargs = self._request_kwargs(stream=True)
+        cache_key, cached = self._check_cache(kwargs)
+        if cached is not None:
+            try:
+                yield cached
+            finally:
+                self._record_reply(cached)
+                self._record_metrics(start, kwargs["model"], cache_hit=True, streamed=True)
+            return
+
+        async def produce(meta):
+            held = False
+
+            async def attempt(timeout):
+                async def create():
+                    nonlocal held
+                    # Like achat: a slot per attempt once quota is granted, kept until the stream is drained
+                    await semaphore.acquire()
+                    try:
+                        stream = await _acreate_completion(async_client, kwargs, timeout)
+                    except BaseException:
+                        semaphore.release()
+                        raise
+                    held = True
+                    return stream
+                return await _alimited(kwargs, self.user, create)
+
+            try:
+                stream, meta["attempts"] = await acall_with_retries(attempt, retry_policy, circuit_breaker)
+                async for chunk in stream:
+                    yield chunk
+            finally:
+                if held:
+                    semaphore.release()
+
+        chunks, meta, coalesced = _open_stream(kwargs, produce, _get_async_coalescer())
+        try:
+            async for chunk in chunks:
+                self._record_usage(chunk)
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    if not parts:
+                        self.last_response_timing["time_to_first_token"] = time.perf_counter() - start
+                    parts.append(delta)
+                    yield delta
+        except Exception as e:
+            self._discard_pending()
+            self.last_attempts = 0 if coalesced else meta.get("attempts", 0)
+            self._record_metrics(start, kwargs["model"], streamed=True, error=e, coalesced=coalesced)
+            _raise_api_error(e)
+        except BaseException:
+            # Closed early, or cancelled (client gone): keep what the caller was shown
+            self._end_stream(start, kwargs["model"], parts, meta, coalesced)
+            raise
+        finally:
+            await chunks.aclose()
+
+        self._end_stream(start, kwargs["model"], parts, meta, coalesced, cache_key)
+
+    def _end_stream(self, start, model, parts, meta, coalesced, cache_key=None):
+        """Record a streamed reply; without cache_key it was cut short and is not cached"""
+        self.last_attempts = 0 if coalesced else meta.get("attempts", 0)
+        self.last_response_timing["total_time"] = time.perf_counter() - start
+        if cache_key is None and not parts:
+            # Stopped before any text arrived: there is no reply to keep
+            self._discard_pending()
+        else:
+            response = "".join(parts)
+            if cache_key is not None:
+                self._store_in_cache(cache_key, response)
+            self._record_reply(response)
+        self._record_metrics(start, model, streamed=True, coalesced=coalesced)
+
+    def get_last_response_timing(self):
+        """Get time-to-first-token and total time (seconds) of the last reply"""
+        return dict(self.last_response_timing)
+
+    def get_last_usage(self):
+        """Get prompt/completion token counts reported for the last reply"""
+        return dict(self.last_usage)
+
+    def set_system_prompt(self, persona):
+        """Change the AI persona"""
+        if persona in SYSTEM_PROMPTS:
+            self.current_persona = persona
+            # Reset conversation with new system prompt
+            self.clear_history()
+            return f"[OK] Switched to {SYSTEM_PROMPTS[persona]['name']} mode"
+        else:
+            available = ", ".join(SYSTEM_PROMPTS.keys())
+            return f"[ERROR] Invalid persona '{persona}'. Available: {available}"
+
+    def get_current_persona(self):
+        """Get current persona name"""
+        return self.current_persona
+
+    def get_current_persona_info(self):
+        """Get current persona full information"""
+        persona = SYSTEM_PROMPTS.get(self.current_persona)
+        if persona is None:
+            # The persona file was removed; the session keeps its last prompt
+            return {"name": self.current_persona, "prompt": self.message_history[0]["content"]}
+        return persona
+
+    def clear_history(self):
+        """Clear conversation history but keep system prompt"""
+        self.message_history = [self._system_message()]
+        self._forget_resumed_journal()
+        self._window_start = 0
+        if self.summarizer:
+            self.summarizer.reset()
+        if self.journal:
+            self.journal.reset(self.current_persona)
+        # The next message starts a new conversation in the database
+        self.db_conversation_id = None
+
+    def get_conversation_history(self):
+        """Get a live, read-only view of the conversation history (nothing is copied)"""
+        return self.message_history.view()
+
+    def save_conversation(self, filename=None, fsync="interval"):
+        """Save current conversation and keep autosaving it after every message
+
+        The default format is an append-only JSON Lines journal: this call
+        writes the history once, then each new message is appended as one
+        line. A filename ending in .json writes a one-off JSON snapshot instead.
+        """
+        if not filename:
+            if self.journal:
+                return self.journal.path
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            filename = f"conversation_{self.current_persona}_{timestamp}.jsonl"
+
+        try:
+            if filename.endswith(".json"):
+                self._save_snapshot(filename)
+            elif not (self.journal and self.journal.path == filename):
+                self._start_journal(filename, fsync)
+            return filename
+        except Exception as e:
+            raise Exception(f"Failed to save conversation: {str(e)}")
+
+    def _save_snapshot(self, filename):
+        conversation_data = {
+            "timestamp": datetime.now().isoformat(),
+            "persona": self.current_persona,
+            "persona_info": self.get_current_persona_info(),
+            "conversation": as_dicts(self._full_history())
+        }
+        with open(filename, 'w', encoding='utf-8') as f:
+            json.dump(conversation_data, f, indent=2, ensure_ascii=False)
+
+    def _start_journal(self, filename, fsync):
+        self.close()
+        # Read before opening: the file may be the journal this conversation was resumed from
+        history = self._full_history()
+        journal = ConversationJournal(filename, self.current_persona, fsync=fsync)
+        if not journal.is_new:
+            # Whatever the file held before is a different conversation
+            journal.reset(self.current_persona)
+        for message in history[1:]:
+            if message is not self._pending_user:
+                journal.append(message)
+        self.journal = journal
+        if self._resumed_journal is not None:
+            # The new journal holds the whole conversation; older messages are now read from it
+            self._resumed_journal = filename
+
+    def _forget_resumed_journal(self):
+        self._resumed_journal = None
+        self._earlier = None
+
+    def _earlier_messages(self):
+        """Messages of a tail-resumed journal that are older than the loaded history
+
+        Reads the whole journal, so only the paths that need the full
+        conversation (stats, snapshots, the database) call it.
+        """
+        if self._resumed_journal is None:
+            return []
+        _, messages = read_journal(self._resumed_journal)
+        # The journal ends with everything in the history except the system prompt and an unanswered turn
+        in_journal = len(self.message_history) - 1 - (self._pending_user is not None)
+        return messages[:max(0, len(messages) - in_journal)]
+
+    def _earlier_history(self):
+        """_earlier_messages() as a MessageHistory, read once per resume: that part no longer changes"""
+        if self._earlier is None:
+            self._earlier = MessageHistory(self._earlier_messages())
+        return self._earlier
+
+    def _full_history(self):
+        """The whole conversation, including what a tail resume left on disk"""
+        earlier = self._earlier_messages()
+        if not earlier:
+            return self.message_history
+        return self.message_history[:1] + [Message.from_dict(m) for m in earlier] + self.message_history[1:]
+
+    def record_to_database(self, db=None):
+        """Store this conversation in the database and keep adding new messages to it"""
+        self.db = db or get_conversation_db()
+        if self.db_conversation_id is None and len(self.message_history) > 1:
+            self.db_conversation_id = self.db.create_conversation(self.current_persona, self._full_history())
+        return self.db_conversation_id
+
+    def load_from_database(self, conversation_id, db=None):
+        """Resume a conversation stored in the database"""
+        db = db or get_conversation_db()
+        conversation = db.get_conversation(conversation_id)
+        if conversation is None:
+            raise Exception(f"Failed to load conversation: no conversation with id {conversation_id}")
+        self.close()
+        self.current_persona = conversation["persona"] if conversation["persona"] in SYSTEM_PROMPTS else default_persona()
+        self.message_history = [self._system_message()] + conversation["messages"]
+        self._forget_resumed_journal()
+        self._window_start = 0
+        if self.summarizer:
+            self.summarizer.reset()
+        self.db = db
+        self.db_conversation_id = conversation_id
+        return True
+
+    def compact_journal(self):
+        """Rewrite the autosave journal keeping only the current conversation"""
+        if not self.journal:
+            return 0
+        path, fsync = self.journal.path, self.journal.fsync
+        self.journal.close()
+        kept = compact_journal(path)
+        self.journal = ConversationJournal(path, self.current_persona, fsync=fsync)
+        return kept
+
+    def close(self):
+        """Flush and close the autosave journal, if any"""
+        if self.journal:
+            self.journal.close()
+            self.journal = None
+
+    def load_conversation(self, filename):
+        """Load conversation from a JSON snapshot or resume a JSON Lines journal
+
+        Journals are read from the end and only as far back as the context
+        window needs; later messages are appended to the same journal. Stats,
+        snapshots and the database still see the whole conversation: they
+        read the older part from the journal when asked.
+        """
+        try:
+            if not os.path.exists(filename):
+                raise FileNotFoundError(f"File not found: {filename}")
+
+            if filename.endswith(".jsonl"):
+                persona, messages = read_journal_tail(filename, max_tokens=self.max_prompt_tokens)
+                self.close()
+                self.current_persona = persona if persona in SYSTEM_PROMPTS else default_persona()
+                self.message_history = [self._system_message()] + messages
+                self.journal = ConversationJournal(filename, self.current_persona)
+                self._forget_resumed_journal()
+                self._resumed_journal = filename
+            else:
+                with open(filename, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+
+                # Restore conversation state
+                self._forget_resumed_journal()
+                persona = data.get("persona")
+                self.current_persona = persona if persona in SYSTEM_PROMPTS else default_persona()
+                self.message_history = data.get("conversation", [])
+
+                # Ensure we have a valid system prompt
+                if not self.message_history or self.message_history[0]["role"] != "system":
+                    self.message_history.insert(0, self._system_message())
+            self._window_start = 0
+            if self.summarizer:
+                self.summarizer.reset()
+            if self.db:
+                # Loaded history becomes a new conversation in the database
+                self.db_conversation_id = None
+                self.record_to_database(self.db)
+
+            return True
+        except Exception as e:
+            raise Exception(f"Failed to load conversation: {str(e)}")
+
+    def get_conversation_stats(self):
+        """Get statistics about current conversation"""
+        history = self.message_history
+        # Whatever a tail resume left on disk still counts
+        earlier = self._earlier_history()
+        return {
+            # Running counts kept by the history: no scan, however long the conversation
+            "user_messages": history.role_count("user") + earlier.role_count("user"),
+            "assistant_messages": history.role_count("assistant") + earlier.role_count("assistant"),
+            "total_messages": len(history) - 1 + len(earlier),  # Exclude system message
+            "history_tokens": history.tokens + earlier.tokens,
+            "current_persona": self.get_current_persona_info()["name"],
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses,
+            "llm_calls": self.call_count,
+            "avg_response_time": self.total_call_time / self.call_count if self.call_count else 0.0,
+            "prompt_tokens": self.total_prompt_tokens,
+            "completion_tokens": self.total_completion_tokens,
+            "cached_tokens": self.total_cached_tokens,
+            "last_call": dict(self.last_call_metrics),
+        }
+
+
+# Default session used by the module-level functions (CLI, scripts); created on first use
+_default_session = None
+
+def __getattr__(name):
+    # Keep `llm_helpers.message_history` etc. working for existing callers
+    if name in ("current_persona", "message_history", "last_response_timing"):
+        return getattr(get_default_session(), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def get_default_session():
+    """Get the session shared by the module-level functions"""
+    global _default_session
+    if _default_session is None:
+        _default_session = ChatSession()
+    return _default_session
+
+def chat(user_input):
+    """Send user input to LLM and get response"""
+    return get_default_session().chat(user_input)
+
+def chat_stream(user_input):
+    """Send user input to LLM and yield the response text as it arrives"""
+    return get_default_session().chat_stream(user_input)
+
+async def achat(user_input):
+    """Async version of chat() using the shared AsyncOpenAI client"""
+    return await get_default_session().achat(user_input)
+
+def achat_stream(user_input):
+    """Async generator of response text for the default session"""
+    return get_default_session().achat_stream(user_input)
+
+def get_last_response_timing():
+    """Get time-to-first-token and total time (seconds) of the last reply"""
+    return get_default_session().get_last_response_timing()
 
 def set_system_prompt(persona):
     """Change the AI persona"""
-    global current_persona, message_history
-    
-    if persona in SYSTEM_PROMPTS:
-        current_persona = persona
-        # Reset conversation with new system prompt
-        message_history = [{"role": "system", "content": SYSTEM_PROMPTS[persona]["prompt"]}]
-        return f"[OK] Switched to {SYSTEM_PROMPTS[persona]['name']} mode"
-    else:
-        available = ", ".join(SYSTEM_PROMPTS.keys())
-        return f"[ERROR] Invalid persona '{persona}'. Available: {available}"
+    return get_default_session().set_system_prompt(persona)
+
+def default_persona():
+    """DEFAULT_PERSONA, or the first available persona if its file is gone or broken"""
+    if DEFAULT_PERSONA in SYSTEM_PROMPTS:
+        return DEFAULT_PERSONA
+    return next(iter(SYSTEM_PROMPTS), DEFAULT_PERSONA)
 
 def get_available_personas():
     """Get list of available persona names"""
-    return list(SYSTEM_PROMPTS.keys())
+    return list(SYSTEM_PROMPTS)
+
+def get_persona_name(persona):
+    """Display name of a persona, or its key if the persona no longer exists"""
+    info = SYSTEM_PROMPTS.get(persona)
+    return info["name"] if info else persona
 
 def get_current_persona():
     """Get current persona name"""
-    return current_persona
+    return get_default_session().get_current_persona()
 
 def get_current_persona_info():
     """Get current persona full information"""
-    return SYSTEM_PROMPTS[current_persona]
+    return get_default_session().get_current_persona_info()
 
 def clear_history():
     """Clear conversation history but keep system prompt"""
-    global message_history
-    message_history = [{"role": "system", "content": SYSTEM_PROMPTS[current_persona]["prompt"]}]
+    get_default_session().clear_history()
 
 def get_conversation_history():
     """Get current conversation history"""
-    return message_history.copy()
+    return get_default_session().get_conversation_history()
 
 # Bonus: Conversation persistence functions
 def save_conversation(filename=None):
     """Save current conversation to JSON file"""
-    if not filename:
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"conversation_{current_persona}_{timestamp}.json"
-    
-    conversation_data = {
-        "timestamp": datetime.now().isoformat(),
-        "persona": current_persona,
-        "persona_info": SYSTEM_PROMPTS[current_persona],
-        "conversation": message_history
-    }
-    
-    try:
-        with open(filename, 'w', encoding='utf-8') as f:
-            json.dump(conversation_data, f, indent=2, ensure_ascii=False)
-        return filename
-    except Exception as e:
-        raise Exception(f"Failed to save conversation: {str(e)}")
+    return get_default_session().save_conversation(filename)
 
 def load_conversation(filename):
     """Load conversation from JSON file"""
-    global message_history, current_persona
-    
-    try:
-        if not os.path.exists(filename):
-            raise FileNotFoundError(f"File not found: {filename}")
-        
-        with open(filename, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        
-        # Restore conversation state
-        current_persona = data.get("persona", "professional")
-        message_history = data.get("conversation", [])
-        
-        # Ensure we have a valid system prompt
-        if not message_history or message_history[0]["role"] != "system":
-            message_history.insert(0, {"role": "system", "content": SYSTEM_PROMPTS[current_persona]["prompt"]})
-        
-        return True
-    except Exception as e:
-        raise Exception(f"Failed to load conversation: {str(e)}")
+    return get_default_session().load_conversation(filename)
+
+def record_to_database():
+    """Store the current conversation in the database; returns its id"""
+    return get_default_session().record_to_database()
+
+def load_from_database(conversation_id):
+    """Resume a conversation stored in the database"""
+    return get_default_session().load_from_database(conversation_id)
+
+def list_saved_conversations(persona=None, limit=20):
+    """List the most recently updated conversations in the database"""
+    return get_conversation_db().list_conversations(persona=persona, limit=limit)
+
+def search_conversations(text, persona=None, limit=20):
+    """Full-text search over all saved messages"""
+    return get_conversation_db().search_messages(text, persona=persona, limit=limit)
 
 def get_conversation_stats():
     """Get statistics about current conversation"""
-    user_messages = len([msg for msg in message_history if msg["role"] == "user"])
-    assistant_messages = len([msg for msg in message_history if msg["role"] == "assistant"])
-    return {
-        "user_messages": user_messages,
-        "assistant_messages": assistant_messages,
-        "total_messages": len(message_history) - 1,  # Exclude system message
-        "current_persona": SYSTEM_PROMPTS[current_persona]["name"]
-    }
+    return get_default_session().get_conversation_stats()
+
+def get_metrics_summary():
+    """Aggregate latency/token metrics over every LLM call in this process"""
+    return metrics.summary()
+
+def export_metrics(format="prometheus"):
+    """Export all call metrics as Prometheus text or JSON"""
+    if format == "json":
+        return metrics.to_json()
+    if format == "prometheus":
+        return metrics.to_prometheus()
+    raise ValueError(f"Invalid metrics format '{format}'. Available: prometheus, json")
@@ -0,0 +1,220 @@
+"""
+Compact in-memory conversation history
+Messages are slotted, read-only mappings with interned roles; the history
+keeps per-role counts and its token total up to date as it changes, so
+stats never rescan the conversation.
+"""
+
+from collections.abc import Mapping, MutableSequence, Sequence
+import sys
+
+from utils.token_counter import count_message_tokens
+
+
+class Message(Mapping):
+    """One chat message: a read-only stand-in for {"role": ..., "content": ...}
+
+    Reads like the dict it replaces (message["role"], .get(), dict(message),
+    == against dicts) at about half the memory. Keys other than role and
+    content, e.g. from an imported file, are kept in extra.
+    """
+
+    __slots__ = ("role", "content", "extra", "_tokens")
+
+    def __init__(self, role, content, extra=None):
+        # One shared "user"/"assistant" string instead of one per loaded message
+        self.role = sys.intern(role)
+        self.content = content
+        self.extra = extra or None
+        self._tokens = None
+
+    @classmethod
+    def from_dict(cls, message):
+        if isinstance(message, Message):
+            return message
+        if len(message) == 2:
+            return cls(message["role"], message["content"])
+        return cls(message["role"], message["content"],
+                   {key: value for key, value in message.items() if key not in ("role", "content")})
+
+    @property
+    def tokens(self):
+        """Prompt tokens of this message, counted on first use"""
+        if self._tokens is None:
+            self._tokens = count_message_tokens(self)
+        return self._tokens
+
+    def __getitem__(self, key):
+        if key == "role":
+            return self.role
+        if key == "content":
+            return self.content
+        if self.extra is not None and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def __iter__(self):
+        yield "role"
+        yield "content"
+        if self.extra is not None:
+            yield from self.extra
+
+    def __len__(self):
+        return 2 + (len(self.extra) if self.extra is not None else 0)
+
+    def to_dict(self):
+        message = {"role": self.role, "content": self.content}
+        if self.extra is not None:
+            message.update(self.extra)
+        return message
+
+    def __repr__(self):
+        return f"Message({self.to_dict()!r})"
+
+
+def as_dicts(messages):
+    """Plain dict copies of messages, for JSON and the API client"""
+    return [message.to_dict() if isinstance(message, Message) else message for message in messages]
+
+
+class HistoryView(Sequence):
+    """Live, read-only view of a MessageHistory; nothing is copied"""
+
+    __slots__ = ("_messages",)
+
+    def __init__(self, messages):
+        self._messages = messages
+
+    def __getitem__(self, index):
+        return self._messages[index]
+
+    def __len__(self):
+        return len(self._messages)
+
+    def __iter__(self):
+        return iter(self._messages)
+
+    def __eq__(self, other):
+        if isinstance(other, (HistoryView, MessageHistory)):
+            other = other._messages
+        return self._messages == other if isinstance(other, list) else NotImplemented
+
+    def __repr__(self):
+        return f"HistoryView({self._messages!r})"
+
+
+class MessageHistory(MutableSequence):
+    """List of Messages that tracks per-role counts and total tokens as it changes
+
+    Anything appended or inserted (dicts included) is stored as a Message.
+    Role counts are updated on every change. The token total counts each
+    message once, the first time the total is read after it was added, so
+    loading a long conversation does not tokenize all of it up front.
+    Slicing returns a plain list of Messages.
+    """
+
+    def __init__(self, messages=()):
+        self._messages = []
+        self._role_counts = {}
+        self._tokens = 0
+        self._counted = 0  # _tokens covers _messages[:_counted]
+        self.extend(messages)
+
+    def _add_role(self, role, amount):
+        self._role_counts[role] = self._role_counts.get(role, 0) + amount
+
+    def _recount(self):
+        self._role_counts = {}
+        for message in self._messages:
+            self._add_role(message.role, 1)
+        self._tokens = 0
+        self._counted = 0
+
+    def _position(self, index):
+        return index + len(self._messages) if index < 0 else index
+
+    def __getitem__(self, index):
+        return self._messages[index]
+
+    def __setitem__(self, index, message):
+        if isinstance(index, slice):
+            self._messages[index] = [Message.from_dict(m) for m in message]
+            self._recount()
+            return
+        message = Message.from_dict(message)
+        old = self._messages[index]
+        self._messages[index] = message
+        self._add_role(old.role, -1)
+        self._add_role(message.role, 1)
+        if self._position(index) < self._counted:
+            self._tokens += message.tokens - old.tokens
+
+    def __delitem__(self, index):
+        if isinstance(index, slice):
+            del self._messages[index]
+            self._recount()
+            return
+        position = self._position(index)
+        old = self._messages.pop(index)
+        self._add_role(old.role, -1)
+        if position < self._counted:
+            self._tokens -= old.tokens
+            self._counted -= 1
+
+    def insert(self, index, message):
+        message = Message.from_dict(message)
+        position = min(max(self._position(index), 0), len(self._messages))
+        self._messages.insert(position, message)
+        self._add_role(message.role, 1)
+        if position < self._counted:
+            self._tokens += message.tokens
+            self._counted += 1
+
+    def append(self, message):
+        message = Message.from_dict(message)
+        self._messages.append(message)
+        self._add_role(message.role, 1)
+
+    def extend(self, messages):
+        # Inlined fast path for plain {"role", "content"} dicts: loading a long conversation lands here
+        added = [m if m.__class__ is Message else Message(m["role"], m["content"]) if len(m) == 2 else Message.from_dict(m)
+                 for m in messages]
+        self._messages.extend(added)
+        counts = self._role_counts
+        for message in added:
+            counts[message.role] = counts.get(message.role, 0) + 1
+
+    def clear(self):
+        self._messages.clear()
+        self._role_counts = {}
+        self._tokens = 0
+        self._counted = 0
+
+    def __len__(self):
+        return len(self._messages)
+
+    def __iter__(self):
+        return iter(self._messages)
+
+    def __eq__(self, other):
+        if isinstance(other, (HistoryView, MessageHistory)):
+            other = other._messages
+        return self._messages == other if isinstance(other, list) else NotImplemented
+
+    def __repr__(self):
+        return f"MessageHistory({self._messages!r})"
+
+    def role_count(self, role):
+        return self._role_counts.get(role, 0)
+
+    @property
+    def tokens(self):
+        """Prompt tokens of the whole history"""
+        messages = self._messages
+        while self._counted < len(messages):
+            self._tokens += messages[self._counted].tokens
+            self._counted += 1
+        return self._tokens
+
+    def view(self):
+        return HistoryView(self._messages)
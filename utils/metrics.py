@@ -0,0 +1,182 @@
+"""
+Per-call LLM metrics: pluggable hooks, histograms, Prometheus and JSON export
+"""
+
+from collections import defaultdict
+import json
+import threading
+
+# Seconds; spans cache hits (sub-millisecond) to slow completions
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384)
+
+
+def _label_value(value):
+    """Escape a label value as the Prometheus text format requires"""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus style"""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = i
+                break
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """Estimate a quantile by linear interpolation within its bucket"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        for i, bucket_count in enumerate(self.counts):
+            upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+            if bucket_count and seen + bucket_count >= rank:
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+            lower = upper
+        return self.buckets[-1]
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "buckets": dict(zip([str(b) for b in self.buckets] + ["+Inf"], self.counts)),
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+        }
+
+
+class MetricsRegistry:
+    """Aggregates call records and forwards each one to registered hooks
+
+    A record is a dict with model, persona, wall_time, time_to_first_token,
+    prompt_tokens, completion_tokens, cached_tokens, retries, cache_hit,
+    coalesced, streamed and error. Coalesced calls shared another call's
+    upstream request, so their tokens are not added to the token totals.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hooks = []
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.histograms = {
+                "wall_time_seconds": Histogram(LATENCY_BUCKETS),
+                "time_to_first_token_seconds": Histogram(LATENCY_BUCKETS),
+                "prompt_tokens": Histogram(TOKEN_BUCKETS),
+                "completion_tokens": Histogram(TOKEN_BUCKETS),
+            }
+            self.calls = defaultdict(int)  # (model, persona, outcome) -> count
+            self.totals = defaultdict(int)
+
+    def add_hook(self, hook):
+        """Call hook(record) for every LLM call, e.g. to ship metrics elsewhere"""
+        self._hooks.append(hook)
+
+    def remove_hook(self, hook):
+        self._hooks.remove(hook)
+
+    def record(self, record):
+        if record.get("error"):
+            outcome = "error"
+        elif record.get("cache_hit"):
+            outcome = "cache_hit"
+        elif record.get("coalesced"):
+            outcome = "coalesced"
+        else:
+            outcome = "ok"
+        with self._lock:
+            self.calls[(record.get("model"), record.get("persona"), outcome)] += 1
+            self.totals["retries"] += record.get("retries") or 0
+            self.histograms["wall_time_seconds"].observe(record["wall_time"])
+            for name in ("time_to_first_token_seconds", "prompt_tokens", "completion_tokens"):
+                value = record.get(name.replace("_seconds", ""))
+                if value is not None:
+                    self.histograms[name].observe(value)
+                    if name.endswith("tokens") and not record.get("coalesced"):
+                        self.totals[name] += value
+            if not record.get("coalesced"):
+                self.totals["cached_tokens"] += record.get("cached_tokens") or 0
+        for hook in list(self._hooks):
+            try:
+                hook(record)
+            except Exception:
+                # A broken exporter must never fail a user's chat turn
+                pass
+
+    def summary(self):
+        """Compact aggregate view for stats displays"""
+        with self._lock:
+            wall = self.histograms["wall_time_seconds"]
+            ttft = self.histograms["time_to_first_token_seconds"]
+            outcomes = defaultdict(int)
+            for (_, _, outcome), count in self.calls.items():
+                outcomes[outcome] += count
+            return {
+                "calls": sum(outcomes.values()),
+                "errors": outcomes["error"],
+                "cache_hits": outcomes["cache_hit"],
+                "coalesced": outcomes["coalesced"],
+                "retries": self.totals["retries"],
+                "prompt_tokens": self.totals["prompt_tokens"],
+                "completion_tokens": self.totals["completion_tokens"],
+                "cached_tokens": self.totals["cached_tokens"],
+                "wall_time_p50": wall.quantile(0.5),
+                "wall_time_p95": wall.quantile(0.95),
+                "time_to_first_token_p50": ttft.quantile(0.5),
+                "time_to_first_token_p95": ttft.quantile(0.95),
+            }
+
+    def to_json(self):
+        with self._lock:
+            data = {
+                "histograms": {name: h.to_dict() for name, h in self.histograms.items()},
+                "calls": [
+                    {"model": model, "persona": persona, "outcome": outcome, "count": count}
+                    for (model, persona, outcome), count in self.calls.items()
+                ],
+                "totals": dict(self.totals),
+            }
+        return json.dumps(data, indent=2)
+
+    def to_prometheus(self, prefix="chatbot_llm"):
+        """Render everything in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            lines.append(f"# HELP {prefix}_calls_total LLM calls by model, persona and outcome")
+            lines.append(f"# TYPE {prefix}_calls_total counter")
+            for (model, persona, outcome), count in sorted(self.calls.items(), key=str):
+                # Persona keys come from file names and model names from config: escape, don't trust
+                labels = ",".join(f'{name}="{_label_value(value)}"' for name, value in
+                                  (("model", model), ("persona", persona), ("outcome", outcome)))
+                lines.append(f"{prefix}_calls_total{{{labels}}} {count}")
+            lines.append(f"# TYPE {prefix}_retries_total counter")
+            lines.append(f"{prefix}_retries_total {self.totals['retries']}")
+            lines.append(f"# TYPE {prefix}_cached_prompt_tokens_total counter")
+            lines.append(f"{prefix}_cached_prompt_tokens_total {self.totals['cached_tokens']}")
+            for name, histogram in self.histograms.items():
+                metric = f"{prefix}_{name}"
+                lines.append(f"# TYPE {metric} histogram")
+                cumulative = 0
+                for bound, count in zip(list(histogram.buckets) + ["+Inf"], histogram.counts):
+                    cumulative += count
+                    lines.append(f'{metric}_bucket{{le="{bound}"}} {cumulative}')
+                lines.append(f"{metric}_sum {histogram.sum}")
+                lines.append(f"{metric}_count {histogram.count}")
+        return "\n".join(lines) + "\n"
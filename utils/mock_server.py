@@ -0,0 +1,313 @@
+"""
+Local OpenAI-compatible mock server for offline testing
+Serves /v1/chat/completions with plain JSON and Server-Sent Events streaming
+"""
+
+import argparse
+import collections
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_REPLY = "This is a mock response from the local test server."
+
+
+class _MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes; Nagle + delayed ACK would add ~40ms
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        # Keep test output clean
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        mock = self.server.mock
+
+        if not self.path.endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": f"Unknown path: {self.path}"}})
+            return
+
+        fault = mock._record_request(body)
+        retry_after = mock._over_quota()
+        if retry_after is not None:
+            self._send_json(429, {"error": {"message": "Rate limit exceeded"}}, {"Retry-After": f"{retry_after:.3f}"})
+            return
+        reply = mock.reply(body.get("messages", [])) if callable(mock.reply) else mock.reply
+        usage = _usage(body, reply)
+        cached_tokens = 0
+        if mock.prompt_cache is not None:
+            cached_tokens = mock._cached_prefix_tokens(body.get("messages", []))
+            usage["prompt_tokens_details"] = {"cached_tokens": cached_tokens}
+
+        delay = mock.latency + mock.prefill_delay * (usage["prompt_tokens"] - cached_tokens)
+        if delay:
+            time.sleep(delay)
+
+        if fault:
+            # Injected failure: optional hang, then an error status (or a normal reply)
+            time.sleep(fault.get("delay", 0))
+            if "status" in fault:
+                headers = {}
+                if "retry_after" in fault:
+                    headers["Retry-After"] = str(fault["retry_after"])
+                self._send_json(fault["status"], {"error": {"message": f"Injected {fault['status']} error"}}, headers)
+                return
+
+        if fault and "disconnect_after" in fault:
+            # Injected network failure: hang up partway through the reply
+            self.close_connection = True
+            if body.get("stream"):
+                self._send_stream(body, reply, usage, disconnect_after=fault["disconnect_after"])
+            return
+        if body.get("stream"):
+            self._send_stream(body, reply, usage)
+        else:
+            self._send_json(200, _completion_payload(body, reply, usage))
+
+    def _send_json(self, status, payload, headers=None):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_stream(self, body, reply, usage, disconnect_after=None):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        mock = self.server.mock
+        for i, token in enumerate(_split_tokens(reply)):
+            if i == disconnect_after:
+                return
+            if i and mock.token_delay:
+                time.sleep(mock.token_delay)
+            self._write_event(_chunk_payload(body, {"content": token}))
+        self._write_event(_chunk_payload(body, {}, finish_reason="stop"))
+        if (body.get("stream_options") or {}).get("include_usage"):
+            # Like the OpenAI API: a final chunk with no choices carries the usage
+            self._write_event(dict(_chunk_payload(body, {}), choices=[], usage=usage))
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._write_chunk(b"")
+
+    def _write_event(self, payload):
+        self._write_chunk(f"data: {json.dumps(payload)}\n\n".encode("utf-8"))
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+
+class _MockHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Allow bursts of concurrent clients without refused connections
+    request_queue_size = 256
+
+    def handle_error(self, request, client_address):
+        # Clients that time out and hang up are expected during fault injection
+        pass
+
+
+def _split_tokens(text):
+    """Split text into word-sized pieces that keep their whitespace"""
+    tokens = []
+    current = ""
+    for char in text:
+        current += char
+        if char == " ":
+            tokens.append(current)
+            current = ""
+    if current:
+        tokens.append(current)
+    return tokens
+
+
+def _message_text(message):
+    content = message.get("content", "")
+    if isinstance(content, list):
+        # Content parts, e.g. text carrying a cache_control hint
+        return " ".join(part.get("text", "") for part in content)
+    return str(content)
+
+
+def _message_tokens(message):
+    return len(_message_text(message).split())
+
+
+def _usage(body, reply):
+    prompt_tokens = sum(_message_tokens(m) for m in body.get("messages", []))
+    completion_tokens = len(_split_tokens(reply))
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+
+
+def _completion_payload(body, reply, usage):
+    return {
+        "id": "chatcmpl-mock",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "mock-model"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": reply},
+            "finish_reason": "stop",
+        }],
+        "usage": usage,
+    }
+
+
+def _chunk_payload(body, delta, finish_reason=None):
+    return {
+        "id": "chatcmpl-mock",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": body.get("model", "mock-model"),
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+
+
+class MockLLMServer:
+    """Threaded fake OpenAI-compatible endpoint bound to localhost
+
+    reply may be a string or a callable taking the request messages.
+    latency delays the first byte; token_delay spaces out streamed tokens.
+    prompt_cache=True simulates provider prefix caching: the longest message
+    prefix seen in an earlier request is reported as cached_tokens, and
+    prefill_delay (seconds per prompt token) is only paid for the rest.
+    tokens_per_second, when given, sets token_delay to 1 / tokens_per_second.
+    faults is a list consumed one per request, each a dict with an optional
+    "delay" (seconds to hang) and "status" (+ "retry_after") to fail with, or
+    "disconnect_after" (tokens streamed before the connection is dropped).
+    Once faults run out, error_rate of the requests fail with a 503; the
+    random draws come from seed, so a run with the same requests is repeatable.
+    quota=(requests, seconds) enforces a provider-style sliding-window limit:
+    requests over it get a 429 with Retry-After and are counted in rejected.
+    """
+
+    def __init__(self, reply=DEFAULT_REPLY, latency=0.0, token_delay=0.0, faults=None, prompt_cache=False,
+                 prefill_delay=0.0, quota=None, tokens_per_second=None, error_rate=0.0, seed=0,
+                 host="127.0.0.1", port=0):
+        self.reply = reply
+        self.latency = latency
+        self.token_delay = 1.0 / tokens_per_second if tokens_per_second else token_delay
+        self.prefill_delay = prefill_delay
+        self.prompt_cache = set() if prompt_cache else None
+        self.faults = list(faults or [])
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self.quota = quota
+        self._admitted = collections.deque()
+        self.rejected = 0
+        self.requests = []
+        self._lock = threading.Lock()
+        self._server = _MockHTTPServer((host, port), _MockHandler)
+        self._server.mock = self
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    @property
+    def request_count(self):
+        with self._lock:
+            return len(self.requests)
+
+    def _record_request(self, body):
+        """Record the request and return the fault to inject for it, if any"""
+        with self._lock:
+            self.requests.append(body)
+            if self.faults:
+                return self.faults.pop(0)
+            if self.error_rate and self._random.random() < self.error_rate:
+                return {"status": 503}
+            return None
+
+    def _over_quota(self):
+        """None when the request fits the quota, else the seconds until it would"""
+        if self.quota is None:
+            return None
+        limit, window = self.quota
+        now = time.monotonic()
+        with self._lock:
+            while self._admitted and now - self._admitted[0] >= window:
+                self._admitted.popleft()
+            if len(self._admitted) < limit:
+                self._admitted.append(now)
+                return None
+            self.rejected += 1
+            return window - (now - self._admitted[0])
+
+    def _cached_prefix_tokens(self, messages):
+        """Tokens in the longest message prefix sent before; remembers this request's prefixes"""
+        digest = hashlib.sha256()
+        cached = tokens = 0
+        with self._lock:
+            for message in messages:
+                # Hints are not part of the cached content
+                digest.update(json.dumps([message.get("role"), _message_text(message)]).encode("utf-8"))
+                key = digest.hexdigest()
+                tokens += _message_tokens(message)
+                if key in self.prompt_cache:
+                    cached = tokens
+                else:
+                    self.prompt_cache.add(key)
+        return cached
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main(argv=None):
+    """Serve a mock endpoint until interrupted, e.g. for OPEN_ROUTER_BASE_URL or load tests"""
+    parser = argparse.ArgumentParser(description="Local OpenAI-compatible mock LLM server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--reply", default=DEFAULT_REPLY)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds before the first byte")
+    parser.add_argument("--tokens-per-second", type=float, help="streaming rate (default: as fast as possible)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests that fail with a 503")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    server = MockLLMServer(reply=args.reply, latency=args.latency, tokens_per_second=args.tokens_per_second,
+                           error_rate=args.error_rate, seed=args.seed, host=args.host, port=args.port)
+    print(f"Mock LLM server at {server.base_url}")
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server._server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Side-by-side persona comparison
+Fans one question out to every persona at once, each in its own ChatSession,
+and streams all replies back interleaved as their tokens arrive.
+"""
+
+import queue
+import threading
+import time
+
+from utils import llm_helpers
+
+
+class PersonaComparison:
+    """One conversation per persona, asked the same questions concurrently
+
+    Each persona keeps its own ChatSession, so follow-up comparisons carry
+    that persona's history and the caller's main conversation is untouched.
+    Personas added to the registry later join the next comparison.
+    """
+
+    def __init__(self, personas=None, user=None):
+        # None means every persona in SYSTEM_PROMPTS at the time of asking
+        self.personas = personas
+        self.user = user
+        self.sessions = {}
+
+    def _sessions_for_round(self):
+        personas = self.personas or llm_helpers.get_available_personas()
+        for persona in personas:
+            if persona not in self.sessions:
+                self.sessions[persona] = llm_helpers.ChatSession(persona, user=self.user)
+        return {persona: self.sessions[persona] for persona in personas}
+
+    def stream(self, question):
+        """Yield (persona, kind, value) events while every persona answers
+
+        kind is "delta" (value: text), "done" (value: the session's response
+        timing) or "error" (value: the exception). Wall time is that of the
+        slowest persona. Closing the generator early stops the remaining
+        streams.
+        """
+        sessions = self._sessions_for_round()
+        events = queue.Queue()
+        stop = threading.Event()
+
+        def answer(persona, session):
+            chunks = session.chat_stream(question)
+            try:
+                for delta in chunks:
+                    if stop.is_set():
+                        break
+                    events.put((persona, "delta", delta))
+                else:
+                    events.put((persona, "done", session.get_last_response_timing()))
+                    return
+            except Exception as e:
+                events.put((persona, "error", e))
+                return
+            finally:
+                chunks.close()
+            events.put((persona, "error", RuntimeError("comparison cancelled")))
+
+        for persona, session in sessions.items():
+            threading.Thread(target=answer, args=(persona, session), daemon=True).start()
+        pending = len(sessions)
+        try:
+            while pending:
+                event = events.get()
+                if event[1] != "delta":
+                    pending -= 1
+                yield event
+        finally:
+            stop.set()
+
+    def ask(self, question):
+        """Return {persona: {"response" or "error", "latency"}} once every persona has answered"""
+        start = time.perf_counter()
+        parts = {}
+        # Persona order, not completion order
+        results = dict.fromkeys(self._sessions_for_round())
+        for persona, kind, value in self.stream(question):
+            if kind == "delta":
+                parts.setdefault(persona, []).append(value)
+            elif kind == "done":
+                results[persona] = {"response": "".join(parts.get(persona, [])), "latency": time.perf_counter() - start}
+            else:
+                results[persona] = {"error": str(value), "latency": time.perf_counter() - start}
+        return results
+
+    def clear(self):
+        """Start every persona's comparison thread over"""
+        for session in self.sessions.values():
+            session.clear_history()
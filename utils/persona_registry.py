@@ -0,0 +1,168 @@
+"""
+Persona registry backed by a directory with one YAML or JSON file per persona
+The file name (without extension) is the persona key; files are parsed on
+first use and reloaded when their mtime changes.
+"""
+
+from collections.abc import Mapping
+import json
+import logging
+import os
+import threading
+import time
+
+PERSONA_EXTENSIONS = (".yaml", ".yml", ".json")
+
+logger = logging.getLogger(__name__)
+
+
+def load_persona_file(path):
+    """Parse one persona file into a dict with at least "name" and "prompt" """
+    with open(path, encoding="utf-8") as f:
+        if path.endswith(".json"):
+            data = json.load(f)
+        else:
+            try:
+                import yaml
+            except ImportError:
+                raise ValueError(f"PyYAML is required to read {path}")
+            try:
+                data = yaml.safe_load(f)
+            except yaml.YAMLError as e:
+                raise ValueError(f"Invalid YAML in {path}: {e}")
+    if not isinstance(data, dict) or not isinstance(data.get("prompt"), str):
+        raise ValueError(f"Persona file {path} must define a 'prompt' string")
+    key = os.path.splitext(os.path.basename(path))[0]
+    data.setdefault("name", key.replace("_", " ").title())
+    return data
+
+
+class PersonaRegistry(Mapping):
+    """Read-only mapping of persona key -> {"name", "prompt", ...}
+
+    The directory is indexed (listed, not parsed) up front; a file is parsed
+    the first time its persona is read, checked with `in` or listed. Freshness
+    checks run at most once per check_interval seconds no matter how often the
+    registry is read: the directory's mtime reveals added, removed or renamed
+    files, and only files that were already parsed are re-stat'ed for edits.
+    A file that fails to reload keeps serving its last good version; one that
+    never parsed is logged and treated as absent until it changes.
+    """
+
+    def __init__(self, directory, check_interval=1.0):
+        self.directory = directory
+        self.check_interval = check_interval
+        self._lock = threading.RLock()
+        self._paths = {}  # key -> file path
+        self._loaded = {}  # key -> (path, mtime_ns, persona)
+        self._broken = {}  # key -> (path, mtime_ns) of a file that failed to parse and has no good version
+        self._dir_mtime = None
+        self._last_check = float("-inf")
+        with self._lock:
+            self._rescan()
+
+    def _rescan(self):
+        try:
+            self._dir_mtime = os.stat(self.directory).st_mtime_ns
+            entries = sorted(os.scandir(self.directory), key=lambda entry: entry.name)
+        except FileNotFoundError:
+            self._dir_mtime = None
+            entries = []
+        paths = {}
+        for entry in entries:
+            key, extension = os.path.splitext(entry.name)
+            if extension.lower() in PERSONA_EXTENSIONS and not key.startswith(".") and entry.is_file():
+                paths.setdefault(key, entry.path)
+        self._paths = paths
+
+    def _refresh(self):
+        now = time.monotonic()
+        if now - self._last_check < self.check_interval:
+            return
+        self._last_check = now
+        try:
+            dir_mtime = os.stat(self.directory).st_mtime_ns
+        except FileNotFoundError:
+            dir_mtime = None
+        if dir_mtime != self._dir_mtime:
+            self._rescan()
+        for key, (path, mtime, persona) in list(self._loaded.items()):
+            if self._paths.get(key) != path:
+                del self._loaded[key]
+                continue
+            try:
+                current_mtime = os.stat(path).st_mtime_ns
+                if current_mtime != mtime:
+                    self._load(key)
+            except OSError:
+                pass
+            except ValueError:
+                # Keep the last good version and don't re-parse the broken file until it changes again
+                self._loaded[key] = (path, current_mtime, persona)
+        for key, (path, mtime) in list(self._broken.items()):
+            try:
+                changed = self._paths.get(key) != path or os.stat(path).st_mtime_ns != mtime
+            except OSError:
+                changed = True
+            if changed:
+                # Parse it again on next use
+                del self._broken[key]
+
+    def _load(self, key):
+        path = self._paths[key]
+        mtime = os.stat(path).st_mtime_ns
+        persona = load_persona_file(path)
+        self._loaded[key] = (path, mtime, persona)
+        return persona
+
+    def _get(self, key):
+        """The persona for key, or None if it has no file or its file has never parsed"""
+        if key not in self._paths or key in self._broken:
+            return None
+        loaded = self._loaded.get(key)
+        if loaded is not None:
+            return loaded[2]
+        path = self._paths[key]
+        try:
+            return self._load(key)
+        except OSError:
+            # Removed since the directory was listed
+            return None
+        except ValueError as e:
+            logger.warning("Skipping persona '%s': %s", key, e)
+            try:
+                self._broken[key] = (path, os.stat(path).st_mtime_ns)
+            except OSError:
+                pass
+            return None
+
+    def __getitem__(self, key):
+        with self._lock:
+            self._refresh()
+            persona = self._get(key)
+            if persona is None:
+                raise KeyError(key)
+            return persona
+
+    def __contains__(self, key):
+        with self._lock:
+            self._refresh()
+            return self._get(key) is not None
+
+    def __iter__(self):
+        with self._lock:
+            self._refresh()
+            return iter([key for key in self._paths if self._get(key) is not None])
+
+    def __len__(self):
+        with self._lock:
+            self._refresh()
+            return sum(1 for key in self._paths if self._get(key) is not None)
+
+    def reload(self):
+        """Drop everything parsed so far and re-index the directory now"""
+        with self._lock:
+            self._loaded.clear()
+            self._broken.clear()
+            self._rescan()
+            self._last_check = time.monotonic()
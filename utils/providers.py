@@ -0,0 +1,295 @@
+"""
+LLM providers and a latency-aware router with failover and hedged requests
+Both backends speak the OpenAI chat completions protocol, so one SDK serves both
+"""
+
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import asyncio
+import inspect
+import threading
+import time
+import weakref
+
+from config import (
+    DEFAULT_GEMINI_MODEL,
+    DEFAULT_OPENAI_MODEL,
+    GEMINI_API_KEY,
+    GEMINI_BASE_URL,
+    OPEN_ROUTER_API_KEY,
+    OPEN_ROUTER_BASE_URL)
+
+# Hedged and failed-over calls run here so the caller can wait on several at once
+_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="provider")
+
+# Latency assumed for a provider whose recent calls all failed: ranked behind any provider
+# with a measured latency, but still finite, so failing providers are ordered by error rate
+UNMEASURED_LATENCY = 10.0
+
+
+class LatencyTracker:
+    """Rolling window of call latencies and outcomes for one provider
+
+    Holds the last window calls, and only those younger than max_age seconds
+    count, so a burst of errors is forgotten once it is old.
+    """
+
+    def __init__(self, window=100, max_age=120.0):
+        self.max_age = max_age
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, latency, ok):
+        with self._lock:
+            self._samples.append((time.monotonic(), latency, ok))
+
+    def snapshot(self):
+        """p50/p95 latency of successful calls, error rate and sample count"""
+        cutoff = time.monotonic() - self.max_age
+        with self._lock:
+            while self._samples and self._samples[0][0] < cutoff:
+                self._samples.popleft()
+            samples = [(latency, ok) for _, latency, ok in self._samples]
+        latencies = sorted(latency for latency, ok in samples if ok)
+        errors = sum(1 for _, ok in samples if not ok)
+
+        def percentile(p):
+            if not latencies:
+                return None
+            return latencies[min(len(latencies) - 1, int(p * len(latencies)))]
+
+        return {
+            "requests": len(samples),
+            "p50": percentile(0.50),
+            "p95": percentile(0.95),
+            "error_rate": errors / len(samples) if samples else 0.0,
+        }
+
+
+class Provider:
+    """An OpenAI-compatible chat completions endpoint serving one model"""
+
+    def __init__(self, name, base_url, api_key, model):
+        self.name = name
+        self.base_url = base_url
+        self.api_key = api_key
+        self.model = model
+        self.latency = LatencyTracker()
+        self._client = None
+        self._async_clients = weakref.WeakKeyDictionary()
+
+    @property
+    def client(self):
+        if self._client is None:
+            from openai import OpenAI
+            self._client = OpenAI(base_url=self.base_url, api_key=self.api_key, max_retries=0)
+        return self._client
+
+    def _async_client(self):
+        loop = asyncio.get_running_loop()
+        async_client = self._async_clients.get(loop)
+        if async_client is None:
+            from openai import AsyncOpenAI
+            async_client = AsyncOpenAI(base_url=self.base_url, api_key=self.api_key, max_retries=0)
+            self._async_clients[loop] = async_client
+        return async_client
+
+    def health_score(self):
+        """Lower is better: p95 latency inflated by the error rate; unmeasured providers go first"""
+        stats = self.latency.snapshot()
+        if stats["requests"] == 0:
+            return 0.0
+        p95 = UNMEASURED_LATENCY if stats["p95"] is None else stats["p95"]
+        return p95 * (1 + 10 * stats["error_rate"])
+
+    def create(self, kwargs, timeout=None):
+        start = time.perf_counter()
+        try:
+            result = self.client.chat.completions.create(**dict(kwargs, model=self.model), timeout=timeout)
+        except Exception:
+            self.latency.record(time.perf_counter() - start, ok=False)
+            raise
+        self.latency.record(time.perf_counter() - start, ok=True)
+        return result
+
+    async def acreate(self, kwargs, timeout=None):
+        start = time.perf_counter()
+        try:
+            result = await self._async_client().chat.completions.create(**dict(kwargs, model=self.model), timeout=timeout)
+        except asyncio.CancelledError:
+            # Lost a hedge race; says nothing about the provider's health
+            raise
+        except Exception:
+            self.latency.record(time.perf_counter() - start, ok=False)
+            raise
+        self.latency.record(time.perf_counter() - start, ok=True)
+        return result
+
+
+class OpenRouterProvider(Provider):
+    def __init__(self, api_key=OPEN_ROUTER_API_KEY, model=DEFAULT_OPENAI_MODEL, base_url=OPEN_ROUTER_BASE_URL):
+        super().__init__("openrouter", base_url, api_key, model)
+
+
+class GeminiProvider(Provider):
+    """Gemini through Google's OpenAI-compatible endpoint"""
+
+    def __init__(self, api_key=GEMINI_API_KEY, model=DEFAULT_GEMINI_MODEL, base_url=GEMINI_BASE_URL):
+        super().__init__("gemini", base_url, api_key, model)
+
+
+def _close_result(future):
+    """Close the stream of a hedged call that finished after the winner"""
+    if not future.cancelled() and future.exception() is None:
+        close = getattr(future.result(), "close", None)
+        if close:
+            close()
+
+
+async def _aclose_result(task):
+    """Async twin of _close_result for a finished task (AsyncStream.close() is a coroutine)"""
+    if not task.cancelled() and task.exception() is None:
+        close = getattr(task.result(), "close", None)
+        if close:
+            closing = close()
+            if inspect.isawaitable(closing):
+                await closing
+
+
+class ProviderRouter:
+    """Sends each request to the healthiest provider
+
+    If the chosen provider has not answered within hedge_after seconds, the
+    next-best provider is called too and the first success wins. Errors fail
+    over to the next provider. For streams, "answered" means the stream opened.
+    A provider demoted by errors that has not been called for probe_interval
+    seconds is tried first on the next request, so it can recover; the hedge
+    still covers the caller if it is slow.
+    """
+
+    def __init__(self, providers, hedge_after=2.0, probe_interval=30.0):
+        if not providers:
+            raise ValueError("ProviderRouter needs at least one provider")
+        self.providers = list(providers)
+        self.hedge_after = hedge_after
+        self.probe_interval = probe_interval
+        self.hedged_requests = 0
+        self.failovers = 0
+        self.probes = 0
+        self._last_tried = {}  # provider name -> monotonic time it was last called
+        self._lock = threading.Lock()
+
+    def ranked(self):
+        return sorted(self.providers, key=lambda provider: provider.health_score())
+
+    def _plan(self):
+        """Providers in the order to try them for one request, with a due probe first"""
+        order = self.ranked()
+        now = time.monotonic()
+        with self._lock:
+            if self.probe_interval is not None:
+                for provider in order[1:]:
+                    if (now - self._last_tried.get(provider.name, now) >= self.probe_interval
+                            and provider.latency.snapshot()["error_rate"] > 0):
+                        order.remove(provider)
+                        order.insert(0, provider)
+                        # Claimed now, so concurrent requests don't probe it too
+                        self._last_tried[provider.name] = now
+                        self.probes += 1
+                        break
+            for provider in order:
+                self._last_tried.setdefault(provider.name, now)
+        return order
+
+    def _tried(self, provider):
+        with self._lock:
+            self._last_tried[provider.name] = time.monotonic()
+
+    def create(self, kwargs, timeout=None):
+        untried = self._plan()
+        pending = {}
+        last_error = None
+
+        def launch():
+            provider = untried.pop(0)
+            self._tried(provider)
+            pending[_executor.submit(provider.create, kwargs, timeout)] = provider
+
+        launch()
+        while pending:
+            hedge_wait = self.hedge_after if untried and self.hedge_after is not None else None
+            done, _ = wait(pending, timeout=hedge_wait, return_when=FIRST_COMPLETED)
+            if not done:
+                self.hedged_requests += 1
+                launch()
+                continue
+            for future in done:
+                pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    last_error = e
+                    continue
+                for loser in pending:
+                    loser.add_done_callback(_close_result)
+                return result
+            if not pending and untried:
+                self.failovers += 1
+                launch()
+        raise last_error
+
+    async def acreate(self, kwargs, timeout=None):
+        untried = self._plan()
+        pending = set()
+        last_error = None
+
+        def launch():
+            provider = untried.pop(0)
+            self._tried(provider)
+            pending.add(asyncio.ensure_future(provider.acreate(kwargs, timeout)))
+
+        launch()
+        try:
+            while pending:
+                hedge_wait = self.hedge_after if untried and self.hedge_after is not None else None
+                done, _ = await asyncio.wait(pending, timeout=hedge_wait, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    self.hedged_requests += 1
+                    launch()
+                    continue
+                for task in done:
+                    pending.discard(task)
+                    try:
+                        return task.result()
+                    except Exception as e:
+                        last_error = e
+                if not pending and untried:
+                    self.failovers += 1
+                    launch()
+            raise last_error
+        finally:
+            # Losing hedges: stop the ones still running, close any that already opened a stream
+            for task in pending:
+                if task.done():
+                    await _aclose_result(task)
+                else:
+                    task.cancel()
+
+    def stats(self):
+        """Rolling latency and error stats per provider, best first"""
+        return {
+            "providers": {provider.name: provider.latency.snapshot() for provider in self.ranked()},
+            "hedged_requests": self.hedged_requests,
+            "failovers": self.failovers,
+            "probes": self.probes,
+        }
+
+
+def default_providers():
+    """Every provider with an API key configured, OpenRouter first"""
+    providers = []
+    if OPEN_ROUTER_API_KEY:
+        providers.append(OpenRouterProvider())
+    if GEMINI_API_KEY:
+        providers.append(GeminiProvider())
+    return providers
@@ -0,0 +1,210 @@
+"""
+Client-side rate limiting for the LLM API
+Token buckets for requests/min and tokens/min, shared by every thread and
+event loop in the process, with optional per-user fair-share queues.
+"""
+
+from collections import OrderedDict, deque
+import asyncio
+import threading
+import time
+
+
+class TokenBucket:
+    """Continuously refilled bucket of per_minute units, holding at most burst_seconds worth
+
+    The level may go negative when actual usage turns out higher than what
+    was reserved; later requests then wait for the debt to refill.
+    """
+
+    def __init__(self, per_minute, burst_seconds=10.0):
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        """Seconds until amount can be taken (requests bigger than the bucket only need a full bucket)"""
+        self._refill(now)
+        needed = min(amount, self.capacity)
+        return 0.0 if self.level >= needed else (needed - self.level) / self.rate
+
+    def take(self, amount):
+        self.level -= amount
+
+    def give(self, amount):
+        self.level = min(self.capacity, self.level + amount)
+
+
+class _Ticket:
+    def __init__(self, tokens, queue_key):
+        self.tokens = tokens
+        self.queue_key = queue_key
+        self.granted = False
+
+
+class Reservation:
+    """Capacity granted for one request; settle() it once the real token usage is known"""
+
+    def __init__(self, limiter, tokens):
+        self._limiter = limiter
+        self.tokens = tokens
+        self.settled = False
+
+    def settle(self, actual_tokens=None):
+        """Charge actual_tokens instead of the up-front estimate (None keeps the estimate)"""
+        if self.settled:
+            return
+        self.settled = True
+        if actual_tokens is not None:
+            self._limiter._adjust_tokens(actual_tokens - self.tokens)
+
+
+class RateLimiter:
+    """Admits requests at most at requests_per_minute and tokens_per_minute
+
+    acquire() (threads) and aacquire() (async tasks) queue the caller until
+    both buckets have room and return a Reservation. Requests are charged
+    their estimated prompt tokens up front; Reservation.settle() corrects
+    that with the usage the provider reports. With fair_share, each user
+    gets their own FIFO queue and the queues are served round-robin, so one
+    busy user cannot starve the rest. pause() holds everyone back after an
+    upstream 429.
+    """
+
+    # How often async waiters re-check; sync waiters are woken directly
+    poll_interval = 0.05
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None, burst_seconds=10.0, fair_share=True):
+        self.requests = TokenBucket(requests_per_minute, burst_seconds) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute, burst_seconds) if tokens_per_minute else None
+        self.fair_share = fair_share
+        self._changed = threading.Condition(threading.Lock())
+        self._queues = OrderedDict()  # user -> deque of tickets, in round-robin order
+        self._paused_until = 0.0
+        self.granted = 0
+        self.total_wait = 0.0
+        self.pauses = 0
+
+    def _wait_time(self, tokens, now):
+        wait = self._paused_until - now
+        if self.requests is not None:
+            wait = max(wait, self.requests.wait_time(1, now))
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.wait_time(tokens, now))
+        return max(0.0, wait)
+
+    def _dispatch(self):
+        """Grant queued tickets in fair order while there is room; returns seconds until the next could go"""
+        now = time.monotonic()
+        granted_any = False
+        while self._queues:
+            key, queue = next(iter(self._queues.items()))
+            ticket = queue[0]
+            wait = self._wait_time(ticket.tokens, now)
+            if wait > 0:
+                break
+            if self.requests is not None:
+                self.requests.take(1)
+            if self.tokens is not None:
+                self.tokens.take(ticket.tokens)
+            ticket.granted = True
+            granted_any = True
+            queue.popleft()
+            # Round-robin: this user goes to the back of the line
+            if queue:
+                self._queues.move_to_end(key)
+            else:
+                del self._queues[key]
+        else:
+            wait = 0.0
+        if granted_any:
+            self._changed.notify_all()
+        return wait
+
+    def _enqueue(self, tokens, user):
+        key = user if self.fair_share else None
+        ticket = _Ticket(tokens, key)
+        self._queues.setdefault(key, deque()).append(ticket)
+        return ticket
+
+    def _withdraw(self, ticket):
+        """Take back a ticket whose caller gave up (e.g. a cancelled task)"""
+        if ticket.granted:
+            if self.requests is not None:
+                self.requests.give(1)
+            if self.tokens is not None:
+                self.tokens.give(ticket.tokens)
+        else:
+            queue = self._queues.get(ticket.queue_key)
+            if queue is not None:
+                queue.remove(ticket)
+                if not queue:
+                    del self._queues[ticket.queue_key]
+        self._changed.notify_all()
+
+    def _granted(self, ticket, start):
+        self.granted += 1
+        self.total_wait += time.monotonic() - start
+        return Reservation(self, ticket.tokens)
+
+    def acquire(self, tokens=0, user=None):
+        """Block until the request may be sent; returns a Reservation"""
+        start = time.monotonic()
+        with self._changed:
+            ticket = self._enqueue(tokens, user)
+            try:
+                while True:
+                    wait = self._dispatch()
+                    if ticket.granted:
+                        return self._granted(ticket, start)
+                    self._changed.wait(wait or None)
+            except BaseException:
+                self._withdraw(ticket)
+                raise
+
+    async def aacquire(self, tokens=0, user=None):
+        """Async version of acquire(); never blocks the event loop"""
+        start = time.monotonic()
+        with self._changed:
+            ticket = self._enqueue(tokens, user)
+        try:
+            while True:
+                with self._changed:
+                    wait = self._dispatch()
+                    if ticket.granted:
+                        return self._granted(ticket, start)
+                await asyncio.sleep(min(wait, self.poll_interval) if wait else self.poll_interval)
+        except BaseException:
+            with self._changed:
+                self._withdraw(ticket)
+            raise
+
+    def _adjust_tokens(self, difference):
+        if self.tokens is None or not difference:
+            return
+        with self._changed:
+            if difference > 0:
+                self.tokens.take(difference)
+            else:
+                self.tokens.give(-difference)
+            self._changed.notify_all()
+
+    def pause(self, seconds):
+        """Admit nothing for the next seconds (the provider said we are over quota)"""
+        with self._changed:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self.pauses += 1
+
+    def stats(self):
+        with self._changed:
+            return {
+                "granted": self.granted,
+                "queued": sum(len(queue) for queue in self._queues.values()),
+                "avg_wait": self.total_wait / self.granted if self.granted else 0.0,
+                "pauses": self.pauses,
+            }
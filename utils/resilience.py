@@ -0,0 +1,262 @@
+"""
+Retries, deadlines and circuit breaking around LLM API calls
+Maps OpenAI SDK errors onto a small hierarchy of typed exceptions
+"""
+
+import asyncio
+import random
+import sys
+import threading
+import time
+
+
+class LLMError(Exception):
+    """Base class for chat API failures"""
+    retryable = False
+
+    def __init__(self, message, status_code=None):
+        super().__init__(f"API call failed: {message}")
+        self.status_code = status_code
+
+
+class LLMTimeoutError(LLMError):
+    """The request or the overall deadline timed out"""
+    retryable = True
+
+
+class RateLimitedError(LLMError):
+    """The provider returned 429; retry_after is the requested wait in seconds, if given"""
+    retryable = True
+
+    def __init__(self, message, status_code=429, retry_after=None):
+        super().__init__(message, status_code)
+        self.retry_after = retry_after
+
+
+class ProviderError(LLMError):
+    """Server-side (5xx) or connection failure"""
+    retryable = True
+
+
+class ClientRequestError(LLMError):
+    """The request itself was rejected (bad request, auth, not found...)"""
+
+
+class CircuitOpenError(LLMError):
+    """Calls are short-circuited after repeated provider failures"""
+
+
+def _retry_after_seconds(response):
+    if response is None:
+        return None
+    value = response.headers.get("retry-after")
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def classify_error(error):
+    """Convert any exception from the SDK into an LLMError subclass"""
+    if isinstance(error, LLMError):
+        return error
+    openai = sys.modules.get("openai")
+    if openai is None:
+        # The SDK was never imported, so this cannot be one of its errors
+        return LLMError(str(error))
+    if isinstance(error, openai.APITimeoutError):
+        return LLMTimeoutError(f"request timed out ({error})")
+    if isinstance(error, openai.APIConnectionError):
+        return ProviderError(f"connection error ({error})")
+    if isinstance(error, openai.RateLimitError):
+        return RateLimitedError(str(error), retry_after=_retry_after_seconds(error.response))
+    if isinstance(error, openai.APIStatusError):
+        status = error.status_code
+        if status >= 500 or status in (408, 409):
+            return ProviderError(str(error), status_code=status)
+        return ClientRequestError(str(error), status_code=status)
+    return LLMError(str(error))
+
+
+class RequestPacer:
+    """Spaces out async request starts and pauses everyone after a rate limit"""
+
+    def __init__(self, requests_per_second=None):
+        self.interval = 1.0 / requests_per_second if requests_per_second else 0.0
+        self.next_slot = 0.0
+        self.lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self.lock:
+            now = time.monotonic()
+            delay = self.next_slot - now
+            self.next_slot = max(now, self.next_slot) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def pause(self, seconds):
+        self.next_slot = max(self.next_slot, time.monotonic() + seconds)
+
+
+class RetryPolicy:
+    """Jittered exponential backoff bounded by per-attempt and total deadlines"""
+
+    def __init__(self, max_attempts=3, base_delay=0.5, max_delay=8.0, attempt_timeout=30.0, total_timeout=60.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.attempt_timeout = attempt_timeout
+        self.total_timeout = total_timeout
+
+    def backoff(self, attempt, error):
+        """Seconds to wait before the next attempt (attempt counts from 1)"""
+        retry_after = getattr(error, "retry_after", None)
+        if retry_after is not None:
+            return retry_after
+        # Full jitter keeps synchronized clients from retrying in lockstep
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+
+class CircuitBreaker:
+    """Fails fast after failure_threshold consecutive provider failures
+
+    After reset_timeout seconds one trial call is let through (half-open);
+    success closes the circuit again, failure re-opens it. A trial that ends
+    without a verdict (cancelled, or rate limited) is released so another
+    call can try.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def before_call(self):
+        """Raise CircuitOpenError unless a call may proceed; returns whether it is the half-open trial"""
+        with self._lock:
+            state = self._state()
+            if state == "closed":
+                return False
+            if state == "half-open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            remaining = max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+            raise CircuitOpenError(f"provider circuit open after {self.failures} failures, retry in {remaining:.0f}s")
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial_in_flight or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+    def release_trial(self):
+        """Let another call be the half-open trial; the circuit state is unchanged"""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def reset(self):
+        self.record_success()
+
+
+def _after_failure(error, attempt, policy, breaker, deadline, trial):
+    """Record the failure and return the delay before retrying, or raise"""
+    classified = classify_error(error)
+    if breaker is not None:
+        if isinstance(classified, RateLimitedError):
+            # Quota, not health: the rate limiter handles 429s, so they never open the circuit
+            if trial:
+                breaker.release_trial()
+        elif classified.retryable:
+            breaker.record_failure()
+        else:
+            # The provider answered; a rejected request says nothing about its health
+            breaker.record_success()
+    delay = policy.backoff(attempt, classified)
+    if not classified.retryable or attempt >= policy.max_attempts or time.monotonic() + delay >= deadline:
+        # Callers report how many attempts were spent on a request that failed
+        classified.attempts = attempt
+        if classified is error:
+            raise classified
+        raise classified from error
+    return delay
+
+
+def _attempt_timeout(policy, deadline):
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise LLMTimeoutError(f"total deadline of {policy.total_timeout}s exceeded")
+    return min(policy.attempt_timeout, remaining)
+
+
+def call_with_retries(fn, policy, breaker=None):
+    """Call fn(timeout) until it succeeds; returns (result, attempts)
+
+    Retries timeouts, 429s (honoring Retry-After) and 5xx/connection errors.
+    Client errors and an open circuit fail immediately.
+    """
+    deadline = time.monotonic() + policy.total_timeout
+    attempt = 0
+    while True:
+        attempt += 1
+        timeout = _attempt_timeout(policy, deadline)
+        trial = breaker.before_call() if breaker is not None else False
+        try:
+            result = fn(timeout)
+        except Exception as e:
+            delay = _after_failure(e, attempt, policy, breaker, deadline, trial)
+            time.sleep(delay)
+            continue
+        except BaseException:
+            # Cancelled (client gone, hedge lost...): a stuck trial would keep the circuit open for good
+            if trial:
+                breaker.release_trial()
+            raise
+        if breaker is not None:
+            breaker.record_success()
+        return result, attempt
+
+
+async def acall_with_retries(fn, policy, breaker=None):
+    """Async version of call_with_retries(); fn(timeout) returns an awaitable"""
+    deadline = time.monotonic() + policy.total_timeout
+    attempt = 0
+    while True:
+        attempt += 1
+        timeout = _attempt_timeout(policy, deadline)
+        trial = breaker.before_call() if breaker is not None else False
+        try:
+            result = await fn(timeout)
+        except Exception as e:
+            delay = _after_failure(e, attempt, policy, breaker, deadline, trial)
+            await asyncio.sleep(delay)
+            continue
+        except BaseException:
+            # Cancelled (client gone, hedge lost...): a stuck trial would keep the circuit open for good
+            if trial:
+                breaker.release_trial()
+            raise
+        if breaker is not None:
+            breaker.record_success()
+        return result, attempt
@@ -0,0 +1,133 @@
+"""
+Response cache for identical chat completion requests
+In-memory LRU tier with TTL and a size bound, plus an optional SQLite tier
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def make_cache_key(model, temperature, max_tokens, messages):
+    """Hash everything that determines a completion into a stable key"""
+    payload = json.dumps(
+        {
+            "model": model,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "messages": [{"role": m["role"], "content": m["content"]} for m in messages],
+        },
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """Thread-safe LRU + TTL cache of responses keyed by make_cache_key()
+
+    Entries older than ttl seconds are treated as missing. When db_path is
+    given, responses are also written to SQLite so they survive restarts;
+    disk hits are promoted back into the memory tier. Each write to disk
+    prunes expired rows and the oldest beyond max_disk_entries (default ten
+    times max_entries), so the file stays bounded too.
+    """
+
+    def __init__(self, max_entries=1000, ttl=24 * 3600, db_path=None, max_disk_entries=None):
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries if max_disk_entries is not None else 10 * max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, response TEXT NOT NULL, created REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS responses_created ON responses (created)")
+            self._db.commit()
+
+    def _is_fresh(self, created):
+        return self.ttl is None or time.time() - created < self.ttl
+
+    def get(self, key):
+        """Return the cached response for key, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and self._is_fresh(entry[1]):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry:
+                del self._entries[key]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT response, created FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+                if row and self._is_fresh(row[1]):
+                    self._store(key, row[0], row[1])
+                    self.hits += 1
+                    return row[0]
+
+            self.misses += 1
+            return None
+
+    def set(self, key, response):
+        """Cache a response under key"""
+        created = time.time()
+        with self._lock:
+            self._store(key, response, created)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses (key, response, created) VALUES (?, ?, ?)",
+                    (key, response, created),
+                )
+                self._prune_disk(created)
+                self._db.commit()
+
+    def _prune_disk(self, now):
+        if self.ttl is not None:
+            self._db.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+        self._db.execute(
+            "DELETE FROM responses WHERE key IN "
+            "(SELECT key FROM responses ORDER BY created DESC LIMIT -1 OFFSET ?)",
+            (self.max_disk_entries,),
+        )
+
+    def _store(self, key, response, created):
+        self._entries[key] = (response, created)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        """Drop all entries from both tiers and reset counters"""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+            if self._db is not None:
+                self._db.execute("DELETE FROM responses")
+                self._db.commit()
+
+    def stats(self):
+        """Get hit/miss counters and current memory tier size"""
+        with self._lock:
+            return {
+                "cache_hits": self.hits,
+                "cache_misses": self.misses,
+                "cache_entries": len(self._entries),
+            }
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
@@ -0,0 +1,245 @@
+"""
+Semantic cache for first-turn questions
+Questions are normalized to their content words, so "How do I start a
+business?" also answers "how to start a business" but never "how to start a
+podcast" or "Is Java faster than Python?" for "Is Python faster than Java?".
+With an embedding model, paraphrases ("how to start a company") are also
+looked up by cosine similarity in a vector index per persona.
+"""
+
+import importlib.util
+import re
+import threading
+import time
+
+# Small CPU sentence-embedding model used by local_embedder()
+DEFAULT_EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+# Function words carry little meaning and make unrelated questions look alike
+STOP_WORDS = frozenset(
+    "a an the i to do does did how what whats is are be can could should would you me my your "
+    "of for in on at and or with about it its that this please some".split()
+)
+
+_WORD_PATTERN = re.compile(r"[a-z0-9]+")
+_SUFFIXES = ("ing", "ed", "ies", "es", "s", "e", "ly")
+
+
+def _stem(word):
+    """Crude suffix stripping so "starting", "starts" and "start" normalize alike"""
+    for suffix in _SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[:-len(suffix)] + ("y" if suffix == "ies" else "")
+    return word
+
+
+def content_words(text):
+    """Stemmed words of text without function words, in order (all words if nothing else is left)"""
+    words = _WORD_PATTERN.findall(text.lower().replace("'", ""))
+    return [_stem(word) for word in words if word not in STOP_WORDS] or words
+
+
+def question_key(text):
+    """Normalized form of a question: its content words joined by spaces ("" when it has no words)"""
+    return " ".join(content_words(text))
+
+
+def local_embedder(model_name=DEFAULT_EMBEDDING_MODEL):
+    """embed_fn backed by a local sentence-transformers model, loaded on first use
+
+    Needs pip install sentence-transformers; the model is downloaded once and
+    runs on the CPU.
+    """
+    if importlib.util.find_spec("sentence_transformers") is None:
+        raise ValueError("Embedding models require sentence-transformers (pip install sentence-transformers)")
+    model = None
+    lock = threading.Lock()
+
+    def embed(text):
+        nonlocal model
+        with lock:
+            if model is None:
+                from sentence_transformers import SentenceTransformer
+                model = SentenceTransformer(model_name, device="cpu")
+        return model.encode(text, normalize_embeddings=True).astype("float32")
+
+    return embed
+
+
+class BruteForceIndex:
+    """Exact cosine search over unit vectors kept in one NumPy matrix
+
+    Any object with the same set()/search()/__len__ interface can be passed
+    to SemanticCache as an index_factory, e.g. HNSWIndex for large caches.
+    """
+
+    def __init__(self, dimensions, capacity):
+        import numpy as np
+
+        self._np = np
+        self._vectors = np.zeros((min(capacity, 1024), dimensions), dtype=np.float32)
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def set(self, slot, vector):
+        """Store vector under slot (slots are 0..capacity-1 and reused when the cache wraps)"""
+        if slot >= len(self._vectors):
+            grown = self._np.zeros((max(slot + 1, 2 * len(self._vectors)), self._vectors.shape[1]), dtype=self._np.float32)
+            grown[:self._size] = self._vectors[:self._size]
+            self._vectors = grown
+        self._vectors[slot] = vector
+        self._size = max(self._size, slot + 1)
+
+    def search(self, vector, k=1):
+        """Return up to k (slot, cosine similarity) pairs, best first"""
+        if not self._size:
+            return []
+        scores = self._vectors[:self._size] @ vector
+        k = min(k, self._size)
+        best = self._np.argpartition(-scores, k - 1)[:k]
+        best = best[self._np.argsort(-scores[best])]
+        return [(int(slot), float(scores[slot])) for slot in best]
+
+
+class HNSWIndex:
+    """Approximate nearest-neighbour index backed by hnswlib (pip install hnswlib)"""
+
+    def __init__(self, dimensions, capacity, ef=64, m=16):
+        import hnswlib
+
+        self._index = hnswlib.Index(space="ip", dim=dimensions)
+        self._index.init_index(max_elements=capacity, ef_construction=200, M=m)
+        self._index.set_ef(ef)
+
+    def __len__(self):
+        return self._index.get_current_count()
+
+    def set(self, slot, vector):
+        # Re-adding an existing label replaces its vector
+        self._index.add_items(vector.reshape(1, -1), [slot])
+
+    def search(self, vector, k=1):
+        k = min(k, len(self))
+        if not k:
+            return []
+        labels, distances = self._index.knn_query(vector.reshape(1, -1), k=k)
+        # hnswlib's "ip" distance is 1 - inner product
+        return [(int(slot), 1.0 - float(distance)) for slot, distance in zip(labels[0], distances[0])]
+
+
+class _Namespace:
+    """One persona/model's entries: a ring of slots, their normalized questions and a vector index"""
+
+    def __init__(self):
+        self.index = None  # built on the first vector, when there is an embed_fn
+        self.entries = {}  # slot -> (question, answer, created, key)
+        self.keys = {}  # question_key -> slot
+        self.next_slot = 0
+
+
+class SemanticCache:
+    """Thread-safe cache of answers keyed by question meaning
+
+    Entries live in namespaces (one per persona prompt + model settings), each
+    holding at most max_entries; when full, the oldest entry is overwritten.
+    lookup() first matches the question's normalized content words exactly
+    (a dict lookup). Only when embed_fn is given (a text -> unit vector
+    function such as local_embedder()) does it also search the vector index
+    built by index_factory(dimensions, capacity) and accept the closest
+    question with cosine similarity at least threshold and, if set,
+    verify(question, cached_question). Entries older than ttl are ignored.
+    """
+
+    def __init__(self, threshold=0.9, max_entries=10_000, ttl=24 * 3600,
+                 embed_fn=None, index_factory=BruteForceIndex, verify=None):
+        self.threshold = threshold
+        self.verify = verify
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.embed_fn = embed_fn
+        self.index_factory = index_factory
+        self._namespaces = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.lookup_time = 0.0
+
+    def _is_fresh(self, created):
+        return self.ttl is None or time.time() - created < self.ttl
+
+    def _count(self, match, start):
+        if match:
+            self.hits += 1
+        else:
+            self.misses += 1
+        self.lookup_time += time.perf_counter() - start
+        return match
+
+    def lookup(self, namespace_key, question):
+        """Return (answer, similarity) for the closest cached question, or None"""
+        start = time.perf_counter()
+        key = question_key(question)
+        with self._lock:
+            namespace = self._namespaces.get(namespace_key)
+            if namespace is None or not key:
+                return self._count(None, start)
+            slot = namespace.keys.get(key)
+            if slot is not None and self._is_fresh(namespace.entries[slot][2]):
+                return self._count((namespace.entries[slot][1], 1.0), start)
+            if self.embed_fn is None or namespace.index is None:
+                return self._count(None, start)
+
+        # Embedding is the slow part, so it runs outside the lock
+        vector = self.embed_fn(question)
+        with self._lock:
+            match = None
+            if namespace.index is not None:
+                # A few candidates, best first, in case the closest one is stale or fails verify
+                for slot, score in namespace.index.search(vector, k=3):
+                    cached_question, answer, created, _ = namespace.entries[slot]
+                    if (score >= self.threshold and self._is_fresh(created)
+                            and (self.verify is None or self.verify(question, cached_question))):
+                        match = (answer, score)
+                        break
+            return self._count(match, start)
+
+    def store(self, namespace_key, question, answer):
+        key = question_key(question)
+        if not key:
+            return
+        vector = self.embed_fn(question) if self.embed_fn is not None else None
+        with self._lock:
+            namespace = self._namespaces.get(namespace_key)
+            if namespace is None:
+                namespace = self._namespaces[namespace_key] = _Namespace()
+            slot = namespace.next_slot
+            namespace.next_slot = (slot + 1) % self.max_entries
+            evicted = namespace.entries.get(slot)
+            if evicted is not None and namespace.keys.get(evicted[3]) == slot:
+                del namespace.keys[evicted[3]]
+            namespace.entries[slot] = (question, answer, time.time(), key)
+            namespace.keys[key] = slot
+            if vector is not None:
+                if namespace.index is None:
+                    namespace.index = self.index_factory(len(vector), self.max_entries)
+                namespace.index.set(slot, vector)
+
+    def clear(self):
+        with self._lock:
+            self._namespaces.clear()
+            self.hits = 0
+            self.misses = 0
+            self.lookup_time = 0.0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "semantic_hits": self.hits,
+                "semantic_misses": self.misses,
+                "semantic_hit_rate": self.hits / lookups if lookups else 0.0,
+                "semantic_avg_lookup_ms": 1000 * self.lookup_time / lookups if lookups else 0.0,
+                "semantic_entries": sum(len(namespace.entries) for namespace in self._namespaces.values()),
+            }
@@ -0,0 +1,350 @@
+"""
+Single-flight coalescing of identical in-flight LLM requests
+Concurrent callers with the same request fingerprint share one upstream call;
+a streamed reply is read once and fanned out chunk by chunk to every caller.
+"""
+
+import asyncio
+import threading
+
+from utils.response_cache import make_cache_key
+
+
+def request_fingerprint(kwargs):
+    """Key for requests that would produce interchangeable replies"""
+    key = make_cache_key(kwargs["model"], kwargs["temperature"], kwargs["max_tokens"], kwargs["messages"])
+    return ("stream:" if kwargs.get("stream") else "call:") + key
+
+
+class StreamAbandoned(BaseException):
+    """Raised in a stream producer once every subscriber has left
+
+    A BaseException, like asyncio.CancelledError, so retry loops stop instead
+    of counting it as a failed attempt.
+    """
+
+
+class StreamMeta(dict):
+    """Details a stream producer reports to its subscribers (e.g. "attempts"), plus whether any are left
+
+    A sync producer calls check() before each upstream attempt and passes the
+    stream it opened to close_when_abandoned(), so a stream nobody reads any
+    more is neither retried nor read to the end.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.abandoned = threading.Event()
+        self._upstream = None
+        self._lock = threading.Lock()
+
+    def check(self):
+        if self.abandoned.is_set():
+            raise StreamAbandoned("every subscriber left")
+
+    def close_when_abandoned(self, upstream):
+        """Return upstream, closing it now or as soon as the last subscriber leaves"""
+        with self._lock:
+            self._upstream = upstream
+            abandoned = self.abandoned.is_set()
+        if abandoned:
+            upstream.close()
+        return upstream
+
+    def abandon(self):
+        with self._lock:
+            self.abandoned.set()
+            upstream = self._upstream
+        if upstream is not None:
+            # Unblocks the producer's read from another thread; it then ends with an error nobody sees
+            try:
+                upstream.close()
+            except Exception:
+                pass
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class _Broadcast:
+    """Chunks of one upstream stream, kept so late subscribers can replay them"""
+
+    def __init__(self):
+        self.chunks = []
+        # Filled in by the producer, e.g. {"attempts": 2}
+        self.meta = {}
+        self.finished = False
+        self.cancelled = False
+        self.error = None
+        self.subscribers = 0
+
+
+class SingleFlight:
+    """Thread-safe single-flight group for the sync chat paths
+
+    do() runs fn once per key no matter how many threads ask concurrently;
+    every caller gets the same result or the same exception. stream() runs
+    a chunk producer on a background thread and gives each caller its own
+    iterator over all chunks; when every subscriber has closed its iterator
+    the producer is stopped and its upstream stream closed (see StreamMeta).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+        self.upstream_calls = 0
+        self.coalesced_calls = 0
+
+    def do(self, key, fn):
+        """Return (fn() result, shared) where shared means another caller made the call"""
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.upstream_calls += 1
+            else:
+                self.coalesced_calls += 1
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, True
+        try:
+            flight.result = fn()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+        return flight.result, False
+
+    def stream(self, key, produce):
+        """Subscribe to the stream for key, starting produce(meta) if nobody is producing it yet
+
+        produce is a generator function; it receives the broadcast's meta dict
+        to report details such as the attempt count to all subscribers.
+        """
+        with self._lock:
+            broadcast = self._flights.get(key)
+            shared = broadcast is not None
+            if shared:
+                self.coalesced_calls += 1
+            else:
+                broadcast = self._flights[key] = _Broadcast()
+                broadcast.condition = threading.Condition()
+                broadcast.meta = StreamMeta()
+                self.upstream_calls += 1
+            broadcast.subscribers += 1
+        if not shared:
+            threading.Thread(target=self._pump, args=(key, broadcast, produce), daemon=True,
+                             name="single-flight").start()
+        return StreamSubscription(self, key, broadcast, shared)
+
+    def _pump(self, key, broadcast, produce):
+        condition = broadcast.condition
+        chunks = produce(broadcast.meta)
+        try:
+            for chunk in chunks:
+                with condition:
+                    if broadcast.cancelled:
+                        break
+                    broadcast.chunks.append(chunk)
+                    condition.notify_all()
+        except BaseException as e:
+            broadcast.error = e
+        finally:
+            chunks.close()
+            self._forget(key, broadcast)
+            with condition:
+                broadcast.finished = True
+                condition.notify_all()
+
+    def _forget(self, key, broadcast):
+        with self._lock:
+            if self._flights.get(key) is broadcast:
+                del self._flights[key]
+
+    def _unsubscribe(self, key, broadcast):
+        with self._lock:
+            broadcast.subscribers -= 1
+            abandoned = broadcast.subscribers == 0
+        if abandoned and not broadcast.finished:
+            # Nobody is listening any more: new callers must not join a stream that is being torn down
+            self._forget(key, broadcast)
+            with broadcast.condition:
+                broadcast.cancelled = True
+            broadcast.meta.abandon()
+
+
+class StreamSubscription:
+    """One caller's iterator over a shared stream, replaying chunks that arrived before it joined"""
+
+    def __init__(self, group, key, broadcast, shared):
+        self._group = group
+        self._key = key
+        self._broadcast = broadcast
+        self._index = 0
+        self._closed = False
+        self.shared = shared
+
+    @property
+    def meta(self):
+        return self._broadcast.meta
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        broadcast = self._broadcast
+        if not self._closed:
+            with broadcast.condition:
+                while self._index >= len(broadcast.chunks) and not broadcast.finished:
+                    broadcast.condition.wait()
+                if self._index < len(broadcast.chunks):
+                    self._index += 1
+                    return broadcast.chunks[self._index - 1]
+            self.close()
+            if broadcast.error is not None:
+                raise broadcast.error
+        raise StopIteration
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._group._unsubscribe(self._key, self._broadcast)
+
+
+class AsyncSingleFlight:
+    """Single-flight group for one event loop (the async chat paths)
+
+    The upstream call runs in its own task, so cancelling one waiter never
+    cancels the call for the others; it is cancelled only once every waiter
+    (or stream subscriber) is gone.
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self.upstream_calls = 0
+        self.coalesced_calls = 0
+
+    def _forget(self, key, flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    async def do(self, key, fn):
+        """Return (await fn() result, shared) where shared means another caller made the call"""
+        flight = self._flights.get(key)
+        shared = flight is not None
+        if shared:
+            self.coalesced_calls += 1
+        else:
+            flight = self._flights[key] = _Broadcast()
+            flight.task = asyncio.ensure_future(fn())
+            flight.task.add_done_callback(lambda task: self._finish_call(key, flight, task))
+            self.upstream_calls += 1
+        flight.subscribers += 1
+        try:
+            return await asyncio.shield(flight.task), shared
+        except asyncio.CancelledError:
+            if flight.subscribers == 1 and not flight.task.done():
+                self._forget(key, flight)
+                flight.task.cancel()
+            raise
+        finally:
+            flight.subscribers -= 1
+
+    def _finish_call(self, key, flight, task):
+        self._forget(key, flight)
+        if not task.cancelled():
+            # Mark the exception as retrieved even if every waiter was cancelled
+            task.exception()
+
+    def stream(self, key, produce):
+        """Subscribe to the stream for key, starting produce(meta) if nobody is producing it yet
+
+        produce is an async generator function; see SingleFlight.stream().
+        """
+        broadcast = self._flights.get(key)
+        shared = broadcast is not None
+        if shared:
+            self.coalesced_calls += 1
+        else:
+            broadcast = self._flights[key] = _Broadcast()
+            broadcast.changed = asyncio.Event()
+            broadcast.task = asyncio.ensure_future(self._pump(key, broadcast, produce))
+            self.upstream_calls += 1
+        broadcast.subscribers += 1
+        return AsyncStreamSubscription(self, key, broadcast, shared)
+
+    async def _pump(self, key, broadcast, produce):
+        chunks = produce(broadcast.meta)
+        try:
+            async for chunk in chunks:
+                broadcast.chunks.append(chunk)
+                self._notify(broadcast)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            broadcast.error = e
+        finally:
+            await chunks.aclose()
+            self._forget(key, broadcast)
+            broadcast.finished = True
+            self._notify(broadcast)
+
+    @staticmethod
+    def _notify(broadcast):
+        changed, broadcast.changed = broadcast.changed, asyncio.Event()
+        changed.set()
+
+    def _unsubscribe(self, key, broadcast):
+        broadcast.subscribers -= 1
+        if broadcast.subscribers == 0 and not broadcast.finished:
+            self._forget(key, broadcast)
+            broadcast.cancelled = True
+            broadcast.task.cancel()
+
+
+class AsyncStreamSubscription:
+    """Async counterpart of StreamSubscription"""
+
+    def __init__(self, group, key, broadcast, shared):
+        self._group = group
+        self._key = key
+        self._broadcast = broadcast
+        self._index = 0
+        self._closed = False
+        self.shared = shared
+
+    @property
+    def meta(self):
+        return self._broadcast.meta
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        broadcast = self._broadcast
+        while not self._closed:
+            if self._index < len(broadcast.chunks):
+                self._index += 1
+                return broadcast.chunks[self._index - 1]
+            if broadcast.finished:
+                await self.aclose()
+                if broadcast.error is not None:
+                    raise broadcast.error
+                break
+            await broadcast.changed.wait()
+        raise StopAsyncIteration
+
+    async def aclose(self):
+        if not self._closed:
+            self._closed = True
+            self._group._unsubscribe(self._key, self._broadcast)
@@ -0,0 +1,71 @@
+"""
+Rolling summary of messages that fell out of the context window
+Summaries are computed on a background thread, off the reply's critical path
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+# Shared by all sessions; summaries are small and infrequent
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="summarizer")
+
+
+class RollingSummarizer:
+    """Keeps a running summary of history[1:summarized_upto]
+
+    summarize_fn(previous_summary, new_messages) -> str does the folding, so a
+    stub can replace the model in tests. Only one update runs at a time per
+    summarizer; later evictions are picked up by the next update.
+    """
+
+    def __init__(self, summarize_fn):
+        self.summarize_fn = summarize_fn
+        self.summary = ""
+        self.summarized_upto = 1  # index into history; 0 is the system prompt
+        self._lock = threading.Lock()
+        self._pending = None
+        self._generation = 0
+
+    def summary_message(self):
+        """System message carrying the summary, or None before anything was summarized"""
+        with self._lock:
+            if not self.summary:
+                return None
+            return {"role": "system", "content": f"Summary of the earlier conversation: {self.summary}"}
+
+    def schedule(self, history, evicted_upto):
+        """Fold history[summarized_upto:evicted_upto] into the summary in the background"""
+        with self._lock:
+            if evicted_upto <= self.summarized_upto:
+                return
+            if self._pending is not None and not self._pending.done():
+                return
+            new_messages = history[self.summarized_upto:evicted_upto]
+            self._pending = _executor.submit(
+                self._fold, self.summary, new_messages, evicted_upto, self._generation
+            )
+
+    def _fold(self, previous_summary, new_messages, evicted_upto, generation):
+        try:
+            summary = self.summarize_fn(previous_summary, new_messages)
+        except Exception:
+            # Keep the old summary; the same messages are retried next turn
+            return
+        with self._lock:
+            if generation == self._generation:
+                self.summary = summary
+                self.summarized_upto = evicted_upto
+
+    def wait(self, timeout=None):
+        """Block until any in-flight update has finished"""
+        pending = self._pending
+        if pending is not None:
+            pending.result(timeout)
+
+    def reset(self):
+        """Forget the summary, e.g. when the history is cleared"""
+        with self._lock:
+            self._generation += 1
+            self.summary = ""
+            self.summarized_upto = 1
+            self._pending = None
@@ -0,0 +1,114 @@
+"""
+Token counting and token-budgeted context windows
+Uses tiktoken when installed, otherwise a ~4 characters/token estimate
+"""
+
+import math
+
+# Fixed per-message cost of role and separators in the chat format
+MESSAGE_OVERHEAD_TOKENS = 4
+
+_encoding = None
+
+
+def _get_encoding():
+    """Load the tiktoken encoding once; returns None when tiktoken is unavailable"""
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("o200k_base")
+        except Exception:
+            _encoding = False
+    return _encoding or None
+
+
+def count_tokens(text):
+    """Count tokens in text"""
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    return math.ceil(len(text) / 4)
+
+
+def message_tokens(message):
+    """Tokens a single chat message contributes to the prompt
+
+    A Message counts itself once and keeps the count (Message.tokens), so a
+    long history is not re-tokenized every turn; plain dicts are counted on
+    every call.
+    """
+    tokens = getattr(message, "tokens", None)
+    if tokens is not None:
+        return tokens
+    return count_message_tokens(message)
+
+
+def count_message_tokens(message):
+    """Count a chat message's tokens, without looking at any stored count"""
+    content = message["content"]
+    if not isinstance(content, str):
+        # Content parts, e.g. text marked with cache_control
+        content = "".join(part.get("text", "") for part in content)
+    return MESSAGE_OVERHEAD_TOKENS + count_tokens(content)
+
+
+def select_context_window(messages, max_tokens):
+    """Pick the system message plus the newest messages that fit max_tokens
+
+    The latest message is always kept even if it alone exceeds the budget.
+    Returns (window, evicted_count) where evicted_count is how many older
+    non-system messages were left out.
+    """
+    if not messages:
+        return [], 0
+
+    # Walk back from the end by index: slicing off the system message would copy the whole history
+    offset = 1 if messages[0]["role"] == "system" else 0
+    budget = max_tokens - (message_tokens(messages[0]) if offset else 0)
+
+    end = len(messages)
+    start = end
+    while start > offset:
+        cost = message_tokens(messages[start - 1])
+        if cost > budget and start < end:
+            break
+        budget -= cost
+        start -= 1
+
+    return list(messages[:offset]) + list(messages[start:]), start - offset
+
+
+def select_stable_window(messages, max_tokens, start=0, refill_ratio=0.5):
+    """Like select_context_window(), but the oldest kept message only moves in jumps
+
+    The window grows at the end until it no longer fits max_tokens; then start
+    jumps forward until the window fits refill_ratio * max_tokens. Between
+    jumps every request shares a byte-identical prefix that provider-side
+    prompt caching can reuse. start is the evicted_count returned by the
+    previous call; returns (window, evicted_count).
+    """
+    if not messages:
+        return [], 0
+
+    offset = 1 if messages[0]["role"] == "system" else 0
+    budget = max_tokens - (message_tokens(messages[0]) if offset else 0)
+    rest_length = len(messages) - offset
+    if start > rest_length:
+        # The history was replaced by a shorter one
+        start = 0
+
+    kept = list(messages[offset + start:])
+    total = sum(message_tokens(m) for m in kept)
+    if total > budget:
+        target = budget * refill_ratio
+        dropped = 0
+        while start < rest_length - 1 and total > target:
+            total -= message_tokens(kept[dropped])
+            dropped += 1
+            start += 1
+        kept = kept[dropped:]
+
+    return list(messages[:offset]) + kept, start